@@ -0,0 +1,114 @@
+"""
+Benchmark the Alpino parse interpretation (and csv conversion) against the previous implementation
+
+Usage: python -m benchmarks.alpino_interpret [--sentences N] [--repeat R]
+
+Generates an Alpino dependency triples result with N sentences (including some tokens with a POS tag that is not
+in POSMAP), checks that both implementations give identical output and reports the time of interpret_parse and
+of the csv conversion (best of R runs). Warnings are logged to /dev/null, as a worker would log them to a file.
+"""
+import argparse
+import csv
+import logging
+import os
+import time
+from io import StringIO
+
+from nlpipe.modules.alpino import AlpinoParser, POSMAP, get_fields, interpret_parse
+
+# lemma, word, major pos, relation, index of the parent (or None for the root)
+WORDS = [("de", "De", "det", "det", 2), ("minister", "minister", "noun", "su", 3),
+         ("zeggen", "zei", "verb", None, None), ("dat", "dat", "comp", "vc", 3),
+         ("het", "het", "det", "det", 6), ("kabinet", "kabinet", "noun", "su", 8),
+         ("morgen", "morgen", "adv", "mod", 8), ("vallen", "valt", "verb", "body", 4),
+         ("xyz", "xyz", "unknowntag", "mod", 8), (".", ".", "punct", "--", 3)]
+
+
+def generate(n_sentences):
+    """Generate an Alpino dependency triples result with n_sentences sentences"""
+    lines = []
+    for sid in range(1, n_sentences + 1):
+        for i, (lemma, word, pos, rel, parent) in enumerate(WORDS):
+            end = i + 1
+            token = "{lemma}|{word}|{i}|{end}|{pos}|{pos}|x".format(**locals())
+            if rel is None:
+                lines.append("top|top|0|0|top|top|top|top/hd|{token}|{sid}".format(**locals()))
+            else:
+                plemma, pword, ppos = WORDS[parent - 1][:3]
+                pbegin = parent - 1
+                head = "{plemma}|{pword}|{pbegin}|{parent}|{ppos}|{ppos}|x".format(**locals())
+                lines.append("{head}|hd/{rel}|{token}|{sid}".format(**locals()))
+    return "\n".join(lines)
+
+
+def interpret_parse_old(parse):
+    """The previous interpret_parse"""
+    def interpret_token(sid, lemma, word, begin, _end, major_pos, _pos, full_pos):
+        if major_pos not in POSMAP:
+            logging.warning("UNKNOWN POS: {major_pos}".format(**locals()))
+        pos1 = POSMAP.get(major_pos, '?')
+        return sid, int(begin), word, lemma, pos1
+
+    rels = {}  # child: (rel, parent)
+    for line in get_fields(parse):
+        assert len(line) == 16
+        sid = int(line[-1])
+        func, rel = line[7].split("/")
+        child = interpret_token(sid, *line[8:15])
+        if func == "top":
+            parent = None
+        else:
+            parent = interpret_token(sid, *line[:7])
+        rels[child] = (rel, parent)
+
+    tokens = sorted(rels.keys(), key=lambda token: token[:2])
+    tokenids = {token: i for (i, token) in enumerate(tokens)}
+
+    for token in tokens:
+        (rel, parent) = rels[token]
+        tokenid = tokenids[token]
+        parentid = tokenids[parent] if parent is not None else None
+        yield (tokenid, ) + token + (rel, parentid)
+
+
+def convert_old(id, result):
+    """The previous AlpinoParser.convert"""
+    s = StringIO()
+    w = csv.writer(s)
+    w.writerow(["doc", "id", "sentence", "offset", "word", "lemma", "pos", "rel", "parent"])
+    for line in interpret_parse_old(result):
+        w.writerow((id,) + line)
+    return s.getvalue()
+
+
+def convert_new(id, result):
+    return AlpinoParser().convert(id, result, "csv")
+
+
+def measure(function, parse, repeat):
+    """Get the result and the best time of repeat calls"""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(parse)
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(filename=os.devnull, format='[%(asctime)s %(name)-12s %(levelname)-5s] %(message)s')
+
+    parse = generate(args.sentences)
+    print("Document: {} sentences, {} tokens".format(args.sentences, args.sentences * len(WORDS)))
+    for name, old, new in [("interpret_parse", lambda p: list(interpret_parse_old(p)),
+                            lambda p: list(interpret_parse(p))),
+                           ("convert", lambda p: convert_old(1, p), lambda p: convert_new(1, p))]:
+        old_result, old_time = measure(old, parse, args.repeat)
+        new_result, new_time = measure(new, parse, args.repeat)
+        assert old_result == new_result, "Output of {name} differs".format(**locals())
+        print("{name}: old {:.3f}s, new {:.3f}s ({:.1f}x faster)"
+              .format(old_time, new_time, old_time / new_time, **locals()))
@@ -0,0 +1,181 @@
+"""
+Benchmark the streaming Alpino NAF csv converter against the previous KafNafParser based converter
+
+Usage: python -m benchmarks.alpinonaf_convert [--sentences N] [--repeat R]
+
+Generates a NAF document (with dependencies, constituency trees, entities and coreferences) with N sentences,
+checks that both implementations give identical output for alpinonerc and alpinocoref, and reports the time and
+the increase in peak resident memory of the conversion (measured in a fresh process, including the document). Requires KafNafParserPy.
+"""
+import argparse
+import csv
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO, BytesIO
+
+from KafNafParserPy import KafNafParser
+
+from nlpipe.modules.alpino import POSMAP
+from nlpipe.modules.alpinonaf import AlpinoNERCParser, AlpinoCorefPipe
+
+# word, lemma, pos, (relation, parent index) or None for the root
+WORDS = [("Mark", "Mark", "name", ("hd/su", 2)), ("Rutte", "Rutte", "name", ("mwp/mwp", 1)),
+         ("bezocht", "bezoeken", "verb", None), ("gisteren", "gisteren", "adv", ("hd/mod", 3)),
+         ("Amsterdam", "Amsterdam", "name", ("hd/obj1", 3)), (".", ".", "punct", ("--/--", 3))]
+
+
+def generate(n_sentences):
+    """Generate a NAF document with n_sentences sentences"""
+    text, terms, deps, trees, entities, corefs = [], [], [], [], [], []
+    offset = 0
+    for s in range(n_sentences):
+        first = s * len(WORDS) + 1
+        for i, (word, lemma, pos, dep) in enumerate(WORDS):
+            n = first + i
+            sent, para = s + 1, s // 10 + 1
+            length = len(word)
+            text.append('<wf id="w{n}" offset="{offset}" length="{length}" sent="{sent}" para="{para}">{word}</wf>\n'
+                        .format(**locals()))
+            terms.append('<term id="t_{n}" type="open" lemma="{lemma}" pos="{pos}" morphofeat="x">'
+                         '<span><target id="w{n}"/></span></term>\n'.format(**locals()))
+            if dep:
+                rfunc, parent = dep
+                parent += first - 1
+                deps.append('<dep from="t_{parent}" to="t_{n}" rfunc="{rfunc}"/>\n'
+                            .format(**locals()))
+            trees.append('<t id="ter{n}"><span><target id="t_{n}"/></span></t><nt id="nter{n}" label="{pos}"/>'
+                         '<edge id="tre{n}" from="ter{n}" to="nter{n}"/>\n'.format(**locals()))
+            offset += length + 1
+        second, loc, previous = first + 1, first + 4, first - len(WORDS)
+        entities.append('<entity id="e{s}" type="PER"><references><span><target id="t_{first}"/>'
+                        '<target id="t_{second}"/></span></references></entity>\n'.format(**locals()))
+        entities.append('<entity id="e{s}b" type="LOC"><references><span><target id="t_{loc}"/></span>'
+                        '</references></entity>\n'.format(**locals()))
+        if s:
+            corefs.append('<coref id="co{s}" type="entity"><span><target id="t_{first}" head="yes"/>'
+                          '<target id="t_{second}"/></span><span><target id="t_{previous}" head="yes"/></span>'
+                          '</coref>\n'.format(**locals()))
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<NAF xml:lang="nl" version="v3">\n<nafHeader/>\n'
+            '<text>\n{}</text>\n<terms>\n{}</terms>\n<deps>\n{}</deps>\n<constituency>\n<tree>\n{}</tree>\n'
+            '</constituency>\n<entities>\n{}</entities>\n<coreferences>\n{}</coreferences>\n</NAF>\n'
+            .format("".join(text), "".join(terms), "".join(deps), "".join(trees), "".join(entities),
+                    "".join(corefs)))
+
+
+def convert_kafnaf(id, result, coref=False):
+    """The KafNafParser based AlpinoClient.convert (with the AlpinoCorefPipe columns if coref is True)"""
+    def _int(x):
+        return None if x is None else int(x)
+
+    def _id_int(x):
+        return int(x.replace("t_", ""))
+
+    naf = KafNafParser(BytesIO(result.encode("utf-8")))
+    deps = {dep.get_to(): (dep.get_function(), dep.get_from()) for dep in naf.get_dependencies()}
+    entities, corefs = {}, {}
+    if coref:
+        for ent in naf.get_entities():
+            for ref in ent.get_references():
+                for span in ref:
+                    for target in span:
+                        entities[target.get_id()] = ent
+        for c in naf.get_corefs():
+            for span in c.get_spans():
+                corefs[span.get_id_head()] = c
+    tokendict = {token.get_id(): token for token in naf.get_tokens()}
+    s = StringIO()
+    w = csv.writer(s)
+    header = ["doc_id", "token_id", "para", "sentence", "offset", "token", "lemma", "POS", "pos1", "parent",
+              "relation"]
+    w.writerow(header + ["ner_id", "NER", "coref_id"] if coref else header)
+    for term in naf.get_terms():
+        for token in [tokendict[tid] for tid in term.get_span().get_span_ids()]:
+            tid, pos = term.get_id(), term.get_pos()
+            row = [id, _id_int(tid)] + [_int(x) for x in (token.get_para(), token.get_sent(), token.get_offset())]
+            row += [token.get_text(), term.get_lemma(), pos, POSMAP[pos]]
+            if tid in deps:
+                rel, parent = deps[tid]
+                row += [_id_int(parent), rel.split("/")[-1]]
+            else:
+                row += [None, None]
+            if coref:
+                ent = entities.get(tid)
+                row += [ent.get_id(), ent.get_type()] if ent else [None, None]
+                c = corefs.get(tid)
+                row += [c.get_id() if c else None]
+            w.writerow(row)
+    return s.getvalue()
+
+
+def convert_streaming(id, result, coref=False):
+    return (AlpinoCorefPipe() if coref else AlpinoNERCParser()).convert(id, result, "csv")
+
+
+CONVERTERS = {"KafNafParser": convert_kafnaf, "streaming": convert_streaming}
+
+
+def peak_memory(converter, filename, coref):
+    """Convert the document in filename and print the increase in peak resident memory (in bytes),
+    sampled before the document is read so it includes the document itself"""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(filename, encoding="utf-8") as f:
+        naf = f.read()
+    CONVERTERS[converter](1, naf, coref)
+    print((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024)
+
+
+def _run(*args):
+    return subprocess.run([sys.executable, "-m", "benchmarks.alpinonaf_convert"] + list(args),
+                          stdout=subprocess.PIPE, check=True).stdout
+
+
+def measure_memory(converter, filename, coref):
+    """Measure the peak memory of a conversion in a fresh process.
+    As the peak memory of a process is inherited by its children, this should be called before the
+    document is generated or loaded in this process"""
+    return int(_run("--memory", converter, "--file", filename, *(["--coref"] if coref else [])))
+
+
+def measure(converter, naf, coref, repeat):
+    convert = CONVERTERS[converter]
+    start = time.perf_counter()
+    for i in range(repeat):
+        result = convert(1, naf, coref)
+    return result, (time.perf_counter() - start) / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", choices=list(CONVERTERS), help=argparse.SUPPRESS)
+    parser.add_argument("--file", help=argparse.SUPPRESS)
+    parser.add_argument("--coref", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.memory:
+        peak_memory(args.memory, args.file, args.coref)
+        sys.exit()
+    if args.file:
+        with open(args.file, "w", encoding="utf-8") as f:
+            f.write(generate(args.sentences))
+        sys.exit()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, "document.naf")
+        _run("--file", filename, "--sentences", str(args.sentences))
+        peaks = {(converter, coref): measure_memory(converter, filename, coref)
+                 for converter in CONVERTERS for coref in (False, True)}
+        with open(filename, encoding="utf-8") as f:
+            naf = f.read()
+    print("Document: {} sentences, {:.1f} MB".format(args.sentences, len(naf) / 1e6))
+    for name, coref in [("alpinonerc", False), ("alpinocoref", True)]:
+        old_result, old_time = measure("KafNafParser", naf, coref, args.repeat)
+        new_result, new_time = measure("streaming", naf, coref, args.repeat)
+        assert old_result == new_result, "Output of {name} differs".format(**locals())
+        old_peak, new_peak = peaks["KafNafParser", coref], peaks["streaming", coref]
+        print("{name}: KafNafParser {:.3f}s, {:.1f} MB peak; streaming {:.3f}s, {:.1f} MB peak ({:.1f}x faster)"
+              .format(old_time, old_peak / 1e6, new_time, new_peak / 1e6, old_time / new_time, **locals()))
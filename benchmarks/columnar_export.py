@@ -0,0 +1,94 @@
+"""
+Benchmark loading a merged export of token tables as csv and in the columnar formats
+
+Usage: python -m benchmarks.columnar_export [--documents N] [--sentences S]
+
+Generates N Alpino results of S sentences, merges their csv and arrow conversions into a single export as
+the export/csv and export/<format> endpoints do, and reports the size of each export and the time to load it
+into typed columns: with the python csv module (converting the integer columns), with the (much faster)
+pyarrow csv reader, and from the arrow and parquet exports. Requires pyarrow.
+"""
+import argparse
+import csv
+import time
+from io import BytesIO, StringIO
+
+import pyarrow.csv
+
+from nlpipe import columnar
+from nlpipe.client import _merge_csv
+from nlpipe.modules.alpino import AlpinoParser
+
+# lemma, word, major pos, relation, index of the parent (or None for the root)
+WORDS = [("Mark", "Mark", "name", "su", 2), ("bezoeken", "bezocht", "verb", None, None),
+         ("gisteren", "gisteren", "adv", "mod", 2), ("Amsterdam", "Amsterdam", "name", "obj1", 2)]
+
+
+def generate(n_sentences):
+    """Generate an Alpino dependency triples result with n_sentences sentences"""
+    lines = []
+    for sid in range(1, n_sentences + 1):
+        for i, (lemma, word, pos, rel, parent) in enumerate(WORDS):
+            end = i + 1
+            token = "{lemma}|{word}|{i}|{end}|{pos}|{pos}|x".format(**locals())
+            if rel is None:
+                lines.append("top|top|0|0|top|top|top|top/hd|{token}|{sid}".format(**locals()))
+            else:
+                plemma, pword, ppos = WORDS[parent - 1][:3]
+                pbegin = parent - 1
+                head = "{plemma}|{pword}|{pbegin}|{parent}|{ppos}|{ppos}|x".format(**locals())
+                lines.append("{head}|hd/{rel}|{token}|{sid}".format(**locals()))
+    return "\n".join(lines)
+
+
+def load_csv(data):
+    """Load the csv into a list per column, converting the integer columns as a typed table would"""
+    reader = csv.reader(StringIO(data.decode("utf-8")))
+    header = next(reader)
+    columns = [list(column) for column in zip(*reader)]
+    for i, (_name, type) in enumerate(AlpinoParser.table_schema):
+        if type == columnar.INT:
+            columns[i] = [int(x) if x else None for x in columns[i]]
+    return dict(zip(header, columns))
+
+
+def load_pyarrow_csv(data):
+    return pyarrow.csv.read_csv(BytesIO(data))
+
+
+LOADERS = [("csv (python csv module)", "csv", load_csv),
+           ("csv (pyarrow csv reader)", "csv", load_pyarrow_csv),
+           ("arrow", "arrow", columnar.decode),
+           ("parquet", "parquet", lambda data: columnar.decode(data, "parquet"))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10000)
+    parser.add_argument("--sentences", type=int, default=20)
+    args = parser.parse_args()
+
+    module = AlpinoParser()
+    result = generate(args.sentences)
+    ids = ["0x{:032x}".format(i) for i in range(args.documents)]
+    start = time.perf_counter()
+    csvs = [(id, module.convert(id, result, "csv"), None) for id in ids]
+    csv_time = time.perf_counter() - start
+    start = time.perf_counter()
+    arrows = [(id, module.convert(id, result, "arrow"), None) for id in ids]
+    arrow_time = time.perf_counter() - start
+    print("Converting {args.documents} documents: csv {csv_time:.2f}s, arrow {arrow_time:.2f}s".format(**locals()))
+
+    exports = {"csv": b"".join(_merge_csv("alpino", csvs))}
+    for format in columnar.FORMATS:
+        start = time.perf_counter()
+        exports[format] = b"".join(columnar.merge(module.table_schema, arrows, format))
+        merge_time = time.perf_counter() - start
+        print("Merging the {format} export: {merge_time:.2f}s".format(**locals()))
+    n_rows = len(WORDS) * args.sentences * args.documents
+    for name, format, load in LOADERS:
+        start = time.perf_counter()
+        load(exports[format])
+        load_time = time.perf_counter() - start
+        print("Loading {n_rows} rows from {name} ({size:.1f} MB): {load_time:.3f}s"
+              .format(size=len(exports[format]) / 1e6, **locals()))
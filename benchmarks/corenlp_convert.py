@@ -0,0 +1,108 @@
+"""
+Benchmark the streaming CoreNLP csv converters against the previous corenlp_xml based converters
+
+Usage: python -m benchmarks.corenlp_convert [--sentences N] [--repeat R]
+
+Generates a CoreNLP xml document with N sentences, checks that both implementations give identical output,
+and reports the time and peak (python) memory of the conversion. Requires corenlp_xml.
+"""
+import argparse
+import csv
+import time
+import tracemalloc
+from io import StringIO
+
+from corenlp_xml.document import Document
+
+from nlpipe.modules.corenlp import CoreNLPParser, CoreNLPLemmatizer, POSMAP
+
+WORDS = [("The", "the", "DT", "O"), ("president", "president", "NN", "O"), ("of", "of", "IN", "O"),
+         ("France", "France", "NNP", "LOCATION"), ("visited", "visit", "VBD", "O"),
+         ("Amsterdam", "Amsterdam", "NNP", "LOCATION"), ("yesterday", "yesterday", "NN", "DATE"), (".", ".", ".", "O")]
+
+
+def generate(n_sentences):
+    """Generate a CoreNLP xml document with n_sentences sentences"""
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<root>\n<document>\n<sentences>\n']
+    offset = 0
+    for s in range(1, n_sentences + 1):
+        out.append('<sentence id="{s}">\n<tokens>\n'.format(**locals()))
+        for i, (word, lemma, pos, ner) in enumerate(WORDS, start=1):
+            end = offset + len(word)
+            out.append('<token id="{i}"><word>{word}</word><lemma>{lemma}</lemma>'
+                       '<CharacterOffsetBegin>{offset}</CharacterOffsetBegin><CharacterOffsetEnd>{end}'
+                       '</CharacterOffsetEnd><POS>{pos}</POS><NER>{ner}</NER></token>\n'.format(**locals()))
+            offset = end + 1
+        out.append('</tokens>\n<dependencies type="collapsed-ccprocessed-dependencies">\n')
+        out.append('<dep type="root"><governor idx="0">ROOT</governor><dependent idx="5">visited</dependent></dep>\n')
+        for i, (rel, gov) in enumerate([("det", 2), ("nsubj", 5), ("case", 4), ("nmod:of", 2), (None, None),
+                                         ("dobj", 5), ("nmod:tmod", 5), ("punct", 5)], start=1):
+            if rel:
+                out.append('<dep type="{rel}"><governor idx="{gov}">x</governor><dependent idx="{i}">x</dependent>'
+                           '</dep>\n'.format(**locals()))
+        out.append('</dependencies>\n</sentence>\n')
+    out.append('</sentences>\n</document>\n</root>\n')
+    return "".join(out)
+
+
+def parse_dom(id, result):
+    """The corenlp_xml based CoreNLPParser.convert"""
+    doc = Document(result.encode("utf-8"))
+    s = StringIO()
+    w = csv.writer(s)
+    w.writerow(["doc_id", "sentence", "token_id", "offset", "token", "lemma", "POS", "pos1", "NER",
+                "relation", "parent"])
+    parents = {}
+    for sent in doc.sentences:
+        if sent.collapsed_ccprocessed_dependencies:
+            for dep in sent.collapsed_ccprocessed_dependencies.links:
+                if dep.type != 'root':
+                    parents[sent.id, dep.dependent.idx] = (dep.type, dep.governor.idx)
+    for sent in doc.sentences:
+        for t in sent.tokens:
+            rel, parent = parents.get((sent.id, t.id), (None, None))
+            w.writerow([id, sent.id, t.id, t.character_offset_begin, t.word, t.lemma,
+                        t.pos, POSMAP[t.pos], t.ner, rel, parent])
+    return s.getvalue()
+
+
+def lemmatize_dom(id, result):
+    """The corenlp_xml based CoreNLPLemmatizer.convert"""
+    doc = Document(result.encode("utf-8"))
+    s = StringIO()
+    w = csv.writer(s)
+    w.writerow(["id", "sentence", "offset", "word", "lemma", "POS", "pos1", "ner"])
+    for sent in doc.sentences:
+        for t in sent.tokens:
+            w.writerow([id, sent.id, t.character_offset_begin, t.word, t.lemma, t.pos, POSMAP[t.pos], t.ner])
+    return s.getvalue()
+
+
+def measure(convert, xml, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        result = convert(1, xml)
+    duration = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    convert(1, xml)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    xml = generate(args.sentences)
+    print("Document: {} sentences, {:.1f} MB".format(args.sentences, len(xml) / 1e6))
+    for name, old, new in [("corenlp_parse", parse_dom, lambda id, xml: CoreNLPParser().convert(id, xml, "csv")),
+                           ("corenlp_lemmatize", lemmatize_dom,
+                            lambda id, xml: CoreNLPLemmatizer().convert(id, xml, "csv"))]:
+        old_result, old_time, old_peak = measure(old, xml, args.repeat)
+        new_result, new_time, new_peak = measure(new, xml, args.repeat)
+        assert old_result == new_result, "Output of {name} differs".format(**locals())
+        print("{name}: corenlp_xml {:.3f}s, {:.1f} MB peak; streaming {:.3f}s, {:.1f} MB peak ({:.1f}x faster)"
+              .format(old_time, old_peak / 1e6, new_time, new_peak / 1e6, old_time / new_time, **locals()))
@@ -0,0 +1,81 @@
+"""
+Benchmark the template based NAF serialization of nlpamcat against the previous KafNafParser based serialization
+
+Usage: python -m benchmarks.nlpamcat_naf [--articles N]
+
+Generates N random articles (with markup characters, CDATA terminators and optional metadata), checks that both
+implementations give identical documents and reports the time per article. Requires KafNafParserPy and amcatclient.
+"""
+import argparse
+import random
+import time
+from io import BytesIO
+
+from KafNafParserPy import KafNafParser, CfileDesc, CHeader
+
+from nlpipe.nlpamcat import _get_text, _normalize
+
+WORDS = ["de", "krant", "&", "<b>", "]]>", '"quote"', "'s", "café", "\t", "\n", "\n\n", "€", "𝄞"]
+
+
+def get_naf_kafnaf(a, lang='nl'):
+    """The KafNafParser based nlpamcat._get_text(a, to_naf=True)"""
+    result = "\n\n".join([_normalize(a[x]) for x in ('headline', 'text')])
+    naf = KafNafParser(type="NAF")
+    naf.header = CHeader(type=naf.type)
+    naf.root.insert(0, naf.header.get_node())
+    naf.set_language(lang)
+    naf.set_raw(result)
+    naf.set_version("3.0")
+    fd = CfileDesc()
+    if 'author' in a:
+        fd.set_author(a['author'])
+    if 'headline' in a:
+        fd.set_title(a['headline'])
+    if 'date' in a:
+        fd.set_creationtime(a['date'])
+    if 'medium' in a:
+        fd.set_magazine(a['medium'])
+    if 'page' in a:
+        fd.set_pages(str(a['page']))
+    if 'section' in a:
+        fd.set_section(a['section'])
+    naf.header.set_fileDesc(fd)
+    naf.header.set_publicId(a['uuid'])
+    b = BytesIO()
+    naf.dump(b)
+    return b.getvalue().decode("utf-8")
+
+
+def generate(n, seed=1):
+    rnd = random.Random(seed)
+
+    def text(n_words):
+        return " ".join(rnd.choice(WORDS) for _ in range(n_words))
+    for i in range(n):
+        a = dict(id=i, headline=text(8), text=text(rnd.randint(0, 500)), uuid="uuid-{i}".format(**locals()))
+        for field in ("author", "date", "medium", "section"):
+            if rnd.random() < .7:
+                a[field] = text(3)
+        if rnd.random() < .7:
+            a['page'] = rnd.randint(0, 100)
+        yield a
+
+
+def measure(get_naf, articles):
+    start = time.perf_counter()
+    result = [get_naf(a) for a in articles]
+    return result, (time.perf_counter() - start) / len(articles)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=5000)
+    args = parser.parse_args()
+
+    articles = list(generate(args.articles))
+    old_result, old_time = measure(get_naf_kafnaf, articles)
+    new_result, new_time = measure(lambda a: _get_text(a, to_naf=True), articles)
+    assert old_result == new_result, "Output differs"
+    print("{} articles: KafNafParser {:.1f}us, template {:.1f}us per article ({:.1f}x faster)"
+          .format(args.articles, old_time * 1e6, new_time * 1e6, old_time / new_time))
@@ -0,0 +1,229 @@
+"""
+Routing of module requests over one or more backend servers
+
+The environment variables that point modules at their backend (e.g. CORENLP_HOST or ALPINO_SERVER)
+can contain a comma separated list of endpoints, e.g. CORENLP_HOST=http://corenlp1:9000,http://corenlp2:9000
+
+Every request is routed to the healthy backend with the fewest requests in flight,
+using the (exponentially weighted moving average) latency to break ties.
+A backend that cannot be reached is ejected for eject_timeout seconds, after which requests are routed
+to it again to re-probe it. Every consecutive failure doubles the time it stays ejected.
+
+The number of concurrent requests per backend can be limited for all worker processes on a host
+(see Module.max_concurrency). This uses a HostSemaphore of lock files in NLPIPE_LOCK_DIR (default: a
+nlpipe-locks folder in the temp dir), so a crashed worker process automatically releases its slot.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Optional
+
+import requests
+
+# Exceptions that indicate that the backend itself (rather than the document) is the problem
+BACKEND_ERRORS = (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
+
+class Backend(object):
+    """A single backend endpoint and its load/health statistics"""
+
+    def __init__(self, url):
+        self.url = url
+        self.inflight = 0
+        self.latency = None  # EWMA of request duration in seconds
+        self.failures = 0  # consecutive failures
+        self.ejected_until = 0
+
+    def is_healthy(self, now=None):
+        return self.ejected_until <= (time.time() if now is None else now)
+
+    def __repr__(self):
+        return "<Backend {self.url} inflight={self.inflight} latency={self.latency} failures={self.failures}>"\
+            .format(**locals())
+
+
+class HostSemaphore(object):
+    """
+    Counting semaphore shared by all processes on this host.
+    Each of the size slots is a lock file which is held with flock while the slot is in use.
+    """
+    poll_interval = 0.05
+
+    def __init__(self, name: str, size: int, lock_dir: str=None):
+        if lock_dir is None:
+            lock_dir = os.environ.get("NLPIPE_LOCK_DIR", os.path.join(tempfile.gettempdir(), "nlpipe-locks"))
+        os.makedirs(lock_dir, exist_ok=True)
+        prefix = os.path.join(lock_dir, hashlib.md5(name.encode("utf-8")).hexdigest())
+        self.name = name
+        self.filenames = ["{}.{}".format(prefix, i) for i in range(size)]
+
+    def try_acquire(self):
+        """Acquire a free slot without blocking, returning the (open) slot file or None if all slots are taken"""
+        start = random.randrange(len(self.filenames))  # spread contention over the slots
+        for fn in self.filenames[start:] + self.filenames[:start]:
+            slot = open(fn, "a")
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                slot.close()
+                continue
+            return slot
+        return None
+
+    @staticmethod
+    def release(slot):
+        fcntl.flock(slot, fcntl.LOCK_UN)
+        slot.close()
+
+    @contextmanager
+    def acquire(self):
+        """Context manager that blocks until a slot is free and holds it until the body is done"""
+        slot = self.try_acquire()
+        while slot is None:
+            time.sleep(self.poll_interval)
+            slot = self.try_acquire()
+        try:
+            yield
+        finally:
+            self.release(slot)
+
+
+class BackendPool(object):
+    """Least-loaded routing with ejection of failing backends over a list of endpoints"""
+
+    def __init__(self, endpoints: Iterable[str], eject_timeout=10, max_eject_timeout=300, alpha=0.3,
+                 max_concurrency: Optional[int]=None):
+        """
+        :param endpoints: The backend urls or host:port strings
+        :param eject_timeout: Seconds to eject a backend after its first failure
+        :param max_eject_timeout: Maximum number of seconds to eject a backend
+        :param alpha: Weight of the latest request in the latency moving average
+        :param max_concurrency: Maximum number of concurrent requests per backend from this host (None: unlimited)
+        """
+        self.backends = [Backend(url) for url in endpoints]
+        if not self.backends:
+            raise ValueError("No backend endpoints given")
+        self.eject_timeout = eject_timeout
+        self.max_eject_timeout = max_eject_timeout
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.semaphores = None
+        if max_concurrency:
+            self.semaphores = {b.url: HostSemaphore(b.url, max_concurrency) for b in self.backends}
+
+    @property
+    def urls(self) -> List[str]:
+        return [b.url for b in self.backends]
+
+    def ranked(self) -> List[Backend]:
+        """Rank the healthy backends by load, or all backends by when they will be re-probed if none are healthy"""
+        now = time.time()
+        healthy = [b for b in self.backends if b.is_healthy(now)]
+        if not healthy:
+            return sorted(self.backends, key=lambda b: b.ejected_until)
+        random.shuffle(healthy)  # break remaining ties randomly
+        return sorted(healthy, key=lambda b: (b.inflight, b.latency or 0))
+
+    def choose(self) -> Backend:
+        """Choose the healthy backend with the lowest load, or the first to be re-probed if none are healthy"""
+        return self.ranked()[0]
+
+    def _acquire_slot(self):
+        """Wait until one of the backends has a free slot (in order of preference) and return (backend, slot)"""
+        while True:
+            with self.lock:
+                ranked = self.ranked()
+            for backend in ranked:
+                slot = self.semaphores[backend.url].try_acquire()
+                if slot is not None:
+                    return backend, slot
+            time.sleep(HostSemaphore.poll_interval)
+
+    def success(self, backend: Backend, duration: float):
+        with self.lock:
+            if backend.failures:
+                logging.info("Backend {backend.url} is available again".format(**locals()))
+            backend.failures = 0
+            backend.ejected_until = 0
+            if backend.latency is None:
+                backend.latency = duration
+            else:
+                backend.latency = self.alpha * duration + (1 - self.alpha) * backend.latency
+
+    def failure(self, backend: Backend):
+        with self.lock:
+            timeout = min(self.max_eject_timeout, self.eject_timeout * 2 ** backend.failures)
+            backend.failures += 1
+            backend.ejected_until = time.time() + timeout
+        logging.warning("Backend {backend.url} failed ({backend.failures} times in a row), ejecting it for "
+                        "{timeout} seconds".format(**locals()))
+
+    @contextmanager
+    def request(self):
+        """
+        Context manager that chooses a backend and yields its url, keeping track of the load and
+        latency of the backend and ejecting it if the body raises one of the BACKEND_ERRORS.
+        If max_concurrency is set, this blocks until a backend has a free slot.
+        """
+        slot = None
+        if self.semaphores:
+            backend, slot = self._acquire_slot()
+            with self.lock:
+                backend.inflight += 1
+        else:
+            with self.lock:
+                backend = self.choose()
+                backend.inflight += 1
+        start = time.time()
+        try:
+            yield backend.url
+        except BACKEND_ERRORS:
+            self.failure(backend)
+            raise
+        else:
+            self.success(backend, time.time() - start)
+        finally:
+            with self.lock:
+                backend.inflight -= 1
+            if slot is not None:
+                HostSemaphore.release(slot)
+
+    def check(self, probe: Callable[[str], None]):
+        """
+        Probe all backends with the given function, which should raise an exception if a backend is not available.
+        Failing backends are ejected; raises an exception if no backend is available
+        """
+        errors = []
+        for backend in self.backends:
+            start = time.time()
+            try:
+                probe(backend.url)
+            except Exception as e:
+                self.failure(backend)
+                errors.append("{backend.url}: {e}".format(**locals()))
+            else:
+                self.success(backend, time.time() - start)
+        if len(errors) == len(self.backends):
+            raise Exception("No backend available: {}".format("; ".join(errors)))
+
+
+_POOLS = {}  # (pid, endpoints, max_concurrency) : BackendPool
+
+
+def get_backends(endpoints: str, max_concurrency: Optional[int]=None) -> BackendPool:
+    """
+    Get the backend pool for a comma separated list of endpoints.
+    Pools are kept per process, so their statistics survive across module instances but are not shared
+    between (forked) worker processes. The max_concurrency limit is shared by all processes on this host.
+    """
+    key = (os.getpid(), endpoints, max_concurrency)
+    if key not in _POOLS:
+        _POOLS[key] = BackendPool((e.strip().rstrip("/") for e in endpoints.split(",") if e.strip()),
+                                  max_concurrency=max_concurrency)
+    return _POOLS[key]
@@ -1,17 +1,25 @@
+import fcntl
+import bisect
 import hashlib
+import heapq
 import json
+import re
 import time
 import os.path
 import errno
 import logging
 import subprocess
+import tempfile
 
 import itertools
+from collections import deque
 from urllib.parse import urlencode
 
 import requests
 
 from nlpipe.module import Module, get_module, known_modules
+from nlpipe import columnar, transport
+from nlpipe.convert import Converted, convert_all
 
 # Status definitions and subdir names
 
@@ -20,6 +28,35 @@ STATUS = {"PENDING": "queue",
           "DONE": "results",
           "ERROR": "errors"}
 
+# Subdir for the leases of STARTED tasks (and attempt counters of requeued tasks)
+LEASES = "leases"
+
+# Subdir for the priority queue index, containing a <priority>/<job>/<deadline>_<sequence>_<id> ticket per PENDING task
+INDEX = "index"
+
+# Subdir for the ids, status counters and scheduling weight per job
+JOBS = "jobs"
+
+# Subdir for the names of the jobs each task was submitted with
+JOBMAP = "jobmap"
+
+# Subdir for cached converted results, containing a <format>/<id> file per converted result
+CONVERTED = "converted"
+
+# Subdir for results converted by workers right after processing (see Module.eager_formats), containing a
+# <format>/<id> file per converted result. Unlike the cache, these are kept until the result is stored again.
+MATERIALIZED = "materialized"
+
+# Dir (in the storage root, shared by all modules) for the input documents, containing a <get_id(doc)> file per
+# document that the queue and inprogress files of each module are hard links to
+BLOBS = "blobs"
+
+# Job of tasks that were submitted without a job
+DEFAULT_JOB = "default"
+
+# Default priority of documents submitted with process_inline (other documents have priority 0)
+INLINE_PRIORITY = 10
+
 
 def get_id(doc):
     """
@@ -36,21 +73,113 @@ def get_id(doc):
     m.update(doc)
     return "0x" + m.hexdigest()
 
+def parse_pipelines(spec: str) -> dict:
+    """
+    Parse a comma separated list of pipelines such as "alpinonerc->corefnl, alpino->frog->parzu"
+    :return: a {module: [downstream modules]} dict
+    """
+    pipelines = {}
+    for pipeline in spec.split(","):
+        if not pipeline.strip():
+            continue
+        modules = [module.strip() for module in pipeline.split("->")]
+        if len(modules) < 2 or not all(modules):
+            raise ValueError("Invalid pipeline: {pipeline!r}".format(**locals()))
+        for upstream, downstream in zip(modules, modules[1:]):
+            get_module(upstream), get_module(downstream)  # check if modules exist
+            pipelines.setdefault(upstream, []).append(downstream)
+    return pipelines
+
+
+def _job_summary(counters):
+    """Compute the status summary of a job from its counters"""
+    result = {status: counters.get(status, 0) for status in STATUS}
+    result['total'] = sum(result.values())
+    result['throughput'], result['eta'] = None, None
+    completed = counters.get('completed', 0)
+    if completed > 1:
+        duration = counters['last_completed'] - counters['first_completed']
+        if duration > 0:
+            result['throughput'] = (completed - 1) / duration
+            result['eta'] = (result['PENDING'] + result['STARTED']) / result['throughput']
+    return result
+
+
+def _check_job(job):
+    """Check whether the job name can be used as a file name"""
+    if job is not None and not re.match(r"^[\w-][\w.-]*$", job):
+        raise ValueError("Invalid job name: {job!r}".format(**locals()))
+
+
 class Client(object):
     """Abstract class for NLPipe client bindings"""
 
-    def process(self, module, doc, id=None, reset_error=False, reset_pending=False):
+    def process(self, module, doc, id=None, reset_error=False, reset_pending=False, priority=0, deadline=None,
+                job=None):
         """Add a document to be processed by module, returning the task ID
+        Tasks with a higher priority are processed first. Within a priority, tasks are processed from each
+        job in turn (weighted by job weight, see set_job_weight) and within a job by earliest deadline.
         :param module: Module name
         :param doc: A document (string)
         :param id: An optional id for the task
         :param reset_error: Re-assign documents that have status 'ERROR'
         :param reset_pending: Re-assign documents that have status 'PENDING'
+        :param priority: Priority of the task (integer, default 0)
+        :param deadline: Optional deadline of the task (unix timestamp)
+        :param job: Optional job or tenant name (letters, digits, _ . -) for fair scheduling
         :return: task ID
         :rtype: str
         """
         raise NotImplementedError()
 
+    def process_modules(self, modules, doc, id=None, **kargs):
+        """
+        Add a document to the processing queue of each of the modules, see process.
+        The document is only sent (and stored) once.
+        :param modules: Module names
+        :param kargs: Additional options to pass to process
+        :return: task ID
+        """
+        for module in modules:
+            id = self.process(module, doc, id=id, **kargs)
+        return id
+
+    def set_job_weight(self, module, job, weight):
+        """
+        Set the scheduling weight of a job, i.e. its share of the processing relative to other jobs (default 1)
+        :param module: Module name
+        :param job: Job name
+        :param weight: weight (number)
+        """
+        raise NotImplementedError()
+
+    def jobs(self, module):
+        """
+        Get the names of all jobs for this module
+        :param module: Module name
+        :return: a list of job names
+        """
+        raise NotImplementedError()
+
+    def job_status(self, module, job):
+        """
+        Get the progress of a job without checking every task
+        :param module: Module name
+        :param job: Job name
+        :return: a dict with the number of tasks per status (PENDING, STARTED, DONE, ERROR), the total,
+                 the throughput (tasks completed per second) and the eta (seconds, or None if not known yet)
+        """
+        raise NotImplementedError()
+
+    def job_ids(self, module, job):
+        """
+        Get the IDs of the tasks submitted with a job
+        :param module: Module name
+        :param job: Job name
+        :return: a list of task IDs
+        """
+        raise NotImplementedError()
+
     def status(self, module, id):
         """Get processing status
         :param module: Module name
@@ -67,44 +196,66 @@ class Client(object):
         :param module: Module name
         :param id: A document (string) or task ID
         :param format: (Optional) format to convert to, e.g. 'xml', 'csv', 'json'
-        :return: The result of processing (string)
+        :return: The result of processing (string, or bytes for the columnar formats, see nlpipe.columnar)
         """
         raise NotImplementedError()
 
-    def process_inline(self, module, doc, format=None, id=None):
+    def process_inline(self, module, doc, format=None, id=None, priority=INLINE_PRIORITY):
         """
         Process the given document, use cached version if possible, wait and return result
         :param module: Module name
         :param doc: A document (string)
+        :param priority: Priority of the task, by default higher than bulk submissions
         :return: The result of processing (string)
         """
         if id is None:
             id = get_id(doc)
-        if self.status(module, id) == 'UNKNOWN':
-            self.process(module, doc, id)
+        if self.status(module, id) in ('UNKNOWN', 'PENDING'):
+            self.process(module, doc, id, priority=priority)
         while True:
             status = self.status(module, id)
             if status in ('DONE', 'ERROR'):
                 return self.result(module, id, format=format)
             time.sleep(0.1)
 
-    def get_task(self, module):
+    def get_task(self, module, worker=None):
         """
         Get a document to process with the given module, marking the document as 'in progress'
+        The task is leased to the worker: if the worker does not store a result or send a heartbeat
+        before the lease expires, the task is returned to the queue.
         :param module: Name of the module
+        :param worker: (Optional) identification of the worker claiming the task
         :return: a pair (id, string) for the document to be processed
         """
         raise NotImplementedError()
 
-    def get_tasks(self, module, n):
+    def get_tasks(self, module, n, worker=None):
         """
         Get multiple documents to process
         :param module: Name of the module for processing
         :param n: Number of documents to retrieve
+        :param worker: (Optional) identification of the worker claiming the tasks
         :return: a sequence of (id, document string) pairs
         """
         for i in range(n):
-            yield self.get_task(module)
+            yield self.get_task(module, worker=worker)
+
+    def heartbeat(self, module, id, worker=None):
+        """
+        Extend the lease on a task that is being processed
+        :param module: Module name
+        :param id: Task ID
+        :param worker: (Optional) identification of the worker that claimed the task
+        """
+        raise NotImplementedError()
+
+    def release_task(self, module, id):
+        """
+        Return a task that was retrieved with get_task but not processed to the queue (status PENDING)
+        :param module: Module name
+        :param id: Task ID
+        """
+        raise NotImplementedError()
 
     def store_result(self, module, id, result):
         """
@@ -139,7 +290,193 @@ class Client(object):
         :param ids: Task IDs
         :return: a dict of {id: result}
         """
-        return {id: self.result(module, id, format=format) for id in ids}
+        return dict(self.iter_results(module, ids, format=format))
+
+    def iter_results(self, module, ids, format=None):
+        """Lazily get results for multiple ids.
+        If a format is given, the results are yielded in the order in which their conversion completes.
+        As with result, an exception is raised when reaching a result that has status ERROR
+        :param module: Module name
+        :param ids: Task IDs
+        :return: a generator of (id, result) pairs
+        """
+        for id, result, error in self.iter_outcomes(module, ids, format=format):
+            if error is not None:
+                raise error
+            yield id, result
+
+    def iter_outcomes(self, module, ids, format=None, ordered=False):
+        """
+        Get results for multiple ids, converting them in a process pool if a format is given (see nlpipe.convert)
+        :param module: Module name
+        :param ids: Task IDs
+        :param format: (Optional) format to convert to
+        :param ordered: If True, yield the results in the order of ids, otherwise in order of completion
+        :return: a generator of (id, result, error) triples,
+                 where error is an exception if the task is not done or could not be converted
+        """
+        if format is None:
+            for id in ids:
+                try:
+                    yield id, self.result(module, id), None
+                except Exception as e:
+                    yield id, None, e
+            return
+        cached = set()
+
+        def read_results():
+            for id in ids:
+                converted = self.get_converted(module, id, format)
+                if converted is not None:
+                    cached.add(id)
+                    yield id, Converted(converted)
+                    continue
+                try:
+                    yield id, self.result(module, id)
+                except Exception as e:
+                    yield id, e
+        for id, converted, error in convert_all(module, read_results(), format, ordered=ordered):
+            if id in cached:
+                cached.remove(id)
+            elif error is None:
+                self.store_converted(module, id, format, converted)
+            yield id, converted, error
+
+    def get_converted(self, module, id, format):
+        """
+        Get a stored converted result (see store_converted)
+        :param module: Module name
+        :param id: Task ID
+        :param format: The format
+        :return: the converted result, or None if it was not stored
+        """
+        return None
+
+    def store_converted(self, module, id, format, converted, eager=False):
+        """
+        Store a converted result so it does not need to be converted again. Clients without storage for
+        converted results ignore this.
+        :param module: Module name
+        :param id: Task ID
+        :param format: The format
+        :param converted: The converted result (string, or bytes for the columnar formats)
+        :param eager: If True, the result was converted right after processing (see Module.eager_formats) and is kept
+                      until the result is stored again, otherwise it is only cached (if the cache is enabled)
+        :return: True if the converted result was stored
+        """
+        return False
+
+    def list_ids(self, module, status='DONE'):
+        """
+        Get the IDs of all tasks with the given status
+        :param module: Module name
+        :param status: The task status
+        :return: a list of task IDs
+        """
+        raise NotImplementedError()
+
+    def export(self, module, out, ids=None, job=None, format=None, after=None):
+        """
+        Export results as a tar archive with a file per document, see iter_export
+        :param out: a binary file-like object to write the archive to
+        """
+        for chunk in self.iter_export(module, ids=ids, job=job, format=format, after=after):
+            out.write(chunk)
+
+    def iter_export(self, module, ids=None, job=None, format=None, after=None):
+        """
+        Export the results of a module as a tar archive, containing a file per document named after its ID
+        (with the format as extension if given). Documents are exported in order of their ID, and only
+        finished (DONE) documents are included. To resume an interrupted export, pass the id of the last
+        document in the (partial) archive as after.
+        :param module: Module name
+        :param ids: Task IDs to export (default: all results of the module or job)
+        :param job: Export the results of this job
+        :param format: (Optional) format to convert to, e.g. 'xml', 'csv', 'json'
+        :param after: Only export documents with an id after this cursor
+        :return: a generator of bytes chunks
+        """
+        ids = self._export_ids(module, ids, job, after)
+        return transport.chunked(transport.encode_tar(self._export_members(module, ids, format)))
+
+    def export_csv(self, module, out, ids=None, job=None):
+        """
+        Export results as a single csv file, see iter_export_csv
+        :param out: a binary file-like object to write the csv to
+        """
+        for chunk in self.iter_export_csv(module, ids=ids, job=job):
+            out.write(chunk)
+
+    def iter_export_csv(self, module, ids=None, job=None):
+        """
+        Export the results of a module converted to csv and concatenated into one csv file with a single header.
+        The documents are converted in parallel (see nlpipe.convert), and only finished (DONE) documents are included.
+        :param module: Module name
+        :param ids: Task IDs to export (default: all results of the module or job)
+        :param job: Export the results of this job
+        :return: a generator of (utf-8) bytes chunks
+        """
+        ids = self._export_ids(module, ids, job)
+        ids = (id for id in ids if self.status(module, id) == 'DONE')
+        return transport.chunked(_merge_csv(module, self.iter_outcomes(module, ids, format="csv", ordered=True)))
+
+    def export_table(self, module, out, format="arrow", ids=None, job=None):
+        """
+        Export results as a single token table, see iter_export_table
+        :param out: a binary file-like object to write the table to
+        """
+        for chunk in self.iter_export_table(module, format=format, ids=ids, job=job):
+            out.write(chunk)
+
+    def iter_export_table(self, module, format="arrow", ids=None, job=None):
+        """
+        Export the token tables of the results of a module merged into one table in a columnar format
+        (arrow or parquet, see nlpipe.columnar). The documents are converted in parallel (see nlpipe.convert),
+        and only finished (DONE) documents are included.
+        :param module: Module name
+        :param format: The columnar format of the table
+        :param ids: Task IDs to export (default: all results of the module or job)
+        :param job: Export the results of this job
+        :return: a generator of bytes chunks
+        """
+        schema = get_module(module).table_schema
+        if format not in columnar.FORMATS or schema is None:
+            raise ValueError("Module {module} results cannot be exported as {format}".format(**locals()))
+        columnar.check_pyarrow()
+        ids = self._export_ids(module, ids, job)
+        ids = (id for id in ids if self.status(module, id) == 'DONE')
+        outcomes = self.iter_outcomes(module, ids, format="arrow", ordered=True)
+        return transport.chunked(columnar.merge(schema, outcomes, format))
+
+    def _export_ids(self, module, ids=None, job=None, after=None):
+        if ids is None:
+            ids = self.job_ids(module, job) if job is not None else self.list_ids(module)
+        ids = sorted({str(id) for id in ids})
+        if after is not None:
+            ids = ids[bisect.bisect_right(ids, str(after)):]
+        return ids
+
+    def _export_members(self, module, ids, format=None):
+        ids = (id for id in ids if self.status(module, id) == 'DONE')
+        for id, result, error in self.iter_outcomes(module, ids, format=format, ordered=True):
+            if error is not None:
+                logging.warning("Skipping {module}/{id} in export: {error}".format(**locals()))
+                continue
+            name = id if format is None else "{id}.{format}".format(**locals())
+            yield name, result if isinstance(result, bytes) else result.encode("utf-8")
+
+    def process_results(self, module, previous_module, ids, **kargs):
+        """
+        Add the results of previous_module for the given documents to the processing queue of module,
+        without sending them to the client and back (e.g. for documents that were done before a pipeline was
+        configured, see FSClient)
+        :param module: Module name
+        :param previous_module: Module name of the results to process
+        :param ids: IDs of the documents
+        :param kargs: Additional options to pass to process
+        :return: the IDs of the documents that were DONE with previous_module
+        """
+        raise NotImplementedError()
 
     def bulk_process(self, module, docs, ids=None, **kargs):
         """
@@ -158,15 +495,70 @@ class Client(object):
 class FSClient(Client):
     """
     NLPipe client that relies on direct filesystem access (e.g. on local machine or over NFS)
+
+    Tasks retrieved with get_task are leased to the worker for lease_timeout seconds (see heartbeat).
+    Tasks with an expired lease are returned to the queue by requeue_expired, which is called from get_task
+    at most every reap_interval seconds. After max_attempts attempts a task is stored as ERROR instead.
+
+    Pending tasks are indexed by a ticket file per task in <module>/index/<priority>/<job>/, named so that
+    sorting the names orders tasks by deadline and submission time. get_task takes the highest priority,
+    chooses a job from that priority with smooth weighted round robin, and takes the first ticket of that job.
+    To keep get_task fast for queues with millions of tasks, only the first ticket_batch tickets of a job
+    are kept in memory, and a changed job dir is only scanned again after rescan_interval seconds (unless
+    it was smaller than ticket_batch, in which case it is scanned again immediately).
+    Pending tasks without a ticket (e.g. queued by an older version) are processed oldest first
+    once all tickets are done.
+
+    Input documents are stored once in <result_dir>/blobs/<get_id(doc)>, and the queue and inprogress files of
+    every module that the document was submitted to are hard links to this blob (or copies, if the file system
+    does not support hard links). A blob is removed when the last module has stored the result of the document.
+
+    Modules can be chained with pipelines (see parse_pipelines): when a result is stored, it is queued as a task
+    for the downstream modules, with the same id, priority, deadline and jobs.
+
+    Results converted to another format are cached in <module>/converted/<format>/<id> (as bytes for the
+    columnar formats) until the result is stored again. If the cache grows beyond convert_cache_size bytes, the least recently used conversions are removed.
+    Results converted by workers to the eager formats are stored in <module>/materialized/<format>/<id> instead,
+    which is not limited by convert_cache_size.
     """
 
-    def __init__(self, result_dir):
+    reap_interval = 10
+    ticket_batch = 10000
+    rescan_interval = 10
+
+    def __init__(self, result_dir, lease_timeout=None, max_attempts=None, convert_cache_size=None, pipelines=None):
+        """
+        :param result_dir: The NLPipe storage directory
+        :param lease_timeout: Seconds before a claimed task is requeued (default: $NLPIPE_LEASE_TIMEOUT or 600)
+        :param max_attempts: Number of claims before a task is stored as ERROR (default: $NLPIPE_MAX_ATTEMPTS or 3)
+        :param convert_cache_size: Size limit of the converted results cache per module in bytes, 0 to disable
+                                   (default: $NLPIPE_CONVERT_CACHE_SIZE megabytes or 1024MB)
+        :param pipelines: The modules to queue the results of each module for, as a {module: [modules]} dict
+                          (default: parsed from $NLPIPE_PIPELINES, e.g. "alpinonerc->corefnl", see parse_pipelines)
+        """
         self.result_dir = result_dir
+        if lease_timeout is None:
+            lease_timeout = float(os.environ.get("NLPIPE_LEASE_TIMEOUT", 600))
+        if max_attempts is None:
+            max_attempts = int(os.environ.get("NLPIPE_MAX_ATTEMPTS", 3))
+        if convert_cache_size is None:
+            convert_cache_size = float(os.environ.get("NLPIPE_CONVERT_CACHE_SIZE", 1024)) * 1024 * 1024
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.convert_cache_size = convert_cache_size
+        self._cache_stats = {}  # module : {hits, misses, evictions}
+        self._cache_written = {}  # module : bytes written to the cache since the last eviction check
+        self._last_reaped = {}  # module : timestamp
+        self._tickets = {}  # (module, priority, job) : {mtime, scanned, complete, tickets}
+        self._credits = {}  # (module, priority) : {job: round robin credit}
         for module in known_modules():
             self._check_dirs(module.name)
+        if pipelines is None:
+            pipelines = parse_pipelines(os.environ.get("NLPIPE_PIPELINES", ""))
+        self.pipelines = pipelines
 
     def _check_dirs(self, module: str):
-        for subdir in STATUS.values():
+        for subdir in list(STATUS.values()) + [LEASES, INDEX]:
             dirname = os.path.join(self.result_dir, module, subdir)
             try:
                 os.makedirs(dirname)
@@ -180,6 +572,58 @@ class FSClient(Client):
         open(fn, 'w', encoding="UTF-8").write(doc)
         return fn
 
+    def _blob_filename(self, doc):
+        return os.path.join(self.result_dir, BLOBS, get_id(doc))
+
+    def _write_input(self, module, id, doc):
+        """Queue the document as a PENDING task, as a hard link to its blob so it is only stored once"""
+        self._check_dirs(module)
+        fn = self._filename(module, 'PENDING', id)
+        blob = self._blob_filename(doc)
+        for _attempt in range(2):
+            if not os.path.exists(blob):
+                self._write_blob(blob, doc)
+            try:
+                os.link(blob, fn)
+                return fn
+            except FileNotFoundError:
+                continue  # the blob was removed in the meantime, so write it again
+            except OSError as e:
+                logging.debug("Cannot link {fn} to {blob}, writing a copy: {e}".format(**locals()))
+                break
+        return self._write(module, 'PENDING', id, doc)
+
+    def _write_blob(self, blob, doc):
+        """Write the blob through a unique temporary file, as other threads or processes can write it concurrently"""
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(blob), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding="UTF-8") as f:
+                f.write(doc)
+            os.replace(tmp, blob)
+        except OSError:
+            if not os.path.exists(blob):
+                raise
+            # another writer created the (identical) blob in the meantime
+            logging.debug("Blob {blob} was written concurrently".format(**locals()))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def _delete_input(self, module, status, id):
+        """Delete the input of a PENDING or STARTED task, and its blob if no other module links to it"""
+        fn = self._filename(module, status, id)
+        blob = None
+        if os.stat(fn).st_nlink == 2:  # this file and the blob
+            blob = self._blob_filename(self._read(module, status, id))
+        os.remove(fn)
+        if blob is not None:
+            try:
+                if os.stat(blob).st_nlink == 1:
+                    os.remove(blob)
+            except FileNotFoundError:
+                pass
+
     def _read(self, module, status, id):
         fn = self._filename(module, status, id)
         return open(fn, encoding="UTF-8").read()
@@ -200,6 +644,336 @@ class FSClient(Client):
         else:
             return os.path.join(dirname, str(id))
 
+    def _converted_filename(self, module, format, id=None, subdir=CONVERTED):
+        if not re.match(r"^\w+$", format):
+            raise ValueError("Invalid format: {format!r}".format(**locals()))
+        dirname = os.path.join(self.result_dir, module, subdir, format)
+        return dirname if id is None else os.path.join(dirname, str(id))
+
+    def _cache_statistics(self, module):
+        return self._cache_stats.setdefault(module, {"hits": 0, "misses": 0, "evictions": 0})
+
+    def get_converted(self, module, id, format):
+        try:
+            converted = _read_converted(self._converted_filename(module, format, id, MATERIALIZED), format)
+        except FileNotFoundError:
+            converted = None
+        if converted is None and self.convert_cache_size:
+            fn = self._converted_filename(module, format, id)
+            try:
+                converted = _read_converted(fn, format)
+                os.utime(fn)  # mark as recently used
+            except FileNotFoundError:
+                pass
+        if converted is None:
+            if self.convert_cache_size:
+                self._cache_statistics(module)["misses"] += 1
+            return None
+        self._cache_statistics(module)["hits"] += 1
+        return converted
+
+    def store_converted(self, module, id, format, converted, eager=False):
+        if eager:
+            self._write_converted(module, id, self._converted_filename(module, format, subdir=MATERIALIZED),
+                                  converted)
+            return True
+        if not self.convert_cache_size:
+            return False
+        try:
+            self._write_converted(module, id, self._converted_filename(module, format), converted)
+        except OSError:
+            logging.exception("Cannot cache {format} of {module}/{id}".format(**locals()))
+            return False
+        # only check the cache size once every 10% of the limit is written
+        self._cache_written[module] = self._cache_written.get(module, 0) + len(converted)
+        if self._cache_written[module] > self.convert_cache_size / 10:
+            self._cache_written[module] = 0
+            self.evict_converted(module)
+        return True
+
+    def _write_converted(self, module, id, dirname, converted):
+        os.makedirs(dirname, exist_ok=True)
+        # a unique temporary file, as threads of the same process can write the same id concurrently
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix=".", suffix=".tmp")
+        try:
+            with (os.fdopen(fd, 'wb') if isinstance(converted, bytes) else os.fdopen(fd, 'w', encoding="UTF-8")) as f:
+                f.write(converted)
+            os.replace(tmp, os.path.join(dirname, str(id)))
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def evict_converted(self, module):
+        """Remove the least recently used converted results until the cache is below 90% of convert_cache_size"""
+        root = os.path.join(self.result_dir, module, CONVERTED)
+        entries = []  # (mtime, size, path)
+        try:
+            for format_dir in os.scandir(root):
+                if format_dir.is_dir():
+                    for entry in os.scandir(format_dir.path):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            return
+        total = sum(size for (_mtime, size, _path) in entries)
+        if total <= self.convert_cache_size:
+            return
+        entries.sort()
+        stats = self._cache_statistics(module)
+        for _mtime, size, path in entries:
+            if total <= 0.9 * self.convert_cache_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            stats["evictions"] += 1
+
+    def _invalidate_converted(self, module, id):
+        for subdir in CONVERTED, MATERIALIZED:
+            root = os.path.join(self.result_dir, module, subdir)
+            try:
+                formats = os.listdir(root)
+            except FileNotFoundError:
+                continue
+            for format in formats:
+                try:
+                    os.remove(os.path.join(root, format, str(id)))
+                except (FileNotFoundError, NotADirectoryError):
+                    pass
+
+    def cache_statistics(self, module):
+        """Get the hits, misses and evictions of the converted results cache of this module (since startup)"""
+        return dict(self._cache_statistics(module), size_limit=self.convert_cache_size)
+
+    def _lease_filename(self, module, id):
+        return os.path.join(self.result_dir, module, LEASES, str(id))
+
+    def _read_lease(self, module, id):
+        """Get the lease {worker, expires, attempts} for this task, or None if it was never claimed"""
+        try:
+            with open(self._lease_filename(module, id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_lease(self, module, id, lease):
+        fn = self._lease_filename(module, id)
+        tmp = os.path.join(os.path.dirname(fn), ".{id}.{pid}".format(pid=os.getpid(), **locals()))
+        with open(tmp, 'w') as f:
+            json.dump(lease, f)
+        os.rename(tmp, fn)  # atomic, so readers never see a partial lease
+
+    def _delete_lease(self, module, id):
+        try:
+            os.remove(self._lease_filename(module, id))
+        except FileNotFoundError:
+            pass
+
+    def _add_ticket(self, module, id, priority=0, deadline=None, job=None):
+        """Add the PENDING task to the priority queue index"""
+        dirname = os.path.join(self.result_dir, module, INDEX, str(int(priority)), job or DEFAULT_JOB)
+        deadline = int(deadline * 1000) if deadline else 10**16 - 1  # tasks without deadline come last
+        ticket = "{deadline:016d}_{seq:020d}_{id}".format(seq=time.time_ns(), **locals())
+        while True:
+            os.makedirs(dirname, exist_ok=True)
+            try:
+                open(os.path.join(dirname, ticket), 'w').close()
+                return
+            except FileNotFoundError:
+                pass  # empty job dir was removed by _scan_tickets in the meantime
+
+    def _scan_tickets(self, module, priority, job):
+        """Get the cached tickets for this priority and job, (re)scanning the index dir if needed"""
+        dirname = os.path.join(self.result_dir, module, INDEX, str(priority), job)
+        try:
+            mtime = os.stat(dirname).st_mtime_ns
+        except FileNotFoundError:
+            return deque()
+        cache = self._tickets.get((module, priority, job))
+        if (cache is None or not cache['tickets'] or
+                (cache['mtime'] != mtime and (cache['complete'] or
+                                              time.time() - cache['scanned'] > self.rescan_interval))):
+            with os.scandir(dirname) as entries:
+                names = (e.name for e in entries if not e.name.startswith("."))
+                tickets = heapq.nsmallest(self.ticket_batch + 1, names)
+            if not tickets:
+                try:
+                    os.rmdir(dirname)  # job is done (for this priority)
+                except OSError:
+                    pass
+            complete = len(tickets) <= self.ticket_batch
+            cache = dict(mtime=mtime, scanned=time.time(), complete=complete,
+                         tickets=deque(tickets[:self.ticket_batch]))
+            self._tickets[module, priority, job] = cache
+        return cache['tickets']
+
+    def _claimed_ticket(self, module, priority, job, mtime):
+        """
+        Update the cached mtime of a job dir after removing a claimed ticket, so the removal does not cause a rescan
+        :param mtime: the mtime of the dir before the removal, if it differs from the cached mtime the dir
+                      was changed by another client and is not updated
+        """
+        cache = self._tickets.get((module, priority, job))
+        if cache is not None and cache['mtime'] == mtime:
+            try:
+                cache['mtime'] = os.stat(os.path.join(self.result_dir, module, INDEX, str(priority), job)).st_mtime_ns
+            except FileNotFoundError:
+                pass
+
+    def _choose_job(self, module, priority, jobs):
+        """Choose the next job using smooth weighted round robin over the given active jobs"""
+        credits = self._credits.setdefault((module, priority), {})
+        for job in list(credits):
+            if job not in jobs:
+                del credits[job]
+        weights = {job: self.get_job_weight(module, job) for job in jobs}
+        for job in jobs:
+            credits[job] = credits.get(job, 0) + weights[job]
+        job = max(sorted(jobs), key=lambda j: credits[j])
+        credits[job] -= sum(weights.values())
+        return job
+
+    def _next_ticket(self, module):
+        """
+        Claim the next ticket from the priority queue index,
+        returning (id, priority, deadline, job) or None if there are no tickets
+        """
+        try:
+            priorities = sorted((int(p) for p in os.listdir(os.path.join(self.result_dir, module, INDEX))),
+                                reverse=True)
+        except FileNotFoundError:
+            return None
+        for priority in priorities:
+            jobs = set(os.listdir(os.path.join(self.result_dir, module, INDEX, str(priority))))
+            while jobs:
+                job = self._choose_job(module, priority, jobs)
+                tickets = self._scan_tickets(module, priority, job)
+                dirname = os.path.join(self.result_dir, module, INDEX, str(priority), job)
+                while tickets:
+                    ticket = tickets.popleft()
+                    try:
+                        mtime = os.stat(dirname).st_mtime_ns
+                        # removing the ticket is atomic, so only one client can claim it
+                        os.remove(os.path.join(dirname, ticket))
+                    except FileNotFoundError:
+                        continue
+                    self._claimed_ticket(module, priority, job, mtime)
+                    deadline, _seq, id = ticket.split("_", 2)
+                    deadline = int(deadline) / 1000 if int(deadline) < 10**16 - 1 else None
+                    return id, priority, deadline, job
+                jobs.remove(job)
+        return None
+
+    def _job_dir(self, module, job):
+        return os.path.join(self.result_dir, module, JOBS, job)
+
+    def _update_json(self, fn, update):
+        """Atomically update the json dict in the given file with the update(dict) function"""
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(fn, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            data = f.read()
+            data = json.loads(data) if data else {}
+            update(data)
+            f.seek(0)
+            f.truncate()
+            json.dump(data, f)
+        return data
+
+    def _jobs_of(self, module, id):
+        """Get the jobs that this task was submitted with"""
+        try:
+            with open(os.path.join(self.result_dir, module, JOBMAP, str(id))) as f:
+                return f.read().split()
+        except FileNotFoundError:
+            return []
+
+    def _add_to_job(self, module, job, id, status):
+        """Add the task with the given current status to the job, unless it is already part of the job"""
+        if job in self._jobs_of(module, id):
+            return
+        os.makedirs(self._job_dir(module, job), exist_ok=True)
+        os.makedirs(os.path.join(self.result_dir, module, JOBMAP), exist_ok=True)
+        with open(os.path.join(self._job_dir(module, job), "ids"), "a") as f:
+            f.write("{id}\n".format(**locals()))
+        with open(os.path.join(self.result_dir, module, JOBMAP, str(id)), "a") as f:
+            f.write("{job}\n".format(**locals()))
+
+        def update(counters):
+            counters.setdefault('created', time.time())
+            counters[status] = counters.get(status, 0) + 1
+        self._update_json(os.path.join(self._job_dir(module, job), "counters"), update)
+
+    def _job_transition(self, module, id, from_status, to_status):
+        """Update the counters of all jobs of this task after it changed status"""
+        if from_status == to_status:
+            return
+
+        def update(counters):
+            now = time.time()
+            counters[from_status] = counters.get(from_status, 0) - 1
+            counters[to_status] = counters.get(to_status, 0) + 1
+            # a task that is stored again (e.g. a DONE task that is stored as ERROR) was already counted as completed
+            if to_status in ('DONE', 'ERROR') and from_status not in ('DONE', 'ERROR'):
+                counters['completed'] = counters.get('completed', 0) + 1
+                counters.setdefault('first_completed', now)
+                counters['last_completed'] = now
+        for job in self._jobs_of(module, id):
+            self._update_json(os.path.join(self._job_dir(module, job), "counters"), update)
+
+    def get_job_weight(self, module, job):
+        """Get the scheduling weight of a job (default 1)"""
+        try:
+            with open(os.path.join(self._job_dir(module, job), "weight")) as f:
+                return float(f.read())
+        except (FileNotFoundError, ValueError):
+            return 1
+
+    def set_job_weight(self, module, job, weight):
+        _check_job(job)
+        os.makedirs(self._job_dir(module, job), exist_ok=True)
+        with open(os.path.join(self._job_dir(module, job), "weight"), "w") as f:
+            f.write(str(weight))
+
+    def jobs(self, module):
+        try:
+            return sorted(job for job in os.listdir(os.path.join(self.result_dir, module, JOBS))
+                          if os.path.exists(os.path.join(self._job_dir(module, job), "counters")))
+        except FileNotFoundError:
+            return []
+
+    def job_status(self, module, job):
+        try:
+            with open(os.path.join(self._job_dir(module, job), "counters")) as f:
+                counters = json.load(f)
+        except FileNotFoundError:
+            raise ValueError("Unknown job: {module}/{job}".format(**locals()))
+        return _job_summary(counters)
+
+    def job_ids(self, module, job):
+        try:
+            with open(os.path.join(self._job_dir(module, job), "ids")) as f:
+                return [id.strip() for id in f if id.strip()]
+        except FileNotFoundError:
+            raise ValueError("Unknown job: {module}/{job}".format(**locals()))
+
+    def list_ids(self, module, status='DONE'):
+        try:
+            return os.listdir(self._filename(module, status))
+        except FileNotFoundError:
+            return []
+
+    def job_statistics(self, module):
+        """Get the status of all jobs of this module as a dict of {job: status}, see job_status"""
+        return {job: self.job_status(module, job) for job in self.jobs(module)}
+
     def check(self, module):
         self._check_dirs(self, module)
         return module.check_status()
@@ -210,24 +984,47 @@ class FSClient(Client):
                 return status
         return 'UNKNOWN'
 
-    def process(self, module, doc, id=None, reset_error=False, reset_pending=False):
+    def process(self, module, doc, id=None, reset_error=False, reset_pending=False, priority=0, deadline=None,
+                job=None):
+        _check_job(job)
         if id is None:
             id = get_id(doc)
         status = self.status(module, id)
         if status == 'UNKNOWN':
             logging.debug("Assigning doc {id} to {module}".format(**locals()))
-            self._write(module, 'PENDING', id, doc)
-        elif (status == "ERROR" and reset_error) or (status == "STARTED" and reset_pending):
+            if job:
+                self._add_to_job(module, job, id, 'PENDING')
+            self._write_input(module, id, doc)
+            self._add_ticket(module, id, priority, deadline, job)
+            return id
+        if (status == "ERROR" and reset_error) or (status == "STARTED" and reset_pending):
             logging.debug("Re-assigning doc {id} with status {status} to {module}".format(**locals()))
-            self._delete(module, status, id)
-            self._write(module, 'PENDING', id, doc)
+            if status == "STARTED":
+                self._delete_input(module, status, id)
+            else:
+                self._delete(module, status, id)
+            self._delete_lease(module, id)
+            self._write_input(module, id, doc)
+            self._add_ticket(module, id, priority, deadline, job)
+            self._job_transition(module, id, status, 'PENDING')
+            status = 'PENDING'
+        elif status == "PENDING" and (priority or deadline):
+            # add an extra ticket, the task will be processed for whichever ticket comes first
+            logging.debug("Re-prioritizing doc {id} to {priority}".format(**locals()))
+            self._add_ticket(module, id, priority, deadline, job)
         else:
-            logging.debug("Document {id} had status {}".format(self.status(module, id), **locals()))
+            logging.debug("Document {id} had status {status}".format(**locals()))
+        if job:
+            self._add_to_job(module, job, id, status)
         return id
 
     def result(self, module, id, format=None):
         status = self.status(module, id)
         if status == 'DONE':
+            if format is not None:
+                converted = self.get_converted(module, id, format)
+                if converted is not None:
+                    return converted
             result = self._read(module, 'DONE', id)
             if format is not None:
                 try:
@@ -235,41 +1032,155 @@ class FSClient(Client):
                 except:
                     logging.exception("Error converting document {id} to {format}".format(**locals()))
                     raise
+                self.store_converted(module, id, format, result)
             return result
         if status == 'ERROR':
             raise Exception(self._read(module, 'ERROR', id))
         raise ValueError("Status of {id} is {status}".format(**locals()))
 
-    def get_task(self, module):
-        path = self._filename(module, 'PENDING')
-        # I can't find a way to get newest file in python without iterating over all of them
-        # So this seems more robust/faster than looping over python with .getctime for every entry
-        cmd = "ls -rt {path} | head -1".format(**locals())
-        fn = subprocess.check_output(cmd, shell=True).decode("utf-8").strip()
-        if not fn: 
-            return None, None  # no files to process
+    def get_task(self, module, worker=None):
+        if time.time() - self._last_reaped.get(module, 0) > self.reap_interval:
+            self.requeue_expired(module)
+        while True:
+            ticket = self._next_ticket(module)
+            if ticket is not None:
+                fn, priority, deadline, job = ticket
+            else:
+                priority, deadline, job = 0, None, DEFAULT_JOB
+                path = self._filename(module, 'PENDING')
+                # I can't find a way to get newest file in python without iterating over all of them
+                # So this seems more robust/faster than looping over python with .getctime for every entry
+                cmd = "ls -rt {path} | head -1".format(**locals())
+                fn = subprocess.check_output(cmd, shell=True).decode("utf-8").strip()
+                if not fn:
+                    return None, None  # no files to process
+            try:
+                self._move(module, fn, 'PENDING', 'STARTED')
+                self._job_transition(module, fn, 'PENDING', 'STARTED')
+                break
+            except FileNotFoundError:
+                # file was removed between choosing it and now (or the ticket was stale), so try again
+                continue
+        lease = self._read_lease(module, fn) or {}
+        attempts = lease.get('attempts', 0) + 1
+        self._write_lease(module, fn, {'worker': worker, 'expires': time.time() + self.lease_timeout,
+                                       'attempts': attempts, 'priority': priority, 'deadline': deadline,
+                                       'job': job})
+        return fn, self._read(module, 'STARTED', fn)
+
+    def heartbeat(self, module, id, worker=None):
+        status = self.status(module, id)
+        lease = self._read_lease(module, id)
+        if status != 'STARTED' or lease is None:
+            raise ValueError("Cannot extend lease for task {id} with status {status}".format(**locals()))
+        if lease.get('worker') != worker:
+            raise ValueError("Task {id} is leased to {}, not to {worker}".format(lease.get('worker'), **locals()))
+        lease['expires'] = time.time() + self.lease_timeout
+        self._write_lease(module, id, lease)
+
+    def release_task(self, module, id):
+        status = self.status(module, id)
+        if status != 'STARTED':
+            raise ValueError("Cannot release task {id} with status {status}".format(**locals()))
+        # a released task was not attempted, so don't count it
+        lease = self._read_lease(module, id) or {}
+        self._requeue(module, id, lease, attempts=max(0, lease.get('attempts', 1) - 1))
+
+    def _requeue(self, module, id, lease, attempts):
+        """Move a STARTED task back to the queue, keeping its attempts, priority, deadline and job"""
+        priority, deadline, job = lease.get('priority', 0), lease.get('deadline'), lease.get('job')
+        self._write_lease(module, id, {'attempts': attempts})
+        self._move(module, id, 'STARTED', 'PENDING')
+        self._add_ticket(module, id, priority, deadline, job)
+        self._job_transition(module, id, 'STARTED', 'PENDING')
+
+    def requeue_expired(self, module):
+        """
+        Return STARTED tasks with an expired lease to the queue,
+        or store them as ERROR if they have been attempted max_attempts times
+        :return: a list of requeued task ids
+        """
+        self._last_reaped[module] = time.time()
+        requeued = []
         try:
-            self._move(module, fn, 'PENDING', 'STARTED')
+            ids = os.listdir(os.path.join(self.result_dir, module, LEASES))
         except FileNotFoundError:
-            # file was removed between choosing it and now, so try again
-            return self.get_task(module)
-        return fn, self._read(module, 'STARTED', fn)
+            return requeued
+        for id in ids:
+            if id.startswith("."):
+                continue
+            lease = self._read_lease(module, id)
+            if lease is None or not lease.get('expires') or lease['expires'] > time.time():
+                continue
+            if self.status(module, id) != 'STARTED':
+                continue
+            attempts = lease.get('attempts', 1)
+            try:
+                if attempts >= self.max_attempts:
+                    logging.warning("Lease on {module}/{id} by {} expired after {attempts} attempts, storing error"
+                                    .format(lease.get('worker'), **locals()))
+                    self.store_error(module, id, "Task was not completed after {attempts} attempts "
+                                                 "(last claimed by {})".format(lease.get('worker'), **locals()))
+                else:
+                    logging.info("Lease on {module}/{id} by {} expired, returning task to the queue"
+                                 .format(lease.get('worker'), **locals()))
+                    self._requeue(module, id, lease, attempts)
+                    requeued.append(id)
+            except (FileNotFoundError, ValueError):
+                # task was completed or requeued by someone else in the meantime
+                pass
+        return requeued
 
     def store_result(self, module, id, result):
         status = self.status(module, id)
         if status not in ('STARTED', 'DONE', 'ERROR'):
             raise ValueError("Cannot store result for task {id} with status {status}".format(**locals()))
+        if status == 'DONE':
+            self._invalidate_converted(module, id)
+        lease = self._read_lease(module, id) or {}
         self._write(module, 'DONE', id, result)
-        if status in ('STARTED', 'ERROR'):
+        if status == 'STARTED':
+            self._delete_input(module, status, id)
+        elif status == 'ERROR':
             self._delete(module, status, id)
+        self._delete_lease(module, id)
+        self._job_transition(module, id, status, 'DONE')
+        for downstream in self.pipelines.get(module, ()):
+            # the upstream task is done, so a failure to queue the downstream task should not change its outcome
+            try:
+                self._process_downstream(downstream, module, id, result, lease)
+            except Exception:
+                logging.exception("Error on queueing {module}/{id} for {downstream}".format(**locals()))
+
+    def _process_downstream(self, module, previous_module, id, result, lease):
+        """Queue the result of previous_module as a task for module, in the same jobs and with the same priority"""
+        logging.debug("Queueing {previous_module} result {id} for {module}".format(**locals()))
+        for job in self._jobs_of(previous_module, id) or [None]:
+            # an error of module may have been caused by the previous result, so retry it with the new result
+            self.process(module, result, id=id, reset_error=True, priority=lease.get('priority', 0),
+                         deadline=lease.get('deadline'), job=job)
+
+    def process_results(self, module, previous_module, ids, **kargs):
+        queued = []
+        for id in ids:
+            if self.status(previous_module, id) == 'DONE':
+                self.process(module, self._read(previous_module, 'DONE', id), id=id, **kargs)
+                queued.append(id)
+        return queued
 
     def store_error(self, module, id, result):
         status = self.status(module, id)
         if status not in ('STARTED', 'DONE', 'ERROR'):
             raise ValueError("Cannot store error for task {id} with status {status}".format(**locals()))
+        if status == 'DONE':
+            self._invalidate_converted(module, id)
         self._write(module, 'ERROR', id, result)
-        if status in ('STARTED', 'DONE'):
+        if status == 'STARTED':
+            self._delete_input(module, status, id)
+        elif status == 'DONE':
             self._delete(module, status, id)
+        self._delete_lease(module, id)
+        self._job_transition(module, id, status, 'ERROR')
 
     def statistics(self, module):
         """Get number of docs for each status for this module"""
@@ -282,17 +1193,49 @@ class FSClient(Client):
 class HTTPClient(Client):
     """
     NLPipe client that connects to the REST server
+
+    Bulk documents and results are streamed as length-prefixed frames (see nlpipe.transport), which avoids
+    json escaping of large XML/NAF documents. Set bulk_mimetype to transport.NDJSON_MIME to use ndjson instead.
+
+    Documents and results that are sent to the server are compressed (see nlpipe.transport),
+    compressed responses are decoded transparently by requests.
     """
+    bulk_mimetype = transport.FRAMES_MIME
 
-    def __init__(self, server="http://localhost:5000", token=None):
+    def __init__(self, server="http://localhost:5000", token=None, compression=None, compression_level=None):
+        """
+        :param server: The server url
+        :param token: The authentication token
+        :param compression: Content encoding of request bodies (gzip or zstd), default from NLPIPE_COMPRESSION,
+                            or gzip. Use 'none' to send uncompressed bodies.
+        :param compression_level: The compression level, default from NLPIPE_COMPRESSION_LEVEL
+        """
         self.server = server
         self.token = token
-
-    def request(self, method, url, headers=None, **kwargs):
+        if compression is None:
+            compression = os.environ.get("NLPIPE_COMPRESSION", "gzip")
+        self.compression = None if compression.lower() in ("", "none", "identity") else compression
+        if self.compression:
+            transport.check_encoding(self.compression)
+        self.compression_level = compression_level
+
+    def request(self, method, url, headers=None, compress=False, **kwargs):
+        """
+        :param compress: if True, compress the data (bytes or an iterator of byte chunks) if compression is enabled
+        """
         if headers is None:
             headers = {}
         if self.token:
             headers['Authorization'] = "Token {}".format(self.token)
+        data = kwargs.get('data')
+        if compress and self.compression and data is not None:
+            if isinstance(data, bytes):
+                if len(data) >= transport.MIN_COMPRESS_SIZE:
+                    kwargs['data'] = transport.compress(data, self.compression, self.compression_level)
+                    headers['Content-Encoding'] = self.compression
+            else:
+                kwargs['data'] = transport.compress_chunks(data, self.compression, self.compression_level)
+                headers['Content-Encoding'] = self.compression
         return requests.request(method, url, headers=headers, **kwargs)
 
     def head(self, url, **kwargs):
@@ -317,11 +1260,15 @@ class HTTPClient(Client):
         raise Exception("Cannot determine status for {module}/{id}; return code: {res.status_code}"
                         .format(**locals()))
 
-    def process(self, module, doc, id=None):
+    def process(self, module, doc, id=None, reset_error=False, reset_pending=False, priority=0, deadline=None,
+                job=None):
         url = "{self.server}/api/modules/{module}/".format(**locals())
-        if id is not None:
-            url = "{url}?id={id}".format(**locals())
-        res = self.post(url, data=doc.encode("utf-8"))
+        params = {"id": id, "reset_error": reset_error or None, "reset_pending": reset_pending or None,
+                  "priority": priority or None, "deadline": deadline, "job": job}
+        params = {k: v for (k, v) in params.items() if v is not None}
+        if params:
+            url = "{url}?{}".format(urlencode(params), **locals())
+        res = self.post(url, data=doc.encode("utf-8"), compress=True)
         if res.status_code != 202:
             raise Exception("Error on processing doc with {module}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
@@ -335,10 +1282,12 @@ class HTTPClient(Client):
         if res.status_code != 200:
             raise Exception("Error on getting result for {module}/{id}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
-        return res.text
+        return res.content if columnar.is_binary(format) else res.text
 
-    def get_task(self, module):
+    def get_task(self, module, worker=None):
         url = "{self.server}/api/modules/{module}/".format(**locals())
+        if worker is not None:
+            url = "{url}?{}".format(urlencode({"worker": worker}), **locals())
         res = self.get(url)
 
         if res.status_code == 404:
@@ -348,16 +1297,74 @@ class HTTPClient(Client):
                             .format(**locals()))
         return res.headers['ID'], res.text
 
+    def set_job_weight(self, module, job, weight):
+        url = "{self.server}/api/modules/{module}/jobs/{job}/weight".format(**locals())
+        res = self.put(url, data=str(weight))
+        if res.status_code != 204:
+            raise Exception("Error on setting weight for job {module}:{job}; return code: {res.status_code}:\n{res.text}"
+                            .format(**locals()))
+
+    def jobs(self, module):
+        url = "{self.server}/api/modules/{module}/jobs/".format(**locals())
+        res = self.get(url)
+        if res.status_code != 200:
+            raise Exception("Error on getting jobs for {module}; return code: {res.status_code}:\n{res.text}"
+                            .format(**locals()))
+        return res.json()
+
+    def job_status(self, module, job):
+        url = "{self.server}/api/modules/{module}/jobs/{job}".format(**locals())
+        res = self.get(url)
+        if res.status_code != 200:
+            raise Exception("Error on getting status for job {module}:{job}; return code: {res.status_code}:\n"
+                            "{res.text}".format(**locals()))
+        return res.json()
+
+    def job_ids(self, module, job):
+        url = "{self.server}/api/modules/{module}/jobs/{job}/ids".format(**locals())
+        res = self.get(url)
+        if res.status_code != 200:
+            raise Exception("Error on getting ids for job {module}:{job}; return code: {res.status_code}:\n"
+                            "{res.text}".format(**locals()))
+        return res.json()
+
+    def heartbeat(self, module, id, worker=None):
+        url = "{self.server}/api/modules/{module}/{id}/heartbeat".format(**locals())
+        if worker is not None:
+            url = "{url}?{}".format(urlencode({"worker": worker}), **locals())
+        res = self.post(url)
+        if res.status_code != 204:
+            raise Exception("Error on heartbeat for task {module}:{id}; return code: {res.status_code}:\n{res.text}"
+                            .format(**locals()))
+
+    def release_task(self, module, id):
+        url = "{self.server}/api/modules/{module}/{id}/release".format(**locals())
+        res = self.post(url)
+        if res.status_code != 204:
+            raise Exception("Error on releasing task {module}:{id}; return code: {res.status_code}:\n{res.text}"
+                            .format(**locals()))
+
     def store_result(self, module, id, result):
         url = "{self.server}/api/modules/{module}/{id}".format(**locals())
         data = result.encode("utf-8")
-        res = self.put(url, data=data)
+        res = self.put(url, data=data, compress=True)
 
         if res.status_code != 204:
             raise Exception("Error on storing result for {module}:{id}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
 
 
+    def store_converted(self, module, id, format, converted, eager=False):
+        url = "{self.server}/api/modules/{module}/{id}/converted/{format}".format(**locals())
+        if eager:
+            url = "{url}?eager=1".format(**locals())
+        data = converted if isinstance(converted, bytes) else converted.encode("utf-8")
+        res = self.put(url, data=data, compress=True)
+        if res.status_code != 204:
+            raise Exception("Error on storing {format} for {module}:{id}; return code: {res.status_code}:\n"
+                            "{res.text}".format(**locals()))
+        return True
+
     def store_error(self, module, id, result):
         url = "{self.server}/api/modules/{module}/{id}".format(**locals())
         data = result.encode("utf-8")
@@ -376,26 +1383,129 @@ class HTTPClient(Client):
                             .format(**locals()))
         return res.json()
 
-    def bulk_result(self, module, ids, format=None):
+    def iter_results(self, module, ids, format=None):
+        """
+        Get results for multiple ids, streamed from the server and yielded as they arrive.
+        Results in a columnar format are binary, so they are always retrieved as frames
+        """
         url = "{self.server}/api/modules/{module}/bulk/result".format(**locals())
         if format is not None:
             url = "{url}?format={format}".format(**locals())
-        res = self.post(url, json=ids)
+        binary = columnar.is_binary(format)
+        mimetype = transport.FRAMES_MIME if binary else self.bulk_mimetype
+        res = self.post(url, json=list(ids), headers={'Accept': mimetype}, stream=True)
+        with res:
+            if res.status_code != 200:
+                raise Exception("Error on getting bulk results for {module}; "
+                                "return code: {res.status_code}:\n{res.text}".format(**locals()))
+            chunks = res.iter_content(chunk_size=transport.CHUNK_SIZE)
+            mimetype = res.headers.get('Content-Type', '').split(";")[0]
+            if mimetype == transport.FRAMES_MIME:
+                results = ((id, data if binary and status is None else data.decode("utf-8"), status)
+                           for (id, data, status) in transport.decode_frames(chunks))
+            elif mimetype == transport.NDJSON_MIME:
+                results = ((r['id'], r.get('result', r.get('error')), 'ERROR' if 'error' in r else None)
+                           for r in transport.decode_ndjson(chunks))
+            else:
+                results = ((id, result, None) for (id, result) in json.loads(res.content.decode("utf-8")).items())
+            for id, result, status in results:
+                if status == 'ERROR':
+                    raise Exception("Error on getting result for {module}/{id}:\n{result}".format(**locals()))
+                yield id, result
+
+    def iter_export(self, module, ids=None, job=None, format=None, after=None):
+        url = "{self.server}/api/modules/{module}/export".format(**locals())
+        return self._export(url, ids, job=job, format=format, after=after)
+
+    def iter_export_csv(self, module, ids=None, job=None):
+        url = "{self.server}/api/modules/{module}/export/csv".format(**locals())
+        return self._export(url, ids, job=job)
+
+    def iter_export_table(self, module, format="arrow", ids=None, job=None):
+        url = "{self.server}/api/modules/{module}/export/{format}".format(**locals())
+        return self._export(url, ids, job=job)
+
+    def _export(self, url, ids=None, **params):
+        params = {k: v for (k, v) in params.items() if v is not None}
+        if params:
+            url = "{url}?{}".format(urlencode(params), **locals())
+        if ids is None:
+            res = self.get(url, stream=True)
+        else:
+            res = self.post(url, json=list(ids), stream=True)
         if res.status_code != 200:
-            raise Exception("Error on getting bulk results for {module}; return code: {res.status_code}:\n{res.text}"
+            raise Exception("Error on exporting {url}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
+        return _iter_content(res)
+
+    def process_results(self, module, previous_module, ids, **kargs):
+        url = "{self.server}/api/modules/{module}/bulk/process_results".format(**locals())
+        params = dict(kargs, **{"from": previous_module})
+        params = {k: v for (k, v) in params.items() if v is not None and v is not False}
+        url = "{url}?{}".format(urlencode(params), **locals())
+        res = self.post(url, json=list(ids))
+        if res.status_code != 200:
+            raise Exception("Error on processing {previous_module} results with {module}; "
+                            "return code: {res.status_code}:\n{res.text}".format(**locals()))
         return res.json()
 
-    def bulk_process(self, module, docs, ids=None, reset_error=False, reset_pending=False):
+    def process_modules(self, modules, doc, id=None, **kargs):
+        # the server queues the document for each module of a comma separated list
+        return self.process(",".join(modules), doc, id=id, **kargs)
+
+    def bulk_process(self, module, docs, ids=None, reset_error=False, reset_pending=False, priority=0, deadline=None,
+                     job=None):
+        """
+        Add multiple documents to the processing queue.
+        The documents are streamed to the server (see bulk_mimetype), so docs and ids can be (lazy) iterators
+        of any length
+        """
         url = ("{self.server}/api/modules/{module}/bulk/process?reset_error={reset_error}&reset_pending={reset_pending}"\
-               .format(**locals()))
-        body = list(docs) if ids is None else dict(zip(ids, docs))
-        res = self.post(url, json=body)
+               "&priority={priority}".format(**locals()))
+        if deadline is not None:
+            url = "{url}&deadline={deadline}".format(**locals())
+        if job is not None:
+            url = "{url}&{}".format(urlencode({"job": job}), **locals())
+        if ids is None:
+            ids = itertools.repeat(None)
+        if self.bulk_mimetype == transport.FRAMES_MIME:
+            body = transport.encode_frames((id, doc, None) for (doc, id) in zip(docs, ids))
+        else:
+            body = transport.encode_ndjson({"id": id, "text": doc} for (doc, id) in zip(docs, ids))
+        res = self.post(url, data=transport.chunked(body), headers={'Content-type': self.bulk_mimetype}, compress=True)
         if res.status_code != 200:
             raise Exception("Error on bulk processfor {module}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
         return res.json()
 
+
+def _read_converted(fn, format):
+    if columnar.is_binary(format):
+        with open(fn, 'rb') as f:
+            return f.read()
+    with open(fn, encoding="UTF-8") as f:
+        return f.read()
+
+
+def _merge_csv(module, converted):
+    """Concatenate converted csv documents, keeping only the header of the first document"""
+    header = True
+    for id, csv, error in converted:
+        if error is not None:
+            logging.warning("Skipping {module}/{id} in csv export: {error}".format(**locals()))
+            continue
+        if not header:
+            csv = csv.split("\n", 1)[1] if "\n" in csv else ""
+        if csv:
+            header = False
+            yield csv.encode("utf-8") if csv.endswith("\n") else (csv + "\n").encode("utf-8")
+
+
+def _iter_content(res):
+    with res:
+        yield from res.iter_content(chunk_size=transport.CHUNK_SIZE)
+
+
 def get_client(servername, token=None):
     if servername.startswith("http:") or servername.startswith("https:"):
         logging.getLogger('requests').setLevel(logging.WARNING)
@@ -423,17 +1533,26 @@ if __name__ == '__main__':
 
     actions = {name: action_parser.add_parser(name) 
                for name in ('status', 'result', 'check', 'process', 'process_inline',
-                            'bulk_status', 'bulk_result', 'store_result', 'store_error')}
+                            'bulk_status', 'bulk_result', 'store_result', 'store_error', 'jobs', 'job_status',
+                            'export', 'export_csv', 'export_table')}
+    actions['job_status'].add_argument('job', help="Job name")
     for action in 'status', 'result', 'store_result', 'store_error':
         actions[action].add_argument('id', help="Task ID")
 
     for action in 'bulk_status', 'bulk_result':
         actions[action].add_argument('ids', nargs="+", help="Task IDs")
-    for action in 'result', 'process_inline', 'bulk_result':
+    for action in 'result', 'process_inline', 'bulk_result', 'export':
         actions[action].add_argument("--format", help="Optional output format to retrieve")
+    actions['export_table'].add_argument("--format", help="Columnar format: arrow (default) or parquet")
+    for action in 'export', 'export_csv', 'export_table':
+        actions[action].add_argument('ids', nargs="*", help="Task IDs (default: all results)")
+        actions[action].add_argument("--job", help="Export the results of this job")
+    actions['export'].add_argument("--after", help="Resume the export after this ID")
     for action in 'process', 'process_inline':
         actions[action].add_argument('doc', help="Document to process (use - to read from stdin")
         actions[action].add_argument('id', nargs="?", help="Optional explicit ID")
+        actions[action].add_argument("--priority", type=int, help="Priority (higher is processed earlier)")
+    actions['process'].add_argument("--job", help="Job or tenant name for fair scheduling")
     for action in ('store_result', 'store_error'):
         actions[action].add_argument('result', help="Document to store (use - to read from stdin")
     
@@ -450,6 +1569,8 @@ if __name__ == '__main__':
 
     action = args.pop('action')
     args = {k: v for (k, v) in args.items() if v}
+    if action in ("export", "export_csv", "export_table"):
+        args['out'] = sys.stdout.buffer
     result = getattr(client, action)(**args)
     if action == "get_task":
         id, doc = result
@@ -458,6 +1579,8 @@ if __name__ == '__main__':
             print(doc)
     elif action in ("store_result", "store_error"):
         pass
+    elif isinstance(result, bytes):
+        sys.stdout.buffer.write(result)
     else:
         if result is not None:
             print(result)
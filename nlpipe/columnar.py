@@ -0,0 +1,178 @@
+"""
+Columnar token tables of parse results, in the arrow (Arrow IPC stream) and parquet formats
+
+Modules that declare a table_schema (see nlpipe.module.Module) can convert their results to these formats.
+A table_schema is a sequence of (name, type) columns, where the type is one of INT (32 bit integers such as
+token ids, offsets and parent indices), STR (e.g. words and lemmas) or CATEGORY (dictionary encoded strings such
+as POS tags and relations). The first column is the document id, which should be a CATEGORY column
+since it has the same value on every row of a document.
+
+Unlike csv, these formats can be loaded without parsing, so merged exports of many documents (see merge)
+can be loaded in seconds. Requires the optional pyarrow package.
+"""
+import logging
+from itertools import repeat
+from typing import Iterable, Iterator, Sequence, Tuple
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ("arrow", "parquet")
+
+MIMETYPES = {"arrow": "application/vnd.apache.arrow.stream",
+             "parquet": "application/vnd.apache.parquet"}
+
+# Column types
+INT = "int"
+STR = "str"
+CATEGORY = "category"
+
+# Number of rows per record batch (or parquet row group) in merged tables
+BATCH_ROWS = 65536
+
+
+def is_binary(format: str) -> bool:
+    """Is the format a binary (columnar) format, i.e. are results converted to bytes rather than strings?"""
+    return format in FORMATS
+
+
+def check_pyarrow():
+    if pyarrow is None:
+        raise ValueError("The columnar formats {} require the pyarrow package".format(", ".join(FORMATS)))
+
+
+def _type(type):
+    if type == INT:
+        return pyarrow.int32()
+    if type == STR:
+        return pyarrow.string()
+    if type == CATEGORY:
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    raise ValueError("Unknown column type: {type!r}".format(**locals()))
+
+
+def get_schema(schema: Sequence[Tuple[str, str]]):
+    """Get the arrow schema of a table_schema"""
+    check_pyarrow()
+    return pyarrow.schema([(name, _type(type)) for (name, type) in schema])
+
+
+def _array(values, type):
+    if type == CATEGORY:
+        return pyarrow.array(values, type=pyarrow.string()).dictionary_encode()
+    return pyarrow.array(values, type=_type(type))
+
+
+def to_table(schema: Sequence[Tuple[str, str]], id, columns: Sequence[Sequence]):
+    """
+    Build an arrow table of a document
+    :param schema: the table_schema of the module
+    :param id: the document id, which is used for the first column
+    :param columns: the values of the other columns, as a sequence of values per column
+    """
+    check_pyarrow()
+    n = len(columns[0]) if columns else 0
+    arrays = [pyarrow.array(repeat(str(id), n), type=pyarrow.string(), size=n).dictionary_encode()]
+    arrays += [_array(values, type) for (values, (_name, type)) in zip(columns, schema[1:])]
+    return pyarrow.Table.from_arrays(arrays, schema=get_schema(schema))
+
+
+def transpose(rows: Iterable[Sequence], n: int) -> list:
+    """Turn rows (of n values) into a list of n columns"""
+    columns = [list(column) for column in zip(*rows)]
+    return columns or [[] for _i in range(n)]
+
+
+class _Chunks(object):
+    """Write-only file-like object that collects the written bytes until they are taken"""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _writer(sink, schema, format):
+    if format == "arrow":
+        return pyarrow.ipc.new_stream(sink, schema)
+    if format == "parquet":
+        return pyarrow.parquet.ParquetWriter(sink, schema)
+    raise ValueError("Unknown columnar format: {format!r}".format(**locals()))
+
+
+def encode(schema: Sequence[Tuple[str, str]], id, columns: Sequence[Sequence], format: str) -> bytes:
+    """Encode the columns of a document (see to_table) in the given format"""
+    check_pyarrow()
+    table = to_table(schema, id, columns)
+    sink = pyarrow.BufferOutputStream()
+    writer = _writer(sink, table.schema, format)
+    writer.write_table(table)
+    writer.close()
+    return sink.getvalue().to_pybytes()
+
+
+def decode(data: bytes, format: str="arrow"):
+    """Read a table in the given format"""
+    check_pyarrow()
+    if format == "arrow":
+        return pyarrow.ipc.open_stream(data).read_all()
+    if format == "parquet":
+        return pyarrow.parquet.read_table(pyarrow.BufferReader(data))
+    raise ValueError("Unknown columnar format: {format!r}".format(**locals()))
+
+
+def _combine(tables):
+    return pyarrow.concat_tables(tables).unify_dictionaries().combine_chunks()
+
+
+def merge(schema: Sequence[Tuple[str, str]], documents: Iterable[Tuple[str, bytes, Exception]], format: str,
+          batch_rows: int=BATCH_ROWS) -> Iterator[bytes]:
+    """
+    Merge converted documents into a single table, written as record batches (or row groups) of
+    about batch_rows rows while the documents are read, so memory use does not grow with the number of documents.
+    :param schema: the table_schema of the module
+    :param documents: (id, arrow data, error) triples as given by Client.iter_outcomes, documents with an error
+                      are skipped
+    :param format: the format of the merged table
+    :return: a generator of bytes chunks
+    """
+    check_pyarrow()
+    sink = _Chunks()
+    writer = _writer(sink, get_schema(schema), format)
+    tables, n = [], 0
+    for id, data, error in documents:
+        if error is not None:
+            logging.warning("Skipping {id} in {format} export: {error}".format(**locals()))
+            continue
+        table = decode(data)
+        tables.append(table)
+        n += table.num_rows
+        if n >= batch_rows:
+            writer.write_table(_combine(tables))
+            tables, n = [], 0
+            yield sink.take()
+    if tables:
+        writer.write_table(_combine(tables))
+    writer.close()
+    yield sink.take()
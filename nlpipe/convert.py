@@ -0,0 +1,124 @@
+"""
+Conversion of results to other formats in a pool of worker processes
+
+Converting results (e.g. parsing CoreNLP XML or NAF) is CPU bound, so bulk conversions are spread over a pool
+of NLPIPE_CONVERT_PROCESSES processes (default: the number of CPUs, 0 to convert in the calling process).
+At most max_inflight documents are being converted (or waiting to be converted) at any time,
+so memory use is bounded regardless of the number of documents. The bulk result endpoints yield the
+converted documents in order of completion, so one slow document does not hold up the stream.
+"""
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, Optional, Tuple
+
+from nlpipe.module import get_module
+
+_POOLS = {}  # pid : ProcessPoolExecutor
+_MODULES = {}  # name : Module, cached per (pool) process
+
+
+def get_pool_size() -> int:
+    size = os.environ.get("NLPIPE_CONVERT_PROCESSES")
+    return (os.cpu_count() or 1) if size is None else int(size)
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    """Get the conversion pool of this process, or None if conversions should not use a pool"""
+    size = get_pool_size()
+    if size < 1:
+        return None
+    pid = os.getpid()
+    if pid not in _POOLS:
+        _POOLS[pid] = ProcessPoolExecutor(max_workers=size)
+    return _POOLS[pid]
+
+
+def convert(module: str, id: str, result: str, format: str) -> str:
+    """Convert a single result, reusing the module instance"""
+    if module not in _MODULES:
+        # noinspection PyUnresolvedReferences
+        import nlpipe.modules  # forces registration
+        _MODULES[module] = get_module(module)
+    return _MODULES[module].convert(id, result, format)
+
+
+class Converted(object):
+    """Marks a result that is already converted (e.g. from a cache), so convert_all passes it on as is"""
+
+    def __init__(self, value: str):
+        self.value = value
+
+
+def _outcome(result):
+    """Get the (converted, error) outcome for a result that does not need converting, or None"""
+    if isinstance(result, Converted):
+        return result.value, None
+    if isinstance(result, Exception):
+        return None, result
+    return None
+
+
+def _done(outcome):
+    future = Future()
+    future.set_result(outcome)
+    return future
+
+
+def _try_convert(module, id, result, format):
+    try:
+        return convert(module, id, result, format), None
+    except Exception as e:
+        logging.exception("Error converting document {id} to {format}".format(**locals()))
+        return None, e
+
+
+def convert_all(module: str, results: Iterable[Tuple[str, str]], format: str, max_inflight: int=None,
+                ordered: bool=True) -> Iterator[Tuple[str, Optional[str], Optional[Exception]]]:
+    """
+    Convert the (id, result) pairs in the conversion pool, yielding (id, converted, None) triples,
+    or (id, None, exception) if a conversion failed.
+    A result can also be an exception (e.g. if it could not be read) or a Converted result, which are
+    passed on without converting (but in the same order as the other results).
+    :param max_inflight: maximum number of documents submitted to the pool at any time (default: 4 per process)
+    :param ordered: if True, yield the documents in input order, otherwise in order of completion
+    """
+    pool = get_pool()
+    if pool is None:
+        for id, result in results:
+            yield (id,) + (_outcome(result) or _try_convert(module, id, result, format))
+        return
+    if max_inflight is None:
+        max_inflight = 4 * get_pool_size()
+    inflight = OrderedDict()  # future : id, in order of submission
+    try:
+        for id, result in results:
+            outcome = _outcome(result)
+            if outcome is not None:
+                future = _done(outcome)
+            else:
+                future = pool.submit(_try_convert, module, id, result, format)
+            inflight[future] = id
+            if len(inflight) >= max_inflight:
+                yield from _collect(inflight, ordered)
+        while inflight:
+            yield from _collect(inflight, ordered)
+    except BrokenProcessPool:
+        _POOLS.pop(os.getpid(), None)
+        raise
+    finally:
+        for future in inflight:
+            future.cancel()
+
+
+def _collect(inflight, ordered):
+    """Remove and yield the first submitted (if ordered) or the first completed futures from inflight"""
+    if ordered:
+        done = [next(iter(inflight))]
+    else:
+        done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+    for future in done:
+        id = inflight.pop(future)
+        yield (id,) + future.result()
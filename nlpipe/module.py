@@ -1,10 +1,51 @@
-from typing import Iterable
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from nlpipe import columnar, sentcache
 
 
 class Module(object):
     """Abstract base class for NLPipe modules"""
     name = None
-    
+
+    # Maximum number of concurrent requests to each backend server from all workers on this host (None: no limit)
+    # Can be overridden with the <NAME>_MAX_CONCURRENCY (e.g. CORENLP_PARSE_MAX_CONCURRENCY)
+    # or NLPIPE_MAX_CONCURRENCY environment variables
+    max_concurrency = None
+
+    # Formats that workers convert results to right after processing, so they are stored with the result
+    # Can be overridden with a comma separated list in the <NAME>_EAGER_FORMATS (e.g. ALPINO_EAGER_FORMATS=csv)
+    # or NLPIPE_EAGER_FORMATS environment variables
+    eager_formats = ()
+
+    # The (name, type) columns of the token table of a result, starting with the document id (see nlpipe.columnar)
+    # Modules with a table_schema can convert results to the columnar formats (arrow, parquet), see table_columns
+    table_schema = None
+
+    # Whether results can be joined from separately parsed sentences, so parses can be reused from the sentence cache
+    # if NLPIPE_SENTENCE_CACHE is set (see nlpipe.sentcache, split_sentences, parse_sentences and join_sentences)
+    sentence_cache = False
+
+    def get_max_concurrency(self) -> Optional[int]:
+        """Get the per-backend concurrency limit for this module, see max_concurrency"""
+        env = "{}_MAX_CONCURRENCY".format(self.name.upper())
+        value = os.environ.get(env, os.environ.get("NLPIPE_MAX_CONCURRENCY"))
+        if value:
+            return int(value)
+        return self.max_concurrency
+
+    def get_eager_formats(self) -> Iterable[str]:
+        """Get the formats to convert results to after processing, see eager_formats"""
+        env = "{}_EAGER_FORMATS".format(self.name.upper())
+        value = os.environ.get(env, os.environ.get("NLPIPE_EAGER_FORMATS"))
+        if value is not None:
+            return [format.strip() for format in value.split(",") if format.strip()]
+        return self.eager_formats
+
+    def get_parser_version(self) -> str:
+        """Get the parser version for the sentence cache from the <NAME>_PARSER_VERSION environment variable"""
+        return os.environ.get("{}_PARSER_VERSION".format(self.name.upper()), "")
+
     def check_status(self):
         """Check the status of this module and return an error if not available (e.g. service or tool not found)"""
         raise NotImplementedError()
@@ -13,8 +54,35 @@ class Module(object):
         """Process the given text and return the result"""
         raise NotImplementedError()
 
+    def split_sentences(self, text) -> List[Tuple[Optional[int], str]]:
+        """Split the text into (start offset, sentence) pairs for the sentence cache"""
+        return sentcache.split_sentences(text)
+
+    def normalize_sentence(self, sentence: str) -> str:
+        """Normalize the sentence for the sentence cache key, sentences with the same parse should be equal"""
+        return " ".join(sentence.split())
+
+    def parse_sentences(self, sentences: List[str]) -> List[str]:
+        """Parse the sentences and return the (cacheable) parse of each sentence"""
+        raise NotImplementedError()
+
+    def join_sentences(self, text, sentences: List[Tuple[Optional[int], str]], parses: List[str]) -> str:
+        """
+        Join the parses of the sentences into the result for the text
+        :param text: the document
+        :param sentences: the (start offset, sentence) pairs of the document, see split_sentences
+        :param parses: the parse of each sentence, see parse_sentences
+        """
+        raise NotImplementedError()
+
+    def table_columns(self, id, result) -> list:
+        """Get the columns of the token table of the result (except the document id) as a list of values per column"""
+        raise NotImplementedError()
+
     def convert(self, id, result, format):
         """Convert the given result to the given format (e.g. 'xml'), if possible or raise an exception if not"""
+        if format in columnar.FORMATS and self.table_schema is not None:
+            return columnar.encode(self.table_schema, id, self.table_columns(id, result), format)
         raise ValueError("Module {self.name} results cannot be converted to {format}".format(**locals()))
 
     @classmethod
@@ -2,6 +2,7 @@
 Wrapper around the RUG Alpino Dependency parser
 The module expects either ALPINO_HOME to point at the alpino installation dir
 or an alpino server to be running at ALPINO_SERVER (default: localhost:5002)
+ALPINO_SERVER can also be a comma separated list of servers, see nlpipe.backends
 
 You can use the following command to get the server running: (see github.com/vanatteveldt/alpinoserver)
 docker run -dp 5002:5002 vanatteveldt/alpino-server
@@ -21,7 +22,10 @@ import itertools
 import tempfile
 from io import StringIO
 
+from nlpipe.backends import get_backends
+from nlpipe.columnar import CATEGORY, INT, STR, transpose
 from nlpipe.module import Module
+from nlpipe.sentcache import get_sentence_cache
 
 log = logging.getLogger(__name__)
 
@@ -31,6 +35,12 @@ CMD_TOKENIZE = ["Tokenization/tok"]
 
 class AlpinoParser(Module):
     name = "alpino"
+    table_schema = [("doc", CATEGORY), ("id", INT), ("sentence", INT), ("offset", INT), ("word", STR),
+                    ("lemma", STR), ("pos", CATEGORY), ("rel", CATEGORY), ("parent", INT)]
+
+    @property
+    def backends(self):
+        return get_backends(os.environ.get('ALPINO_SERVER', 'http://localhost:5002'), self.get_max_concurrency())
 
     def check_status(self):
         if 'ALPINO_HOME' in os.environ:
@@ -38,38 +48,82 @@ class AlpinoParser(Module):
             if not os.path.exists(alpino_home):
                 raise Exception("Alpino not found at ALPINO_HOME={alpino_home}".format(**locals()))
         else:
-            alpino_server = os.environ.get('ALPINO_SERVER', 'http://localhost:5002')
-            r = requests.get(alpino_server)
-            if r.status_code != 200:
-                raise Exception("No server found at {alpino_server} and ALPINO_HOME not set".format(**locals()))
+            self.backends.check(_check_server)
+
+    sentence_cache = True
 
     def process(self, text):
+        cache = get_sentence_cache(self)
+        if cache is not None:
+            return cache.process(self, text)
+        return self._parse(text)
+
+    def _parse(self, text):
         if 'ALPINO_HOME' in os.environ:
             tokens = tokenize(text)
             return parse_raw(tokens)
         else:
-            alpino_server = os.environ.get('ALPINO_SERVER', 'http://localhost:5002')
-            url = "{alpino_server}/parse".format(**locals())
-            body = {"text": text, "output": "dependencies"}
-            r = requests.post(url, json=body)
+            with self.backends.request() as alpino_server:
+                url = "{alpino_server}/parse".format(**locals())
+                body = {"text": text, "output": "dependencies"}
+                r = requests.post(url, json=body)
             if r.status_code != 200:
                 raise Exception("Error calling Alpino at {alpino_server}: {r.status_code}:\n{r.content!r}"
                                 .format(**locals()))
             return r.text
 
+    def split_sentences(self, text):
+        if 'ALPINO_HOME' in os.environ:
+            # the alpino tokenizer gives a sentence per line, so cached sentences are split as alpino would
+            return [(None, line) for line in tokenize(text).split("\n") if line.strip()]
+        return super().split_sentences(text)
+
+    def parse_sentences(self, sentences):
+        if 'ALPINO_HOME' in os.environ:
+            parse = parse_raw("\n".join(sentences) + "\n")
+        else:
+            parse = self._parse("\n\n".join(sentences))
+        parses = [_sentence_parse([triples]) for triples in _split_parse(parse)]
+        if len(parses) != len(sentences):
+            # alpino split the sentences differently, so parse them one at a time
+            parses = [_sentence_parse(_split_parse(self._parse(sentence))) for sentence in sentences]
+        return parses
+
+    def join_sentences(self, text, sentences, parses):
+        lines = []
+        n = 0  # number of sentences so far
+        for parse in parses:
+            sentence_n = 0
+            for line in parse.split("\n"):
+                if line:
+                    triple, sid = line.rsplit("|", 1)
+                    sentence_n = max(sentence_n, int(sid))
+                    lines.append("{triple}|{}".format(n + int(sid), **locals()))
+            n += sentence_n
+        return "\n".join(lines) + "\n"
+
+    def table_columns(self, id, result):
+        return transpose(interpret_parse(result), len(self.table_schema) - 1)
+
     def convert(self, id, result, format):
-        assert format in ["csv"]
+        if format != "csv":
+            return super().convert(id, result, format)
         s = StringIO()
         w = csv.writer(s)
-        w.writerow(["doc", "id", "sentence", "offset", "word", "lemma", "pos", "rel", "parent"])
-        for line in interpret_parse(result):
-            w.writerow((id,) + line)
+        w.writerow([name for (name, _type) in self.table_schema])
+        w.writerows([(id, *line) for line in interpret_parse(result)])
         return s.getvalue()
 
 
 AlpinoParser.register()
 
 
+def _check_server(alpino_server):
+    r = requests.get(alpino_server)
+    if r.status_code != 200:
+        raise Exception("No server found at {alpino_server} and ALPINO_HOME not set".format(**locals()))
+
+
 def _call_alpino(command, input):
     alpino_home = os.environ['ALPINO_HOME']
     p = subprocess.Popen(command, shell=False, stdin=subprocess.PIPE,
@@ -101,38 +155,61 @@ def get_fields(parse):
                 yield row + [sid]
     else:
         for line in parse.split("\n"):
-            if line.strip():
-                yield line.strip().split("|")
+            line = line.strip()
+            if line:
+                yield line.split("|")
+
+
+def _split_parse(parse):
+    """Split the fields of the triples of a parse into a list of triples per sentence, in order of sentence id"""
+    sentences = {}  # sid : triples
+    for line in get_fields(parse):
+        sentences.setdefault(int(line[-1]), []).append([str(field) for field in line[:-1]])
+    return [sentences[sid] for sid in sorted(sentences)]
+
+
+def _sentence_parse(sentences):
+    """Format the triples of one or more sentences as a cached parse, numbering the sentences from 1"""
+    return "\n".join("|".join(triple + [str(sid)])
+                     for (sid, triples) in enumerate(sentences, start=1) for triple in triples)
 
 
 def interpret_parse(parse):
-    rels = {}  # child: (rel, parent)
+    """
+    Interpret the dependency triples of an alpino parse, yielding a
+    (token id, sentence, offset, word, lemma, pos1, relation, parent token id) tuple per token,
+    in order of sentence and offset. Unknown POS tags are logged once per document.
+    """
+    posmap = POSMAP
+    unknown = {}  # major pos : number of tokens
+    tokens = {}  # (sid, begin) : (word, lemma, pos1)
+    rels = {}  # (sid, begin) : (rel, (sid, begin) of the parent or None)
     for line in get_fields(parse):
         assert len(line) == 16
-        sid = int(line[-1])
+        sid = int(line[15])
         func, rel = line[7].split("/")
-        child = interpret_token(sid, *line[8:15])
-        if func == "top":
-            parent = None
-        else:
-            parent = interpret_token(sid, *line[:7])
-        rels[child] = (rel, parent)
+        pos1 = posmap.get(line[12], '?')
+        if pos1 == '?' and line[12] not in posmap:
+            unknown[line[12]] = unknown.get(line[12], 0) + 1
+        child = (sid, int(line[10]))
+        tokens[child] = (line[9], line[8], pos1)
+        rels[child] = (rel, None if func == "top" else (sid, int(line[2])))
+    if unknown:
+        log.warning("Unknown POS tag(s) in alpino parse: {}".format(
+            ", ".join("{} ({}x)".format(pos, n) for (pos, n) in sorted(unknown.items()))))
 
     # get tokenid for each token, preserving order
-    tokens = sorted(rels.keys(), key=lambda token: token[:2])
-    tokenids = {token: i for (i, token) in enumerate(tokens)}
-
-    for token in tokens:
-        (rel, parent) = rels[token]
-        tokenid = tokenids[token]
-        parentid = tokenids[parent] if parent is not None else None
-        yield (tokenid, ) + token + (rel, parentid)
+    keys = sorted(tokens)
+    tokenids = {key: i for (i, key) in enumerate(keys)}
+    for tokenid, key in enumerate(keys):
+        rel, parent = rels[key]
+        yield (tokenid, *key, *tokens[key], rel, tokenids[parent] if parent is not None else None)
 
 
 def interpret_token(sid, lemma, word, begin, _end, major_pos, _pos, full_pos):
     """Convert to raw alpino token into a (word, lemma, begin, pos1) tuple"""
     if major_pos not in POSMAP:
-        logging.warn("UNKNOWN POS: {major_pos}".format(**locals()))
+        log.warning("UNKNOWN POS: {major_pos}".format(**locals()))
     pos1 = POSMAP.get(major_pos, '?')
     return sid, int(begin), word, lemma, pos1
 
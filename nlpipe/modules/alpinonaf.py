@@ -2,6 +2,7 @@
 Wrapper around the RUG Alpino Dependency parser using NAF
 The module expects either ALPINO_HOME to point at the alpino installation dir
 or an alpino server to be running at ALPINO_SERVER (default: localhost:5002)
+ALPINO_SERVER can also be a comma separated list of servers, see nlpipe.backends
 
 You can use the following command to get the server running: (see github.com/vanatteveldt/alpinoserver)
 docker run -dp 5002:5002 vanatteveldt/alpino-server
@@ -13,10 +14,13 @@ import csv
 import logging
 import os
 from io import StringIO, BytesIO
+from itertools import repeat
 
 import requests
-from KafNafParserPy import KafNafParser
+from lxml import etree
 
+from nlpipe.backends import get_backends
+from nlpipe.columnar import CATEGORY, INT, STR
 from nlpipe.module import Module
 from .alpino import POSMAP
 
@@ -24,64 +28,169 @@ log = logging.getLogger(__name__)
 
 
 class AlpinoClient(object):
+    @property
+    def backends(self):
+        return get_backends(os.environ.get('ALPINO_SERVER', 'http://localhost:5002'), self.get_max_concurrency())
+
     def check_status(self):
-        alpino_server = os.environ.get('ALPINO_SERVER', 'http://localhost:5002')
+        self.backends.check(self._check_server)
+
+    def _check_server(self, alpino_server):
         r = requests.get(alpino_server)
         if r.status_code != 200:
             raise Exception("No server found at {alpino_server}".format(**locals()))
 
     def process(self, text):
         modules = ",".join(self.modules)
-        alpino_server = os.environ.get('ALPINO_SERVER', 'http://localhost:5002')
-        url = "{alpino_server}/parse/{modules}".format(**locals())
-        r = requests.post(url, text.encode("utf-8"))
+        with self.backends.request() as alpino_server:
+            url = "{alpino_server}/parse/{modules}".format(**locals())
+            r = requests.post(url, text.encode("utf-8"))
         r.raise_for_status()
         return r.content.decode("utf-8")
 
-    def _csv_header(self):
-        return ["doc_id", "token_id", "para", "sentence", "offset", "token",
-                "lemma", "POS", "pos1", "parent", "relation"]
-
-    def _csv_row(self, memo, term, token):
-        def _int(x):
-            return None if x is None else int(x)
-        def _id_int(x):
-            """Convert term ids ('t_12') into integer values (12)"""
-            return int(x.replace("t_", ""))
-        pos = term.get_pos()
-        tid = term.get_id()
-        yield _id_int(tid)
-        yield from (_int(x) for x in (token.get_para(), token.get_sent(), token.get_offset()))
-        yield from (token.get_text(), term.get_lemma(), pos, POSMAP[pos])
-        if tid in memo['deps']:
-            rel, parent = memo['deps'][tid]
-            yield from [_id_int(parent), rel.split("/")[-1]]
-        else:
-            yield from [None, None]
-
-    def _csv_memo(self, naf):
-        return dict(deps={dep.get_to(): (dep.get_function(), dep.get_from())
-                          for dep in naf.get_dependencies()})
+    # the NAF layers needed for the csv output, see read_naf
+    naf_layers = ("text", "terms", "deps")
+
+    table_schema = [("doc_id", CATEGORY), ("token_id", INT), ("para", INT), ("sentence", INT), ("offset", INT),
+                    ("token", STR), ("lemma", STR), ("POS", CATEGORY), ("pos1", CATEGORY), ("parent", INT),
+                    ("relation", CATEGORY)]
+
+    def _csv_columns(self, naf, tids, tokens):
+        """
+        Get the csv columns (except doc_id) as lists with a value per row
+        :param tids: the term id of every row
+        :param tokens: the (para, sent, offset, text) of the token of every row
+        """
+        paras, sents, offsets, texts = zip(*tokens) if tokens else ((), (), (), ())
+        lemmas, pos = naf.lemmas, naf.pos
+        deps = [naf.deps.get(tid) for tid in tids]
+        return [[_id_int(tid) for tid in tids],
+                [_int(x) for x in paras], [_int(x) for x in sents], [_int(x) for x in offsets], texts,
+                [lemmas[tid] for tid in tids], [pos[tid] for tid in tids], [POSMAP[pos[tid]] for tid in tids],
+                [dep and _id_int(dep[1]) for dep in deps], [dep and dep[0].split("/")[-1] for dep in deps]]
+
+    def table_columns(self, id, result):
+        naf = read_naf(result, self.naf_layers)
+        # a row per token in the span of every term
+        tids = [tid for tid, span in naf.spans for _token in span]
+        tokens = [naf.tokens[token] for _tid, span in naf.spans for token in span]
+        return self._csv_columns(naf, tids, tokens)
 
     def convert(self, id, result, format):
-        assert format == "csv"
-        naf = KafNafParser(BytesIO(result.encode("utf-8")))
-        memo = self._csv_memo(naf)
-        tokendict = {token.get_id(): token for token in naf.get_tokens()}
+        if format != "csv":
+            return super().convert(id, result, format)
         s = StringIO()
         w = csv.writer(s)
-        w.writerow(self._csv_header())
-        for term in naf.get_terms():
-            tokens = [tokendict[id] for id in term.get_span().get_span_ids()]
-            for token in tokens:
-                tid = term.get_id()
-                pos = term.get_pos()
-                pos1 = POSMAP[pos]
-                row = [id] + list(self._csv_row(memo, term, token))
-                w.writerow(row)
+        w.writerow([name for (name, _type) in self.table_schema])
+        w.writerows(zip(repeat(id), *self.table_columns(id, result)))
         return s.getvalue()
 
 
+def _int(x):
+    return None if x is None else int(x)
+
+
+def _id_int(x):
+    """Convert term ids ('t_12') into integer values (12)"""
+    return int(x.replace("t_", ""))
+
+
+class NAFLayers(object):
+    """The layers of a NAF document needed for the csv output, see read_naf"""
+
+    def __init__(self):
+        self.tokens = {}  # token id : (para, sent, offset, text)
+        self.spans = []  # (term id, [token ids]) in document order
+        self.lemmas = {}  # term id : lemma
+        self.pos = {}  # term id : pos tag
+        self.deps = {}  # term id : (rfunc, parent term id)
+        self.entities = {}  # term id : (entity id, entity type)
+        self.corefs = {}  # head term id : coref id
+
+
+# xpath queries for the (first) span targets of the terms, used if every term span has exactly one target
+_SPAN_TARGETS = etree.XPath("term/span[1]/target/@id", smart_strings=False)
+_MULTI_TARGET_SPANS = etree.XPath("boolean(term[span[1]/target[2]])")
+
+
+def _spans(layer, n):
+    """Get the ids of the targets in the (first) span of each of the n term children of layer,
+    as term.get_span_ids() does, using a (much faster) xpath query if every span has one target"""
+    if not _MULTI_TARGET_SPANS(layer):
+        targets = _SPAN_TARGETS(layer)
+        if len(targets) == n:
+            return [[target] for target in targets]
+    spans = []
+    for term in layer.iterchildren("term"):
+        targets = []
+        for span in term.iterchildren("span"):
+            targets = [t.get("id") for t in span.iterchildren("target")]
+            break
+        spans.append(targets)
+    return spans
+
+
+# layer : (element, id attribute in NAF, id attribute in KAF)
+_NAF_LAYERS = {"text": ("wf", "id", "wid"), "terms": ("term", "id", "tid"), "deps": ("dep", None, None),
+               "entities": ("entity", "id", "eid"), "coreferences": ("coref", "id", "coid")}
+
+
+def read_naf(naf: str, layers=tuple(_NAF_LAYERS)) -> NAFLayers:
+    """
+    Read the given layers (text, terms, deps, entities and/or coreferences) of a NAF (or KAF) document,
+    keeping only the attributes needed for the csv output.
+    The document is parsed incrementally: every layer is discarded once it is read, and parsing stops
+    as soon as all requested layers are read, so the rest of the document (e.g. constituency trees) is skipped.
+    As in KafNafParserPy, only the first layer of each type is used and the last token, dependency,
+    entity or coreference with the same key wins.
+    """
+    result = NAFLayers()
+    todo = set(layers)
+    context = etree.iterparse(BytesIO(naf.encode("utf-8")), events=("end",), tag=list(todo))
+    for _event, layer in context:
+        root = layer.getparent()
+        if root is None or root.getparent() is not None or layer.tag not in todo:
+            continue
+        todo.remove(layer.tag)
+        element, naf_id, kaf_id = _NAF_LAYERS[layer.tag]
+        id_attr = kaf_id if root.tag == "KAF" else naf_id
+        if element == "wf":
+            for wf in layer.iterchildren("wf"):
+                result.tokens[wf.get(id_attr)] = (wf.get("para"), wf.get("sent"), wf.get("offset"), wf.text)
+        elif element == "term":
+            tids = []
+            for term in layer.iterchildren("term"):
+                tid = term.get(id_attr)
+                tids.append(tid)
+                result.lemmas[tid] = term.get("lemma")
+                result.pos[tid] = term.get("pos")
+            result.spans = list(zip(tids, _spans(layer, len(tids))))
+        elif element == "dep":
+            for dep in layer.iterchildren("dep"):
+                result.deps[dep.get("to")] = (dep.get("rfunc"), dep.get("from"))
+        elif element == "entity":
+            for elem in layer.iterchildren("entity"):
+                entity = (elem.get(id_attr), elem.get("type"))
+                for references in elem.iterchildren("references"):
+                    for span in references.iterchildren("span"):
+                        for target in span.iterchildren("target"):
+                            result.entities[target.get("id")] = entity
+        elif element == "coref":
+            for elem in layer.iterchildren("coref"):
+                id = elem.get(id_attr)
+                for span in elem.iterchildren("span"):
+                    head = next((t.get("id") for t in span.iterchildren("target") if t.get("head") is not None),
+                                None)
+                    result.corefs[head] = id
+        if not todo:
+            break
+        layer.clear()
+        # also drop the preceding layers that are not needed, e.g. the header and constituency trees
+        while layer.getprevious() is not None:
+            del root[0]
+    return result
+
+
 class AlpinoNERCParser(AlpinoClient, Module):
     name = "alpinonerc"
     modules = ["alpino", "nerc"]
@@ -92,40 +201,17 @@ class AlpinoCorefPipe(AlpinoClient, Module):
     name = "alpinocoref"
     modules = ["alpino", "nerc", "coref"]
 
-    def _csv_header(self):
-        return super()._csv_header() + ["ner_id", "NER", "coref_id"]
+    naf_layers = AlpinoClient.naf_layers + ("entities", "coreferences")
+    table_schema = AlpinoClient.table_schema + [("ner_id", STR), ("NER", CATEGORY), ("coref_id", STR)]
 
-    def _csv_memo(self, naf):
-        memo = super()._csv_memo(naf)
+    def _csv_columns(self, naf, tids, tokens):
+        columns = super()._csv_columns(naf, tids, tokens)
         # NER data
-        memo['entities'] = {} # term_id : entity
-        for ent in naf.get_entities():
-            for ref in ent.get_references():
-                for span in ref:
-                    for target in span:
-                        memo['entities'][target.get_id()] = ent
+        entities = [naf.entities.get(tid) for tid in tids]
+        columns += [[e and e[0] for e in entities], [e and e[1] for e in entities]]
         # COREF data
-        memo['coref'] = {} # term_id : coref
-        for coref in naf.get_corefs():
-            for span in coref.get_spans():
-                memo['coref'][span.get_id_head()] = coref
-        return memo
-
-    def _csv_row(self, memo, term, token):
-        row = list(super()._csv_row(memo, term, token))
-        # NER data
-        ent = memo['entities'].get(term.get_id())
-        if ent:
-            row += [ent.get_id(), ent.get_type()]
-        else:
-            row += [None, None]
-        coref = memo['coref'].get(term.get_id())
-        if coref:
-            row += [coref.get_id()]
-        else:
-            row += [None]
-
-        return row
+        columns.append([naf.corefs.get(tid) for tid in tids])
+        return columns
 
 
 AlpinoCorefPipe.register()
@@ -2,20 +2,27 @@
 Wrapper around the CoreNLP server (http://nlp.stanford.edu/software/corenlp.shtml)
 
 Assumes a CoreNLP server is listening at CORENLP_HOST (default localhost:9000)
+CORENLP_HOST can also be a comma separated list of servers, see nlpipe.backends
 E.g. you can run:
 docker run -dp 9000:9000 chilland/corenlp-docker
 """
 
+from nlpipe.backends import get_backends
+from nlpipe.columnar import CATEGORY, INT, STR, transpose
 from nlpipe.module import Module
+from nlpipe.sentcache import get_sentence_cache
 from urllib.parse import urlencode
 import requests
 import json
 import os
-from io import StringIO
+import re
+from bisect import bisect_right
+from collections import OrderedDict
+from io import StringIO, BytesIO
 import csv
 import logging
 
-from corenlp_xml.document import Document
+from lxml import etree
 
 class CoreNLPBase(Module):
 
@@ -25,73 +32,228 @@ class CoreNLPBase(Module):
             server = os.getenv('CORENLP_HOST', 'http://localhost:9000')
         self.server = server
 
+    @property
+    def backends(self):
+        return get_backends(self.server, self.get_max_concurrency())
+
     def check_status(self):
-        res = requests.get(self.server)
+        self.backends.check(self._check_server)
+
+    def _check_server(self, server):
+        res = requests.get(server)
         if "http://nlp.stanford.edu/software/corenlp.shtml" not in res.text:
-            raise Exception("Unexpected answer at {self.server}".format(**locals()))
+            raise Exception("Unexpected answer at {server}".format(**locals()))
 
     def process(self, text):
+        cache = get_sentence_cache(self)
+        if cache is not None:
+            return cache.process(self, text)
+        return self._process(text)
+
+    def _process(self, text):
         query = urlencode({"properties": json.dumps(self.properties)})
-        url = "{self.server}/?{query}".format(**locals())
-        res = requests.post(url, data=text.encode("utf-8"))
+        with self.backends.request() as server:
+            url = "{server}/?{query}".format(**locals())
+            res = requests.post(url, data=text.encode("utf-8"))
         if res.status_code != 200:
             raise Exception("Error calling corenlp at {url}: {res.status_code}\n{res.content}".format(**locals()))
         return res.content.decode("utf-8")
 
+    def get_parser_version(self):
+        # the annotators are part of the cache key, as they determine the parse
+        return "{} {}".format(super().get_parser_version(), json.dumps(self.properties, sort_keys=True))
+
+    def normalize_sentence(self, sentence):
+        # white space is not normalized, as the parse contains character offsets
+        return sentence
+
+    def parse_sentences(self, sentences):
+        text = "\n\n".join(sentences)
+        starts, start = [], 0
+        for sentence in sentences:
+            starts.append(start)
+            start += len(sentence) + 2
+        starts = _utf16_offsets(text, starts)
+        ends = [start + _utf16_len(sentence) for (start, sentence) in zip(starts, sentences)]
+        parses = [[] for _sentence in sentences]
+        for sent in _sentence_elements(self._process(text)):
+            begin, end = _token_offsets(sent)
+            i = bisect_right(starts, begin) - 1
+            if end > ends[i]:
+                # a sentence spans more than one of the given sentences, so parse them one at a time
+                parses = [list(_sentence_elements(self._process(sentence))) for sentence in sentences]
+                break
+            _shift_offsets(sent, -starts[i])
+            parses[i].append(sent)
+        return ["".join(etree.tostring(sent, encoding="unicode") for sent in sents) for sents in parses]
+
+    def join_sentences(self, text, sentences, parses):
+        starts = _utf16_offsets(text, [start for (start, _sentence) in sentences])
+        out = ['<?xml version="1.0" encoding="UTF-8"?>\n<root>\n<document>\n<sentences>\n']
+        sid = 0
+        for start, parse in zip(starts, parses):
+            for sent in etree.fromstring("<sentences>{parse}</sentences>".format(**locals())):
+                sid += 1
+                sent.set("id", str(sid))
+                _shift_offsets(sent, start)
+                out.append(etree.tostring(sent, encoding="unicode"))
+        out.append("</sentences>\n</document>\n</root>\n")
+        return "".join(out)
+
 class CoreNLPParser(CoreNLPBase):
     name = "corenlp_parse"
     properties = {"annotators": "tokenize,ssplit,pos,lemma,ner,parse,dcoref", "outputFormat": "xml"}
 
+    table_schema = [("doc_id", CATEGORY), ("sentence", INT), ("token_id", INT), ("offset", INT), ("token", STR),
+                    ("lemma", STR), ("POS", CATEGORY), ("pos1", CATEGORY), ("NER", CATEGORY),
+                    ("relation", CATEGORY), ("parent", INT)]
+
+    def _rows(self, result):
+        for sent_id, tokens, parents in iter_sentences(result, dependencies=True):
+            for token_id, t in tokens.items():
+                rel, parent = parents.get(token_id, (None, None))
+                yield (sent_id, token_id, _offset(t), t.get('word'), t.get('lemma'),
+                       t.get('POS'), POSMAP[t.get('POS')], t.get('NER'), rel, parent)
+
+    def table_columns(self, id, result):
+        return transpose(self._rows(result), len(self.table_schema) - 1)
+
     def convert(self, id, result, format):
-        assert format in ["csv"]
-        try:
-            doc = Document(result.encode("utf-8"))
-        except:
-            logging.exception("Error on parsing xml")
-            raise
-
-        s = StringIO()
-        w = csv.writer(s)
-        w.writerow(["doc_id", "sentence", "token_id", "offset", "token", "lemma", "POS", "pos1", "NER",
-                    "relation", "parent"])
-
-        parents = {}  # sentence, child.id : (rel, parent.id)
-        for sent in doc.sentences:
-            if sent.collapsed_ccprocessed_dependencies:
-                for dep in sent.collapsed_ccprocessed_dependencies.links:
-                    if dep.type != 'root':
-                        parents[sent.id, dep.dependent.idx] = (dep.type, dep.governor.idx)
-
-        for sent in doc.sentences:
-            for t in sent.tokens:
-                rel, parent = parents.get((sent.id, t.id), (None, None))
-                w.writerow([id, sent.id, t.id, t.character_offset_begin, t.word, t.lemma,
-                            t.pos, POSMAP[t.pos], t.ner, rel, parent])
-
-        return s.getvalue()
+        if format != "csv":
+            return super().convert(id, result, format)
+        return _csv(self.table_schema, id, self._rows(result))
 
 
 class CoreNLPLemmatizer(CoreNLPBase):
     name = "corenlp_lemmatize"
     properties = {"annotators": "tokenize,ssplit,pos,lemma,ner", "outputFormat": "xml"}
+    # unlike corenlp_parse (which resolves coreference), all annotators work per sentence
+    sentence_cache = True
+
+    table_schema = [("id", CATEGORY), ("sentence", INT), ("offset", INT), ("word", STR), ("lemma", STR),
+                    ("POS", CATEGORY), ("pos1", CATEGORY), ("ner", CATEGORY)]
+
+    def _rows(self, result):
+        for sent_id, tokens, _parents in iter_sentences(result):
+            for t in tokens.values():
+                yield (sent_id, _offset(t), t.get('word'), t.get('lemma'),
+                       t.get('POS'), POSMAP[t.get('POS')], t.get('NER'))
+
+    def table_columns(self, id, result):
+        return transpose(self._rows(result), len(self.table_schema) - 1)
 
     def convert(self, id, result, format):
-        assert format in ["csv"]
-        try:
-            doc = Document(result.encode("utf-8"))
-        except:
-            logging.exception("Error on parsing xml")
-            raise
-
-        s = StringIO()
-        w = csv.writer(s)
-        w.writerow(["id", "sentence", "offset", "word", "lemma", "POS", "pos1", "ner"])
-        
-        for sent in doc.sentences:
-            for t in sent.tokens:
-                w.writerow([id, sent.id, t.character_offset_begin, t.word, t.lemma,
-                            t.pos, POSMAP[t.pos], t.ner])
-        return s.getvalue()
+        if format != "csv":
+            return super().convert(id, result, format)
+        return _csv(self.table_schema, id, self._rows(result))
+
+
+def _csv(schema, id, rows):
+    """Write the rows of a document as csv with the column names of the table_schema"""
+    s = StringIO()
+    w = csv.writer(s)
+    w.writerow([name for (name, _type) in schema])
+    for row in rows:
+        w.writerow((id,) + row)
+    return s.getvalue()
+
+
+def iter_sentences(xml: str, dependencies=False):
+    """
+    Incrementally parse CoreNLP xml output, yielding a (sentence id, tokens, parents) triple per sentence.
+    tokens is an ordered {token id: {element name: text}} dict of the token elements (e.g. word, lemma, POS),
+    parents is a {token id: (relation, parent id)} dict from the collapsed-ccprocessed-dependencies
+    (or empty unless dependencies is True).
+    Every sentence is removed from the tree once it has been yielded, so memory use does not grow with the document.
+    """
+    context = etree.iterparse(BytesIO(xml.encode("utf-8")), events=("end",), tag="sentence")
+    try:
+        for _event, sent in context:
+            # skip the sentence elements of coreference mentions, only use /root/document/sentences/sentence
+            sentences = sent.getparent()
+            if sentences is None or sentences.tag != "sentences":
+                continue
+            document = sentences.getparent()
+            if document is None or document.tag != "document" or document.getparent() is None \
+                    or document.getparent().tag != "root":
+                continue
+            tokens = OrderedDict()
+            for token in sent.iterfind("tokens/token"):
+                values = {}
+                for child in token:
+                    if child.tag not in values and child.text is not None:
+                        values[child.tag] = child.text
+                tokens[int(token.get("id"))] = values
+            parents = {}
+            if dependencies:
+                parents = _parents(sent.find('dependencies[@type="collapsed-ccprocessed-dependencies"]'))
+            yield int(sent.get("id")), tokens, parents
+            sent.clear()
+            while sent.getprevious() is not None:
+                del sentences[0]
+    except etree.XMLSyntaxError:
+        logging.exception("Error on parsing xml")
+        raise
+
+
+def _parents(deps):
+    """Get the {dependent: (relation, governor)} dict of a dependencies element, processing the links
+    grouped by relation (in order of first occurrence) so that the last link per dependent wins,
+    as in corenlp_xml.dependencies.DependencyGraph.links"""
+    parents = {}
+    if deps is None:
+        return parents
+    links = OrderedDict()  # relation : [dep elements]
+    for dep in deps.iterfind("dep"):
+        links.setdefault(dep.get("type"), []).append(dep)
+    for rel, group in links.items():
+        if rel != 'root':
+            for dep in group:
+                parents[int(dep.find("dependent").get("idx"))] = (rel, int(dep.find("governor").get("idx")))
+    return parents
+
+
+def _sentence_elements(xml: str):
+    """Get the /root/document/sentences/sentence elements of CoreNLP xml output"""
+    return etree.fromstring(xml.encode("utf-8")).iterfind("document/sentences/sentence")
+
+
+def _token_offsets(sent):
+    """Get the begin offset of the first and the end offset of the last token of a sentence element"""
+    tokens = sent.findall("tokens/token")
+    return int(tokens[0].findtext("CharacterOffsetBegin")), int(tokens[-1].findtext("CharacterOffsetEnd"))
+
+
+def _shift_offsets(sent, shift):
+    """Add shift to the character offsets of the tokens of a sentence element"""
+    for element in sent.iterfind("tokens/token/*"):
+        if element.tag in ("CharacterOffsetBegin", "CharacterOffsetEnd"):
+            element.text = str(int(element.text) + shift)
+
+
+_NON_BMP = re.compile("[\U00010000-\U0010FFFF]")
+
+
+def _utf16_len(text):
+    return len(text) + len(_NON_BMP.findall(text))
+
+
+def _utf16_offsets(text, offsets):
+    """Convert (increasing) offsets in the text to the UTF-16 code unit offsets of CoreNLP (Java) strings"""
+    if not _NON_BMP.search(text):
+        return offsets
+    result, previous, shift = [], 0, 0
+    for offset in offsets:
+        shift += len(_NON_BMP.findall(text, previous, offset))
+        result.append(offset + shift)
+        previous = offset
+    return result
+
+
+def _offset(token):
+    offset = token.get('CharacterOffsetBegin')
+    return None if offset is None else int(offset)
+
     
 CoreNLPLemmatizer.register()
 CoreNLPParser.register()
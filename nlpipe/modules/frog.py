@@ -2,6 +2,7 @@
 Wrapper to call the frog server and parse the results as NAF
 
 Assumes that a frog server is listening on FROG_HOST, defaulting to localhost:9887
+FROG_HOST can also be a comma separated list of host:port servers, see nlpipe.backends
 
 With 'la machine', this can be done with the following command:
 sudo docker run -dp 9887:9887 proycon/lamachine frog -S 9887 --skip=pm
@@ -10,15 +11,170 @@ Note that on some machines you need to add --net=host to get port forwarding to
 possibly related to https://github.com/docker/docker/issues/13914
 
 See: http://languagemachines.github.io/frog/
+
+Connections to the frog server are kept open and reused for subsequent documents (per worker process),
+see FrogPool. The size of the pool can be limited with FROG_POOL_SIZE (default: 4 idle connections).
 """
 import csv
 import logging
 import os
+import threading
+from contextlib import contextmanager
 from io import StringIO
 import socket
 
-from pynlpl.clients.frogclient import FrogClient
+from nlpipe.backends import get_backends
+from nlpipe.columnar import CATEGORY, INT, STR
 from nlpipe.module import Module
+from nlpipe.sentcache import get_sentence_cache
+
+
+class FrogConnection(object):
+    """
+    Persistent connection to a frog server (see pynlpl.clients.frogclient for the protocol)
+    Output rows are parsed and yielded as soon as they are received from the socket
+    """
+    bufsize = 65536
+
+    def __init__(self, host, port, timeout=600):
+        self.host, self.port, self.timeout = host, int(port), timeout
+        self.socket = None
+        self.connect()
+
+    def connect(self):
+        self.close()
+        self.socket = socket.create_connection((self.host, self.port), timeout=self.timeout)
+
+    def close(self):
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+            self.socket = None
+
+    def is_alive(self):
+        """Check (without blocking) whether the connection is open and has no unread data pending"""
+        if self.socket is None:
+            return False
+        try:
+            self.socket.setblocking(False)
+            try:
+                # an open connection without pending data would block; b'' means closed by server,
+                # and any other data means we are out of sync with the server
+                self.socket.recv(1, socket.MSG_PEEK)
+            finally:
+                self.socket.settimeout(self.timeout)
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def _send(self, text):
+        data = text.strip(' \t\n').encode("utf-8") + b'\r\nEOT\r\n'
+        try:
+            self.socket.sendall(data)
+        except OSError:
+            logging.debug("Frog connection to {self.host}:{self.port} lost, reconnecting".format(**locals()))
+            self.connect()
+            self.socket.sendall(data)
+
+    def _lines(self):
+        """Yield the response lines until the READY line is received"""
+        buffer = b""
+        while True:
+            data = self.socket.recv(self.bufsize)
+            if not data:
+                raise ConnectionError("Frog server at {self.host}:{self.port} closed the connection"
+                                      .format(**locals()))
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                line = line.decode("utf-8").strip(' \t\r')
+                if line == "READY":
+                    return
+                yield line
+
+    def process(self, text):
+        """
+        Send the text to frog and yield (word, lemma, morph, pos, ner, chunk, parse1, parse2) tuples,
+        with a tuple of Nones between sentences.
+        Note that the generator must be consumed completely before the connection can be reused.
+        """
+        self._send(text)
+        first = True
+        for line in self._lines():
+            fields = line.split('\t')
+            if not (len(fields) > 4 and fields[0].isdigit()):
+                continue
+            if fields[0] == '1' and not first:
+                yield (None,) * 8
+            first = False
+            fields = fields[1:]
+            if len(fields) < 5:
+                raise Exception("Can't process response line from Frog: {line!r}".format(**locals()))
+            word, lemma, morph, pos = fields[0:4]
+            ner = fields[5] if len(fields) > 5 else ""
+            chunk = fields[6] if len(fields) > 6 else ""
+            parse1, parse2 = (fields[7], fields[8]) if len(fields) >= 9 else ("", "")
+            yield (word, lemma, morph, pos, ner, chunk, parse1, parse2)
+
+
+class FrogPool(object):
+    """
+    Pool of idle FrogConnections to a single frog server.
+    Connections are health-checked when taken from the pool and only returned to the pool
+    if the response was read completely.
+    """
+
+    def __init__(self, host, port, size=None):
+        if size is None:
+            size = int(os.getenv('FROG_POOL_SIZE', 4))
+        self.host, self.port, self.size = host, port, size
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def _get(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn = self.idle.pop()
+            if conn.is_alive():
+                return conn
+            logging.debug("Discarding stale frog connection to {self.host}:{self.port}".format(**locals()))
+            conn.close()
+        logging.debug("Creating frog connection to {self.host}:{self.port}".format(**locals()))
+        return FrogConnection(self.host, self.port)
+
+    def _put(self, conn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self._get()
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        self._put(conn)
+
+
+_POOLS = {}  # (pid, host, port) : FrogPool
+
+
+def get_pool(host, port) -> FrogPool:
+    """Get the connection pool for this server. Pools are never shared between (forked) worker processes."""
+    key = (os.getpid(), host, str(port))
+    if key not in _POOLS:
+        _POOLS[key] = FrogPool(host, port)
+    return _POOLS[key]
 
 
 class FrogLemmatizer(Module):
@@ -27,39 +183,96 @@ class FrogLemmatizer(Module):
     def __init__(self, server=None):
         if server is None:
             server = os.getenv('FROG_HOST', 'localhost:9887')
-        self.host, self.port = server.split(":")
+        self.server = server
+
+    @property
+    def backends(self):
+        return get_backends(self.server, self.get_max_concurrency())
 
     def check_status(self):
-        frogclient = FrogClient(self.host, self.port, returnall=True)
-        
+        self.backends.check(self._check_server)
+
+    def _check_server(self, server):
+        with get_pool(*server.split(":")).connection() as conn:
+            if not conn.is_alive():
+                raise Exception("Frog server at {server} is not available".format(**locals()))
+
     def call_frog(self, text):
         """
         Call frog on the text and return (sent, offset, word, lemma, pos, morphofeat) tuples
         """
-        logging.debug("Creating frog client")
-        frogclient = FrogClient(self.host, self.port, returnall=True, timeout=600)
         sent = 1
         offset = 0
-        logging.debug("Calling frog")
-        tokens = list(frogclient.process(text))
-        logging.debug("Got {} tokens".format(len(tokens)))
-        for word, lemma, morph, morphofeat, ner, chunk, _p1, _p2 in tokens:
-            if word is None:
-                sent += 1
-            else:
-                yield (sent, offset, word, lemma, morphofeat, ner, chunk)
-                offset += len(word)
+        with self.backends.request() as server, get_pool(*server.split(":")).connection() as frog:
+            logging.debug("Calling frog at {server}".format(**locals()))
+            for word, lemma, morph, morphofeat, ner, chunk, _p1, _p2 in frog.process(text):
+                if word is None:
+                    sent += 1
+                else:
+                    yield (sent, offset, word, lemma, morphofeat, ner, chunk)
+                    offset += len(word)
+
+    sentence_cache = True
 
     def process(self, text):
+        cache = get_sentence_cache(self)
+        if cache is not None:
+            return cache.process(self, text)
         s = StringIO()
         w = csv.writer(s)
-        w.writerow(["sentence", "offset", "word", "lemma", "morphofeat", "ner", "chunk"])
+        w.writerow(_HEADER)
         for line in self.call_frog(text):
             w.writerow(list(line))
         return s.getvalue()
 
+    def parse_sentences(self, sentences):
+        rows = _split_rows(self.call_frog("\n\n".join(sentences)))
+        if len(rows) != len(sentences):
+            # frog split the sentences differently, so parse them one at a time
+            rows = [list(self.call_frog(sentence)) for sentence in sentences]
+        parses = []
+        for sentence_rows in rows:
+            s = StringIO()
+            csv.writer(s).writerows(sentence_rows)
+            parses.append(s.getvalue())
+        return parses
+
+    def join_sentences(self, text, sentences, parses):
+        s = StringIO()
+        w = csv.writer(s)
+        w.writerow(_HEADER)
+        n, offset = 0, 0  # number of sentences and offset of the next token so far
+        for parse in parses:
+            sentence_n, end = 0, 0
+            for sent, token_offset, word, *fields in csv.reader(StringIO(parse)):
+                sentence_n = int(sent)
+                end = int(token_offset) + len(word)
+                w.writerow([n + sentence_n, offset + int(token_offset), word] + fields)
+            n += sentence_n
+            offset += end
+        return s.getvalue()
+
+    table_schema = [("id", CATEGORY), ("sentence", INT), ("offset", INT), ("word", STR), ("lemma", STR),
+                    ("morphofeat", CATEGORY), ("ner", CATEGORY), ("chunk", CATEGORY), ("pos", CATEGORY)]
+
+    def table_columns(self, id, result):
+        r = csv.reader(StringIO(result), delimiter=',')
+        next(r)  # header
+        sents, offsets, words, lemmas, morphofeats, ners, chunks, pos = columns = [[] for _i in range(8)]
+        for sent, offset, word, lemma, morphofeat, ner, chunk in r:
+            sents.append(int(sent))
+            offsets.append(int(offset))
+            words.append(word)
+            lemmas.append(lemma)
+            morphofeats.append(morphofeat)
+            ners.append(ner)
+            chunks.append(chunk)
+            pos.append(_POSMAP[morphofeat.split("(")[0]])
+        return columns
+
     def convert(self, id, result, format):
-        assert format in ["csv"]
+        if format != "csv":
+            return super().convert(id, result, format)
         # add id and pos column to result
         r = csv.reader(StringIO(result), delimiter=',')
         out = StringIO()
@@ -76,6 +289,20 @@ class FrogLemmatizer(Module):
 
 FrogLemmatizer.register()
 
+_HEADER = ["sentence", "offset", "word", "lemma", "morphofeat", "ner", "chunk"]
+
+
+def _split_rows(rows):
+    """Split the call_frog rows of a text into a list of rows per sentence, as if each sentence was parsed separately"""
+    sentences = []
+    current = None
+    for sent, offset, *fields in rows:
+        if sent != current:
+            current, first_offset = sent, offset
+            sentences.append([])
+        sentences[-1].append((1, offset - first_offset, *fields))
+    return sentences
+
 
 _POSMAP = {"VZ" : "P",
           "N" : "N",
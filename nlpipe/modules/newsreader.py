@@ -21,6 +21,7 @@ import itertools
 import tempfile
 from io import StringIO
 
+from nlpipe.backends import get_backends
 from nlpipe.module import Module
 
 log = logging.getLogger(__name__)
@@ -28,17 +29,24 @@ log = logging.getLogger(__name__)
 class Newsreader(Module):
     name = "newsreader"
 
-    def check_status(self):
+    @property
+    def backends(self):
         newsreader_server = os.environ.get('NEWSREADER_SERVER', 'http://localhost:5002')
+        return get_backends(newsreader_server, self.get_max_concurrency())
+
+    def check_status(self):
+        self.backends.check(self._check_server)
+
+    def _check_server(self, newsreader_server):
         r = requests.get(newsreader_server)
         if r.status_code != 200:
             raise Exception("No newsreader server found at {newsreader_server}".format(**locals()))
 
     def process(self, text):
-        newsreader_server = os.environ.get('NEWSREADER_SERVER', 'http://localhost:5002')
-        url = "{newsreader_server}/newsreader".format(**locals())
         body = {"text": text}
-        r = requests.post(url, json=body)
+        with self.backends.request() as newsreader_server:
+            url = "{newsreader_server}/newsreader".format(**locals())
+            r = requests.post(url, json=body)
         if r.status_code != 200:
             raise Exception("Error calling Newsreader at {newsreader_server}: {r.status_code}:\n{r.content!r}"
                             .format(**locals()))
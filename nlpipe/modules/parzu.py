@@ -1,28 +1,66 @@
+import csv
 import json
 import os
+from io import StringIO
+
 import requests
+from nlpipe.backends import get_backends
+from nlpipe.columnar import CATEGORY, INT, STR
 from nlpipe.module import Module
 
 class ParzuClient(Module):
     name = "parzu"
 
+    @property
+    def backends(self):
+        return get_backends(os.environ.get('PARZU_SERVER', 'http://localhost:5003'), self.get_max_concurrency())
+
     def check_status(self):
-        parzu_server = os.environ.get('PARZU_SERVER', 'http://localhost:5003')
+        self.backends.check(self._check_server)
+
+    def _check_server(self, parzu_server):
         r = requests.get(parzu_server)
         if r.status_code != 200:
             raise Exception("No server found at {parzu_server}".format(**locals()))
 
     def process(self, text):
-        parzu_server = os.environ.get('PARZU_SERVER', 'http://localhost:5003')
-        url = "{parzu_server}/parse/".format(**locals())
         data = {"text": text}
-        r = requests.post(url, data=json.dumps(data))
+        with self.backends.request() as parzu_server:
+            url = "{parzu_server}/parse/".format(**locals())
+            r = requests.post(url, data=json.dumps(data))
         r.raise_for_status()
         return r.content.decode("utf-8")
 
+    # the csv columns of the result, with the document id and the sentence number (counting the blank lines
+    # between sentences) added in front
+    table_schema = [("doc_id", CATEGORY), ("sentence", INT), ("id", INT), ("word", STR), ("lemma", STR),
+                    ("pos", CATEGORY), ("pos2", CATEGORY), ("features", STR), ("parent", INT),
+                    ("relation", CATEGORY), ("extra1", STR), ("extra2", STR)]
+
+    def table_columns(self, id, result):
+        columns = [[] for _i in range(len(self.table_schema) - 1)]
+        sentence = 1
+        for row in csv.reader(StringIO(result)):
+            if not row:
+                if columns[0] and columns[0][-1] == sentence:
+                    sentence += 1
+                continue
+            row += [""] * (10 - len(row))
+            row = [sentence, _int(row[0])] + row[1:6] + [_int(row[6])] + row[7:10]
+            for column, value in zip(columns, row):
+                column.append(value)
+        return columns
+
     def convert(self, id, result, format):
-        assert format in ["csv"]
+        if format != "csv":
+            return super().convert(id, result, format)
         header = "id, word, lemma, pos, pos2, features, parent, relation, extra1, extra2\n"
         return header + result
 
-ParzuClient.register()
\ No newline at end of file
+
+
+def _int(x):
+    return int(x) if x.strip().isdigit() else None
+
+
+ParzuClient.register()
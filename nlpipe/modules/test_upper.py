@@ -18,6 +18,8 @@ class TestUpper(Module):
     def convert(self, id, result, format):
         if format == "json":
             return json.dumps({"id": id, "status": "OK", "result": result})
+        if format == "csv":
+            return "id,result\n{id},{result}\n".format(**locals())
         super().convert(result, format)
 
 TestUpper.register()
@@ -1,17 +1,20 @@
 import argparse
 import json
 import os
+import sys
 from collections import Counter
 import re
-from io import BytesIO
-from typing import Union, Iterable, Mapping
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Union, Iterable, Mapping, Optional
+from xml.sax.saxutils import escape as xml_escape
 import itertools
 
 from amcatclient import AmcatAPI
 from nlpipe.client import get_client, Client
 import logging
-from KafNafParserPy import KafNafParser, CfileDesc, Cpublic, CHeader
 
+# Only use a process pool for serializing NAF input for sets with at least this many articles
+NAF_POOL_MIN_ARTICLES = 10000
 
 
 def grouper(iterable, n, fillvalue=None):
@@ -41,6 +44,11 @@ def get_ids(amcat_server: AmcatAPI, project: int, articleset: int) -> Iterable[i
             amcat_server.get_articles(project, articleset, columns=['id']))
 
 
+def get_job_name(project: int, articleset: int) -> str:
+    """Get the NLPipe job name for documents from this articleset"""
+    return "amcat_{project}_{articleset}".format(**locals())
+
+
 def get_status(amcat_server: AmcatAPI, project: int, articleset: int,
                nlpipe_server: Client, module: str) -> Mapping[int, str]:
     """
@@ -60,7 +68,19 @@ def get_status(amcat_server: AmcatAPI, project: int, articleset: int,
 
 def process_pipe(amcat_server: AmcatAPI, project: int, articleset: int,
                  nlpipe_server: Client, module: str, previous_module: str) -> None:
-    
+    """
+    Process the results of previous_module for the given documents with module. The results are queued by
+    the nlpipe server, without downloading them. Note that a server with a pipeline from previous_module to
+    module (see NLPIPE_PIPELINES) queues new results automatically, so this is only needed for documents that were
+    done before the pipeline was configured.
+
+    :param amcat_server: Amcat server (url str or AmCATAPI object)
+    :param project: AmCAT project ID (int)
+    :param articleset: AmCAT Articleset ID (int)
+    :param nlpipe_server: NLPipe server (url/dirname str or nlpipe.Client object)
+    :param module: NLPipe module name (str)
+    :param previous_module: NLPipe module name of the results to process (str)
+    """
     status = get_status(amcat_server, project, articleset, nlpipe_server, module)
 
     todo = {id for (id, status) in status.items() if status in "UNKNOWN"}
@@ -83,12 +103,10 @@ def process_pipe(amcat_server: AmcatAPI, project: int, articleset: int,
     if todo:
         logging.info("Assigning {} articles from {amcat_server} set {project}:{articleset}"
                      .format(len(todo), **locals()))
-        for ids in splitlist(todo, itemsperbatch=100):
+        for ids in splitlist(todo, itemsperbatch=1000):
             ids = [str(id) for id in ids]
             logging.debug("Assigning {} articles...".format(len(ids)))
-            input_files = nlpipe_server.bulk_result(previous_module, ids)
-            input_files = [input_files[str(id)] for id in ids]
-            nlpipe_server.bulk_process(module, input_files, ids=ids)
+            nlpipe_server.process_results(module, previous_module, ids, job=get_job_name(project, articleset))
 
 
 def process(amcat_server: AmcatAPI, project: int, articleset: int,
@@ -106,6 +124,7 @@ def process(amcat_server: AmcatAPI, project: int, articleset: int,
     :param reset_error: Re-assign documents with errors
     :param to_naf: Assign as NAF documents with metadata (otherwise, assign as plain text)
     :param token: Token to use for authentication
+    The documents are submitted as job amcat_<project>_<articleset>, see get_job_name
     """
     status = get_status(amcat_server, project, articleset, nlpipe_server, module)
     accept_status = {"UNKNOWN"}
@@ -118,15 +137,20 @@ def process(amcat_server: AmcatAPI, project: int, articleset: int,
     if todo:
         logging.info("Assigning {} articles from {amcat_server} set {project}:{articleset}"
                      .format(len(todo), **locals()))
-        columns = 'headline,text,creator,date,url,uuid,medium,section,page' if args.naf else 'headline,text'
-        for page in amcat_server.get_articles_by_id(articles=todo, columns=columns,
-                                                            page_size=100, yield_pages=True):
-            args = page['results']
-            ids = [a['id'] for a in arts]
-            texts = [_get_text(a, to_naf=args.naf) for a in arts]
-            logging.debug("Assigning {} articles".format(len(ids)))
-            nlpipe_server.bulk_process(args.module, texts, ids=ids, reset_error=reset_error,
-                                                reset_pending=reset_started)
+        columns = 'headline,text,creator,date,url,uuid,medium,section,page' if to_naf else 'headline,text'
+        pool = get_naf_pool(len(todo)) if to_naf else None
+        try:
+            for page in amcat_server.get_articles_by_id(articles=todo, columns=columns,
+                                                        page_size=100, yield_pages=True):
+                arts = page['results']
+                ids = [a['id'] for a in arts]
+                texts = get_texts(arts, to_naf=to_naf, pool=pool)
+                logging.debug("Assigning {} articles".format(len(ids)))
+                nlpipe_server.bulk_process(module, texts, ids=ids, reset_error=reset_error,
+                                           reset_pending=reset_started, job=get_job_name(project, articleset))
+        finally:
+            if pool is not None:
+                pool.shutdown()
     logging.info("Done! Assigned {} articles".format(len(todo)))
 
 
@@ -136,54 +160,99 @@ def get_results(amcat_server: AmcatAPI, project: int, articleset: int,
     toget = [id for (id, status) in status.items() if status == "DONE"]
     kargs = {'format': format} if format else {}
     for batch in splitlist(toget):
-        yield from nlpipe_server.bulk_result(module, batch, **kargs).items()
+        yield from nlpipe_server.iter_results(module, batch, **kargs)
+
+
+def get_csv(amcat_server: AmcatAPI, project: int, articleset: int, nlpipe_server: Client, module: str):
+    """
+    Get the results of an articleset as a single csv, merged (and converted in parallel) by the nlpipe server.
+    If the articleset was submitted as a job (see get_job_name), the server exports the results of the job,
+    otherwise the ids of the articleset are retrieved from amcat.
+    """
+    job = get_job_name(project, articleset)
+    if job in nlpipe_server.jobs(module):
+        return nlpipe_server.iter_export_csv(module, job=job)
+    status = get_status(amcat_server, project, articleset, nlpipe_server, module)
+    toget = [id for (id, status) in status.items() if status == "DONE"]
+    return nlpipe_server.iter_export_csv(module, ids=toget)
 
 
 def _normalize(txt):
-    pars = []
-    for par in txt.split("\n\n"):
-        par = par.replace("\n", " ")
-        par = re.sub("\s+", " ", par)
-        par = par.strip()
-        pars.append(par)
-    return "\n\n".join(pars)
+    """Collapse all whitespace within paragraphs (separated by blank lines) into single spaces"""
+    return "\n\n".join(" ".join(par.split()) for par in txt.split("\n\n"))
+
+
+# fileDesc attribute : article field, in the order that KafNafParserPy (CfileDesc) writes them
+_FILEDESC = [("author", "author"), ("title", "headline"), ("creationtime", "date"), ("magazine", "medium"),
+             ("pages", "page"), ("section", "section")]
+
+_NAF_TEMPLATE = """<?xml version='1.0' encoding='UTF-8'?>
+<NAF xml:lang="{lang}" version="3.0">
+  <raw><![CDATA[{raw}]]></raw>
+  <nafHeader>
+    <public publicId="{public_id}"/>
+    <fileDesc{filedesc}/>
+  </nafHeader>
+</NAF>
+"""
+
+_INVALID_XML = re.compile("[^\u0009\u000a\u000d\u0020-\ud7ff\ue000-\ufffd\U00010000-\U0010ffff]")
+_ATTR_ENTITIES = {'"': "&quot;", "\t": "&#9;", "\n": "&#10;", "\r": "&#13;"}
+
+
+def _xml_text(value: str) -> str:
+    if _INVALID_XML.search(value):
+        raise ValueError("All strings must be XML compatible: Unicode or ASCII, no NULL bytes or control characters")
+    return value
+
+
+def _xml_attr(value: str) -> str:
+    return xml_escape(_xml_text(value), _ATTR_ENTITIES)
+
+
+def _naf(a, raw, lang='nl') -> str:
+    """
+    Serialize the raw text and metadata of article a as a NAF document with header and raw layers.
+    This gives the same output as building the document with KafNafParserPy and dumping it, without the object model.
+    """
+    lang = _xml_attr(lang)
+    raw = _xml_text(raw).replace("]]>", "]]]]><![CDATA[>")  # ]]> cannot occur in a CDATA section
+    filedesc = "".join(' {}="{}"'.format(attr, _xml_attr(str(a[field]) if field == 'page' else a[field]))
+                       for (attr, field) in _FILEDESC if field in a)
+    public_id = _xml_attr(a['uuid'])
+    return _NAF_TEMPLATE.format(**locals())
 
 
 def _get_text(a, to_naf=False, lang='nl'):
     result = "\n\n".join([_normalize(a[x]) for x in ('headline', 'text')])
     if to_naf:
-        naf = KafNafParser(type="NAF")
-        naf.header = CHeader(type=naf.type)
-        naf.root.insert(0, naf.header.get_node())
-
-        naf.set_language(lang)
-        naf.set_raw(result)
-        naf.set_version("3.0")
-        
-        fd = CfileDesc()
-        if 'author' in a:
-            fd.set_author(a['author'])
-        if 'headline' in a:
-            fd.set_title(a['headline'])
-        if 'date' in a:
-            fd.set_creationtime(a['date'])
-        if 'medium' in a:
-            fd.set_magazine(a['medium'])
-        if 'page' in a:
-            fd.set_pages(str(a['page']))
-        if 'section' in a:
-            fd.set_section(a['section'])
-        naf.header.set_fileDesc(fd)
-
-        naf.header.set_publicId(a['uuid'])
-        #if 'url' in a:
-        #    naf.header.set_uri(a['url'])
-        b = BytesIO()
-        naf.dump(b)
-        result = b.getvalue().decode("utf-8")
+        result = _naf(a, result, lang=lang)
     return result
 
 
+def _get_naf(a):
+    return _get_text(a, to_naf=True)
+
+
+def get_texts(articles: list, to_naf: bool=False, pool: Executor=None) -> list:
+    """Get the texts to submit for the articles, serializing NAF documents in the pool (if given)"""
+    if to_naf and pool is not None:
+        return list(pool.map(_get_naf, articles, chunksize=10))
+    return [_get_text(a, to_naf=to_naf) for a in articles]
+
+
+def get_naf_pool(n_articles: int) -> Optional[Executor]:
+    """
+    Get a process pool for serializing the NAF input of n_articles articles, or None if it is not worth it.
+    The number of processes is NLPIPE_NAF_PROCESSES (default: the number of CPUs, 0 to disable the pool)
+    """
+    processes = os.environ.get("NLPIPE_NAF_PROCESSES")
+    processes = (os.cpu_count() or 1) if processes is None else int(processes)
+    if processes < 2 or n_articles < NAF_POOL_MIN_ARTICLES:
+        return None
+    return ProcessPoolExecutor(max_workers=processes)
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("amcatserver", help="AmCAT Server hostname")
@@ -215,22 +284,29 @@ if __name__ == '__main__':
     
     if args.action == "process":
         process(amcatserver, args.project, args.articleset, nlpipeserver, args.module,
-                args.reset_error, args.reset_started)
+                args.reset_error, args.reset_started, to_naf=args.naf)
     if args.action == "process_pipe":
         process_pipe(amcatserver, args.project, args.articleset, nlpipeserver, args.module, "alpinonerc")
     if args.action == "status":
-        status = get_status(amcatserver, args.project, args.articleset, nlpipeserver, args.module)
-        for k, v in Counter(status.values()).items():
-            print("{k}: {v}".format(**locals()))
+        job = get_job_name(args.project, args.articleset)
+        if job in nlpipeserver.jobs(args.module):
+            # use the job counters rather than checking every document
+            status = nlpipeserver.job_status(args.module, job)
+            for k in ("PENDING", "STARTED", "DONE", "ERROR"):
+                print("{k}: {}".format(status[k], **locals()))
+            if status['eta'] is not None:
+                print("ETA: {:.1f} minutes".format(status['eta'] / 60))
+        else:
+            status = get_status(amcatserver, args.project, args.articleset, nlpipeserver, args.module)
+            for k, v in Counter(status.values()).items():
+                print("{k}: {v}".format(**locals()))
     if args.action == 'result':
-        results = get_results(amcatserver, args.project, args.articleset, nlpipeserver, args.module,
-                              format=args.format)
         if args.format == "csv":
-            for i, (id, csv_bytes) in enumerate(results):
-                if i != 0 and "\n" in csv_bytes:
-                    csv_bytes = csv_bytes.split("\n", 1)[1]
-                print(csv_bytes.strip())
+            for chunk in get_csv(amcatserver, args.project, args.articleset, nlpipeserver, args.module):
+                sys.stdout.buffer.write(chunk)
         else:
+            results = get_results(amcatserver, args.project, args.articleset, nlpipeserver, args.module,
+                                  format=args.format)
             if args.result_folder:
                 for id, result in results:
                     fn = os.path.join(args.result_folder, str(id))
@@ -1,4 +1,5 @@
 import datetime
+import itertools
 import json
 import os
 import socket
@@ -9,9 +10,12 @@ import logging
 import jwt
 from flask import Flask, request, make_response, Response, abort, jsonify
 from flask.templating import render_template
+from werkzeug.wsgi import get_input_stream
 
 from nlpipe.client import FSClient
 from nlpipe.module import UnknownModuleError, get_module, known_modules
+from nlpipe import columnar, transport
+from nlpipe.transport import NDJSON_MIME, FRAMES_MIME, decode_ndjson, decode_frames, encode_frames, read_chunks
 from nlpipe.worker import run_workers
 
 class LoginFailed(Exception):
@@ -58,6 +62,41 @@ ERROR_MIME = 'application/prs.error+text'
 SECRET_KEY = None
 
 
+@app.before_request
+def decompress_request():
+    """Transparently decompress request bodies that are sent with a Content-Encoding (gzip or zstd)"""
+    encoding = request.headers.get('Content-Encoding')
+    if encoding and encoding != 'identity':
+        if encoding not in transport.ENCODINGS:
+            return "Error: Unsupported Content-Encoding {encoding}\n".format(**locals()), 415
+        environ = request.environ
+        environ['wsgi.input'] = transport.decompressing_reader(get_input_stream(environ), encoding)
+        environ['wsgi.input_terminated'] = True  # the decompressed length is unknown, but the stream is safe to read
+        environ.pop('CONTENT_LENGTH', None)
+
+
+@app.after_request
+def compress_response(response):
+    """Compress (streaming) responses if the client accepts a supported Content-Encoding"""
+    if (response.status_code != 200 or request.method == 'HEAD' or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(transport.ENCODINGS)
+    if not encoding:
+        return response
+    if response.is_streamed:
+        response.response = transport.compress_chunks(response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < transport.MIN_COMPRESS_SIZE:
+            return response
+        response.set_data(transport.compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
 def _secret_key():
     global SECRET_KEY
     if SECRET_KEY is None:
@@ -87,6 +126,7 @@ def index():
     fsdir = app.client.result_dir
     mods = sorted(known_modules(), key=lambda mod: mod.name)
     mods = {mod: dict(app.client.statistics(mod.name)) for mod in mods}
+    jobs = {mod: app.client.job_statistics(mod.name) for mod in mods}
     return render_template('index.html', **locals())
 
 
@@ -96,24 +136,47 @@ def post_task(module):
     """
     POST a new task to the NLPipe server.
     Post body should contain the test to process.
-    You can specify an explicit document id with ?id=<id>
+    You can specify an explicit document id with ?id=<id>, a priority with ?priority=<int>,
+    a deadline (unix timestamp) with ?deadline=<timestamp> and a job (or tenant) name with ?job=<name>
     Response will be an empty HTTP 202 response with Location and ID headers
 
-    :param module: The name of the module to process with
+    :param module: The name of the module to process with, or a comma separated list of modules
     """
     try:
-        get_module(module)  # check if module exists
+        modules = _get_modules(module)
     except UnknownModuleError as e:
         return str(e), 404
     doc = request.get_data().decode('UTF-8')
     id = request.args.get("id")
-    id = app.client.process(module, doc, id=id)
+    reset_error = request.args.get('reset_error', False) in ('1', 'Y', 'True')
+    reset_pending = request.args.get('reset_pending', False) in ('1', 'Y', 'True')
+    try:
+        id = app.client.process_modules(modules, doc, id=id, reset_error=reset_error, reset_pending=reset_pending,
+                                        **_priority_args())
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
     resp = Response(id+"\n", status=202)
     resp.headers['Location'] = '/api/modules/{module}/{id}'.format(**locals())
     resp.headers['ID'] = id
     return resp
 
 
+def _get_modules(module):
+    """Get the module names of a comma separated list, raising an UnknownModuleError if a module does not exist"""
+    modules = module.split(",")
+    for name in modules:
+        get_module(name)
+    return modules
+
+
+def _priority_args():
+    """Get the priority, deadline and job arguments from the request"""
+    deadline = request.args.get('deadline')
+    return dict(priority=request.args.get('priority', 0, type=int),
+                deadline=float(deadline) if deadline else None,
+                job=request.args.get('job'))
+
+
 @app.route('/api/modules/<module>/<id>', methods=['HEAD'])
 @check_auth
 def task_status(module, id):
@@ -135,7 +198,7 @@ def task_status(module, id):
 def result(module, id):
     """
     GET the processed result of a task.
-    If processed OK, returns the result as document with HTTP 200
+    If processed OK, returns the result as document with HTTP 200 (?format=<format> to convert the result)
     If processing failed, returns HTTP 500 with a json document containing the exception
     If task is unknown or not yet processed, will return 404
 
@@ -150,6 +213,8 @@ def result(module, id):
     except Exception as e:
         result = {"exception_class": type(e).__name__, "message": str(e)}
         return make_response(jsonify(result), 500)
+    if isinstance(result, bytes):
+        return Response(result, status=200, mimetype=columnar.MIMETYPES.get(format, 'application/octet-stream'))
     return result, 200
 
 
@@ -159,11 +224,12 @@ def get_task(module):
     """
     GET a task to process.
     This is intended to be called by a worker and will set status of the task to STARTED.
+    The worker can identify itself with ?worker=<name>, see heartbeat.
     Returns the text to process with HTTP headers ID and Location
 
     :param module: Module name
     """
-    id, doc = app.client.get_task(module)
+    id, doc = app.client.get_task(module, worker=request.args.get("worker"))
     if doc is None:
         return 'Queue {module} empty!\n'.format(**locals()), 404
     resp = Response(doc, status=200)
@@ -172,6 +238,41 @@ def get_task(module):
     return resp
 
 
+@app.route('/api/modules/<module>/<id>/heartbeat', methods=['POST'])
+@check_auth
+def heartbeat(module, id):
+    """
+    POST to extend the lease on a task that is being processed.
+    Workers should call this regularly for long-running tasks, otherwise the task will be returned to the queue.
+    Specify the worker name used to retrieve the task with ?worker=<name>
+
+    :param module: Module name
+    :param id: ID of the task
+    """
+    try:
+        app.client.heartbeat(module, id, worker=request.args.get("worker"))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 409
+    return '', 204
+
+
+@app.route('/api/modules/<module>/<id>/release', methods=['POST'])
+@check_auth
+def release_task(module, id):
+    """
+    POST to return a task that was retrieved but not processed to the queue.
+    This is intended to be called by a worker and will set the status of the task back to PENDING.
+
+    :param module: Module name
+    :param id: ID of the task to release
+    """
+    try:
+        app.client.release_task(module, id)
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 409
+    return '', 204
+
+
 @app.route('/api/modules/<module>/<id>', methods=['PUT'])
 @check_auth
 def put_results(module, id):
@@ -192,6 +293,36 @@ def put_results(module, id):
     return '', 204
 
 
+@app.route('/api/modules/<module>/<id>/converted/<format>', methods=['PUT'])
+@check_auth
+def put_converted(module, id, format):
+    """
+    Store the result of task <id> converted to <format>, so it does not need to be converted when it is retrieved.
+    Specify ?eager=1 if the result was converted by a worker right after processing (see Module.eager_formats),
+    so it is kept until the result is stored again rather than cached.
+    Returns 204 if the converted result was stored, or 507 if it was not (i.e. not eager and the cache is disabled)
+
+    :param module: The module name
+    :param id: The task ID
+    :param format: The format
+    """
+    status = app.client.status(module, id)
+    if status != 'DONE':
+        return "Error: Cannot store {format} for task {id} with status {status}\n".format(**locals()), 409
+    converted = request.get_data()
+    if not columnar.is_binary(format):
+        converted = converted.decode('UTF-8')
+    eager = request.args.get('eager', False) in ('1', 'Y', 'True')
+    try:
+        stored = app.client.store_converted(module, id, format, converted, eager=eager)
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    if not stored:
+        return "Error: {format} for task {id} was not stored, the converted results cache is disabled\n"\
+            .format(**locals()), 507
+    return '', 204
+
+
 @app.route('/api/modules/<module>/bulk/status', methods=['POST'])
 @check_auth
 def bulk_status(module):
@@ -216,7 +347,11 @@ def bulk_status(module):
 def bulk_result(module):
     """
     Bulk method: POST a json list of IDs to get results for.
-    Returns a json dict of {id: result}
+    Returns a json dict of {id: result}, or with Accept: application/x-ndjson a stream of
+    {"id": id, "result": result} or {"id": id, "error": message} objects, one per line,
+    or with Accept: application/prs.nlpipe-frames a frame per result (with status ERROR for errors).
+    These streams are generated while the results are read from storage.
+    Results converted to a columnar (binary) format can only be retrieved as frames.
 
     :param module: The module name
     """
@@ -227,21 +362,57 @@ def bulk_result(module):
     except:
         return "Error: Please provive bulk IDs as a json list\nd ", 400
     format = request.args.get('format', None)
+    mimetype = request.accept_mimetypes.best_match(['application/json', FRAMES_MIME, NDJSON_MIME])
+    if mimetype == FRAMES_MIME:
+        return Response(encode_frames(_framed_results(module, ids, format)), mimetype=FRAMES_MIME)
+    if columnar.is_binary(format):
+        return "Error: Results in {format} format can only be retrieved as {FRAMES_MIME}\n".format(
+            FRAMES_MIME=FRAMES_MIME, **locals()), 406
+    if mimetype == NDJSON_MIME:
+        return Response(_ndjson_results(module, ids, format), mimetype=NDJSON_MIME)
     results = app.client.bulk_result(module, ids, format=format)
     return jsonify(results)
 
 
+def _ndjson_results(module, ids, format):
+    """Generate ndjson lines of results in order of completion, see Client.iter_outcomes"""
+    for id, result, error in app.client.iter_outcomes(module, ids, format=format):
+        line = {"id": id, "result": result} if error is None else {"id": id, "error": str(error)}
+        yield json.dumps(line) + "\n"
+
+
+def _framed_results(module, ids, format):
+    """Generate (id, result, status) frames in order of completion, see Client.iter_outcomes"""
+    for id, result, error in app.client.iter_outcomes(module, ids, format=format):
+        if error is None:
+            yield id, result, None
+        else:
+            yield id, str(error), "ERROR"
+
+
 @app.route('/api/modules/<module>/bulk/process', methods=['POST'])
 @check_auth
 def bulk_process(module):
     """
     Bulk method: POST a json list or {id: text} dict containing texts to process
+    Alternatively, POST with Content-type: application/x-ndjson and a {"id": id, "text": text} json object
+    per line (id is optional), or with Content-type: application/prs.nlpipe-frames and a frame per document
+    (see nlpipe.transport). These documents are queued while the request body is being read.
+    You can specify ?priority=<int>, ?deadline=<timestamp> and ?job=<name> for all texts
     Returns a json list of ids
 
-    :param module: The module name
+    :param module: The module name, or a comma separated list of modules
     """
+    try:
+        modules = _get_modules(module)
+    except UnknownModuleError as e:
+        return str(e), 404
     reset_error = request.args.get('reset_error', False) in ('1', 'Y', 'True')
     reset_pending = request.args.get('reset_pending', False) in ('1', 'Y', 'True')
+    if request.mimetype in (NDJSON_MIME, FRAMES_MIME):
+        docs = (_ndjson_docs if request.mimetype == NDJSON_MIME else _framed_docs)(request.stream)
+        return _bulk_process_stream(modules, docs, reset_error=reset_error, reset_pending=reset_pending,
+                                    **_priority_args())
     try:
         docs = request.get_json(force=True)
         if not docs:
@@ -250,13 +421,224 @@ def bulk_process(module):
         logging.exception("bulk/process: Error parsing json {}".format(repr(request.data)[:20]))
         return "Error: Please provive bulk docs as a json list or {id:doc, } dict\n ", 400
     if isinstance(docs, list):
-        docs, ids = docs, None
+        docs = zip(itertools.repeat(None), docs)
     else:
-        docs, ids = docs.values(), docs.keys()
-    ids = app.client.bulk_process(module, docs, ids=ids, reset_error=reset_error, reset_pending=reset_pending)
+        docs = docs.items()
+    return _bulk_process_stream(modules, iter(docs), reset_error=reset_error, reset_pending=reset_pending,
+                                **_priority_args())
+
+
+def _bulk_process_stream(modules, docs, **kargs):
+    """
+    Queue the (id, text) pairs from a streaming request body while it is being read
+    :param modules: the names of the modules to queue each document for
+    :param docs: an iterator of (id, text) pairs that raises a ValueError on invalid input
+    """
+    ids = []
+    try:
+        for id, text in docs:
+            ids.append(app.client.process_modules(modules, text, id=id, **kargs))
+    except (ValueError, KeyError, TypeError) as e:
+        n = len(ids)
+        logging.exception("bulk/process: Error on document {n}".format(**locals()))
+        return ("Error after {n} documents (which were queued): {e!r}\n".format(**locals())), 400
     return jsonify(ids)
 
 
+def _ndjson_docs(stream):
+    for doc in decode_ndjson(read_chunks(stream)):
+        yield doc.get('id'), doc['text']
+
+
+def _framed_docs(stream):
+    for id, data, _status in decode_frames(read_chunks(stream)):
+        yield id, data.decode("utf-8")
+
+
+@app.route('/api/modules/<module>/bulk/process_results', methods=['POST'])
+@check_auth
+def bulk_process_results(module):
+    """
+    Bulk method: POST a json list of ids to queue the results of the module given by ?from=<module> for these
+    documents (e.g. for documents that were done before a pipeline was configured, see FSClient)
+    You can specify ?priority=<int>, ?deadline=<timestamp> and ?job=<name> for all documents
+    Returns a json list of the ids of the documents that were DONE with the ?from module
+
+    :param module: The module name
+    """
+    try:
+        get_module(module)
+        get_module(request.args.get("from", ""))
+    except UnknownModuleError as e:
+        return str(e), 404
+    ids = request.get_json(force=True, silent=True)
+    if not isinstance(ids, list):
+        return "Error: Please provide the ids as a json list\n", 400
+    reset_error = request.args.get('reset_error', False) in ('1', 'Y', 'True')
+    reset_pending = request.args.get('reset_pending', False) in ('1', 'Y', 'True')
+    try:
+        ids = app.client.process_results(module, request.args["from"], ids, reset_error=reset_error,
+                                         reset_pending=reset_pending, **_priority_args())
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    return jsonify(ids)
+
+
+@app.route('/api/modules/<module>/export', methods=['GET', 'POST'])
+@check_auth
+def export(module):
+    """
+    Stream a tar archive of results, with a file per document named after its id, in order of id.
+    GET exports all results of the module (or of the job given with ?job=<name>),
+    POST a json list of IDs to export only those documents.
+    Specify ?format=<format> to convert the results, and ?after=<id> to resume after the given id.
+
+    :param module: The module name
+    """
+    try:
+        ids = _export_ids()
+    except ValueError:
+        return "Error: Please provide IDs as a json list\n", 400
+    try:
+        chunks = app.client.iter_export(module, ids=ids, job=request.args.get('job'),
+                                        format=request.args.get('format'), after=request.args.get('after'))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 404
+    return Response(chunks, mimetype=transport.TAR_MIME)
+
+
+@app.route('/api/modules/<module>/export/csv', methods=['GET', 'POST'])
+@check_auth
+def export_csv(module):
+    """
+    Stream the results converted to csv as a single csv file (with one header row).
+    The documents are converted in parallel and concatenated in order of id.
+    GET exports all results of the module (or of the job given with ?job=<name>),
+    POST a json list of IDs to export only those documents.
+
+    :param module: The module name
+    """
+    try:
+        ids = _export_ids()
+    except ValueError:
+        return "Error: Please provide IDs as a json list\n", 400
+    try:
+        chunks = app.client.iter_export_csv(module, ids=ids, job=request.args.get('job'))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 404
+    return Response(chunks, mimetype='text/csv')
+
+
+@app.route('/api/modules/<module>/export/<format>', methods=['GET', 'POST'])
+@check_auth
+def export_table(module, format):
+    """
+    Stream the token tables of the results as a single table in a columnar format (arrow or parquet)
+    The documents are converted in parallel and merged in order of id (see nlpipe.columnar).
+    GET exports all results of the module (or of the job given with ?job=<name>),
+    POST a json list of IDs to export only those documents.
+
+    :param module: The module name
+    :param format: The columnar format
+    """
+    if format not in columnar.FORMATS:
+        return "Error: Unknown export format {format}\n".format(**locals()), 404
+    try:
+        ids = _export_ids()
+    except ValueError:
+        return "Error: Please provide IDs as a json list\n", 400
+    try:
+        chunks = app.client.iter_export_table(module, format=format, ids=ids, job=request.args.get('job'))
+    except (ValueError, UnknownModuleError) as e:
+        return "Error: {e}\n".format(**locals()), 404
+    return Response(chunks, mimetype=columnar.MIMETYPES[format])
+
+
+def _export_ids():
+    """Get the json list of IDs posted to an export endpoint, or None for GET requests"""
+    if request.method != 'POST':
+        return None
+    try:
+        ids = request.get_json(force=True)
+    except Exception as e:
+        raise ValueError("Invalid json") from e
+    if not isinstance(ids, list):
+        raise ValueError("Not a list")
+    return ids
+
+
+@app.route('/api/modules/<module>/cache', methods=['GET'])
+@check_auth
+def cache_statistics(module):
+    """
+    Get the hits, misses and evictions of the converted results cache since the server started
+
+    :param module: The module name
+    """
+    return jsonify(app.client.cache_statistics(module))
+
+
+@app.route('/api/modules/<module>/jobs/', methods=['GET'])
+@check_auth
+def jobs(module):
+    """
+    GET a json list of the job names of this module
+
+    :param module: The module name
+    """
+    return jsonify(app.client.jobs(module))
+
+
+@app.route('/api/modules/<module>/jobs/<job>', methods=['GET'])
+@check_auth
+def job_status(module, job):
+    """
+    GET the progress of a job.
+    Returns a json dict with the number of tasks per status (PENDING, STARTED, DONE, ERROR), the total,
+    throughput (tasks per second) and eta (seconds)
+
+    :param module: The module name
+    :param job: The job name
+    """
+    try:
+        return jsonify(app.client.job_status(module, job))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 404
+
+
+@app.route('/api/modules/<module>/jobs/<job>/ids', methods=['GET'])
+@check_auth
+def job_ids(module, job):
+    """
+    GET a json list of the ids of the tasks in a job
+
+    :param module: The module name
+    :param job: The job name
+    """
+    try:
+        return jsonify(app.client.job_ids(module, job))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 404
+
+
+@app.route('/api/modules/<module>/jobs/<job>/weight', methods=['PUT'])
+@check_auth
+def set_job_weight(module, job):
+    """
+    PUT the scheduling weight (a number, default 1) of a job.
+    Jobs within the same priority get a share of the processing proportional to their weight.
+
+    :param module: The module name
+    :param job: The job name
+    """
+    try:
+        weight = float(request.get_data().decode('UTF-8'))
+        app.client.set_job_weight(module, job, weight)
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    return '', 204
+
+
 if __name__ == '__main__':
     import argparse
     import tempfile
@@ -0,0 +1,114 @@
+"""
+Sentence level cache of parses, so repeated sentences (e.g. bylines, disclaimers or wire copy) are only parsed once
+
+The cache is opt-in: set NLPIPE_SENTENCE_CACHE to a directory to enable it for the modules that support it
+(see Module.sentence_cache: alpino, frog and corenlp_lemmatize). A document is split into sentences
+(Module.split_sentences), the parses of cached sentences are reused, the other sentences are parsed in a single
+request (Module.parse_sentences) and the parses are joined into the result for the document, with the sentence
+numbers and offsets of the document (Module.join_sentences).
+
+Parses are cached per module in <directory>/<module>/, keyed on the hash of the normalized sentence and the parser
+version (<MODULE>_PARSER_VERSION, e.g. ALPINO_PARSER_VERSION=20180101), so set or change the version to avoid using
+parses of a previous version of a parser.
+
+Note that documents are split with a simple rule (see split_sentences) rather than by the parser, so a sentence
+that the parser would not split (e.g. after an abbreviation) can end up as two sentences, and each sentence is
+parsed without the context of the rest of the document. This is why corenlp_parse, which resolves coreference
+across sentences, does not use the cache.
+"""
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+# sentence final punctuation, optionally followed by closing quotes or brackets
+_SENTENCE_END = re.compile(r"""[.!?]+["'’”)\]]*$""")
+_OPENING = "\"'‘“(["
+
+
+def split_sentences(text: str) -> List[Tuple[int, str]]:
+    """
+    Split the text into (start offset, sentence) pairs at blank lines, and at white space after sentence final
+    punctuation if the next sentence starts with a capital or digit (optionally after an opening quote or bracket)
+    """
+    sentences = []
+    start = 0
+    for m in _WHITESPACE.finditer(text):
+        if m.start() == start:
+            start = m.end()  # leading white space
+            continue
+        if m.end() < len(text) and m.group().count("\n") < 2:
+            following = text[m.end():m.end() + 2].lstrip(_OPENING)[:1]
+            if not ((following.isupper() or following.isdigit()) and
+                    _SENTENCE_END.search(text, max(start, m.start() - 10), m.start())):
+                continue
+        sentences.append((start, text[start:m.start()]))
+        start = m.end()
+    if start < len(text):
+        sentences.append((start, text[start:]))
+    return sentences
+
+
+class SentenceCache(object):
+    """Cache of sentence parses in a directory, with a file per sentence"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def key(self, module, sentence: str) -> str:
+        """Get the cache key for the sentence: the hash of the parser version and the normalized sentence"""
+        m = hashlib.md5()
+        m.update(module.get_parser_version().encode("utf-8"))
+        m.update(b"\0")
+        m.update(module.normalize_sentence(sentence).encode("utf-8"))
+        return m.hexdigest()
+
+    def _filename(self, module, key):
+        return os.path.join(self.directory, module.name, key[:2], key)
+
+    def get(self, module, key: str) -> Optional[str]:
+        try:
+            with open(self._filename(module, key), encoding="UTF-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, module, key: str, parse: str):
+        fn = self._filename(module, key)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(fn), ".{}.{}.tmp".format(os.getpid(), key))
+        with open(tmp, 'w', encoding="UTF-8") as f:
+            f.write(parse)
+        os.replace(tmp, fn)  # atomic, so readers never see a partial parse
+
+    def process(self, module, text: str) -> str:
+        """Process the text with the module, only parsing the sentences that are not in the cache"""
+        sentences = module.split_sentences(text)
+        keys = [self.key(module, sentence) for (_start, sentence) in sentences]
+        parses = {}  # key : parse
+        missing = OrderedDict()  # key : sentence, so sentences that occur more than once are parsed once
+        for key, (_start, sentence) in zip(keys, sentences):
+            if key not in parses and key not in missing:
+                parse = self.get(module, key)
+                if parse is None:
+                    missing[key] = sentence
+                else:
+                    parses[key] = parse
+        logging.debug("Sentence cache for {module.name}: {n} of {total} sentences cached"
+                      .format(n=len(sentences) - len(missing), total=len(sentences), **locals()))
+        if missing:
+            for key, parse in zip(missing, module.parse_sentences(list(missing.values()))):
+                self.put(module, key, parse)
+                parses[key] = parse
+        return module.join_sentences(text, sentences, [parses[key] for key in keys])
+
+
+def get_sentence_cache(module) -> Optional[SentenceCache]:
+    """Get the sentence cache for this module, or None if it is not enabled (see NLPIPE_SENTENCE_CACHE)"""
+    directory = os.environ.get("NLPIPE_SENTENCE_CACHE")
+    if not directory or not module.sentence_cache:
+        return None
+    return SentenceCache(directory)
@@ -0,0 +1,191 @@
+"""
+Streaming body formats for the bulk REST endpoints
+
+- ndjson (application/x-ndjson): one json object per line
+- tar (application/x-tar): a tar archive with a member per document, used for exporting results
+- frames (application/prs.nlpipe-frames): a sequence of length-prefixed frames, each consisting of a
+  "<id> <nbytes>[ <status>]\n" header followed by nbytes of raw (utf-8) data. The id is percent-encoded,
+  or * if no id is given. Since the data is not escaped, this is much cheaper than json for large XML/NAF documents.
+
+Request and response bodies can be compressed with gzip, or with zstd if the zstandard package is installed.
+The compression level can be set with NLPIPE_COMPRESSION_LEVEL (default: 6 for gzip, 3 for zstd).
+"""
+import gzip
+import json
+import os
+import tarfile
+import time
+import zlib
+from typing import Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote, unquote
+
+NDJSON_MIME = 'application/x-ndjson'
+TAR_MIME = 'application/x-tar'
+FRAMES_MIME = 'application/prs.nlpipe-frames'
+
+CHUNK_SIZE = 65536
+
+NO_ID = "*"
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Supported content encodings, in order of preference
+ENCODINGS = ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def chunked(pieces: Iterable[bytes], chunk_size=CHUNK_SIZE) -> Iterator[bytes]:
+    """Join the pieces into chunks of roughly chunk_size bytes"""
+    chunk = []
+    size = 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield b"".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b"".join(chunk)
+
+
+def read_chunks(stream, chunk_size=CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a file-like object in chunks"""
+    return iter(lambda: stream.read(chunk_size), b"")
+
+
+def encode_ndjson(objects: Iterable) -> Iterator[bytes]:
+    for obj in objects:
+        yield (json.dumps(obj) + "\n").encode("utf-8")
+
+
+def decode_ndjson(chunks: Iterable[bytes]) -> Iterator:
+    """Parse ndjson from an iterator of byte chunks, yielding one object per line"""
+    buffer = b""
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line.decode("utf-8"))
+    if buffer.strip():
+        yield json.loads(buffer.decode("utf-8"))
+
+
+def encode_frames(frames: Iterable[Tuple[Optional[str], str, Optional[str]]]) -> Iterator[bytes]:
+    """
+    Encode (id, data, status) triples as frames
+    :param frames: triples of (id or None, data string or bytes, status or None)
+    """
+    for id, data, status in frames:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        id = NO_ID if id is None else quote(str(id), safe="")
+        nbytes = len(data)
+        header = "{id} {nbytes}".format(**locals())
+        if status is not None:
+            header = "{header} {status}".format(**locals())
+        yield (header + "\n").encode("ascii")
+        yield data
+
+
+def decode_frames(chunks: Iterable[bytes]) -> Iterator[Tuple[Optional[str], bytes, Optional[str]]]:
+    """
+    Parse frames from an iterator of byte chunks, yielding (id, data, status) triples as soon as a frame is complete.
+    Raises a ValueError if the input is not valid
+    """
+    chunks = iter(chunks)
+    buffer = bytearray()
+
+    def fill(condition):
+        while not condition():
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            buffer.extend(chunk)
+        return True
+
+    while True:
+        if not fill(lambda: b"\n" in buffer):
+            if bytes(buffer).strip():
+                raise ValueError("Truncated frame header: {!r}".format(bytes(buffer[:100])))
+            return
+        end = buffer.index(b"\n")
+        header = bytes(buffer[:end]).decode("ascii", errors="replace").split(" ")
+        del buffer[:end+1]
+        if len(header) not in (2, 3) or not header[1].isdigit():
+            raise ValueError("Invalid frame header: {!r}".format(" ".join(header)[:100]))
+        id = None if header[0] == NO_ID else unquote(header[0])
+        nbytes = int(header[1])
+        status = header[2] if len(header) == 3 else None
+        if not fill(lambda: len(buffer) >= nbytes):
+            raise ValueError("Truncated frame for {id}: expected {nbytes} bytes, got {n}"
+                             .format(n=len(buffer), **locals()))
+        data = bytes(buffer[:nbytes])
+        del buffer[:nbytes]
+        yield id, data, status
+
+
+def encode_tar(members: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """Generate a tar archive containing a file per (name, data) pair without buffering the archive"""
+    mtime = time.time()
+    for name, data in members:
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        info.mode = 0o644
+        yield info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        yield data
+        padding = -len(data) % tarfile.BLOCKSIZE
+        if padding:
+            yield b"\0" * padding
+    yield b"\0" * (2 * tarfile.BLOCKSIZE)  # end of archive marker
+
+
+def check_encoding(encoding: str):
+    if encoding not in ENCODINGS:
+        raise ValueError("Unsupported content encoding: {encoding}, supported: {ENCODINGS}"
+                         .format(ENCODINGS=ENCODINGS, **locals()))
+
+
+def get_compression_level(encoding: str, level: Optional[int]=None) -> int:
+    if level is None:
+        level = os.environ.get("NLPIPE_COMPRESSION_LEVEL")
+    return DEFAULT_LEVELS[encoding] if level is None else int(level)
+
+
+def _compressobj(encoding, level):
+    check_encoding(encoding)
+    level = get_compression_level(encoding, level)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip header and trailer
+
+
+def compress(data: bytes, encoding: str, level: Optional[int]=None) -> bytes:
+    compressor = _compressobj(encoding, level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_chunks(chunks: Iterable[bytes], encoding: str, level: Optional[int]=None) -> Iterator[bytes]:
+    """Compress a stream of byte chunks, yielding compressed chunks as they become available"""
+    compressor = _compressobj(encoding, level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def decompressing_reader(stream, encoding: str):
+    """Wrap a (binary) file-like object in a file-like object that decompresses while reading"""
+    check_encoding(encoding)
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().stream_reader(stream)
+    return gzip.GzipFile(fileobj=stream, mode="rb")
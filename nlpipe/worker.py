@@ -1,3 +1,6 @@
+import os
+import socket
+import threading
 import time
 import sys
 import subprocess
@@ -5,6 +8,7 @@ import logging
 from typing import Iterable
 
 from nlpipe import client
+from nlpipe.backends import BACKEND_ERRORS
 from nlpipe.client import Client
 from nlpipe.module import get_module
 
@@ -15,9 +19,20 @@ from pydoc import locate
 class Worker(Process):
     """
     Base class for NLP workers.
+
+    The worker acts as a circuit breaker for its module: if processing fails and the module's check_status
+    fails as well, or if max_failures tasks in a row fail with a connection error or timeout (see
+    nlpipe.backends.BACKEND_ERRORS), the task is returned to the queue and the worker stops claiming tasks
+    until check_status succeeds again (probing with exponential backoff). Other errors (e.g. documents that the
+    module cannot process) are stored as the result of the task if the backend is available.
+
+    While processing, the worker extends the lease on its task every heartbeat_interval seconds.
     """
 
     sleep_timeout = 1
+    heartbeat_interval = 60
+    max_failures = 5  # consecutive backend errors before the backend is assumed to be down
+    max_backoff = 300  # maximum seconds between health probes
 
     def __init__(self, client, module, quit=False):
         """
@@ -30,9 +45,42 @@ class Worker(Process):
         self.module = module
         self.quit = quit
 
+    @property
+    def worker_id(self):
+        """Identification of this worker process for task leases"""
+        return "{}:{}".format(socket.gethostname(), os.getpid())
+
+    def _heartbeat(self, id, done: threading.Event):
+        while not done.wait(self.heartbeat_interval):
+            try:
+                self.client.heartbeat(self.module.name, id, worker=self.worker_id)
+            except:
+                logging.exception("Exception on heartbeat for {self.module.name}/{id}".format(**locals()))
+
+    def is_healthy(self):
+        """Probe the module backend with check_status"""
+        try:
+            self.module.check_status()
+        except Exception as e:
+            logging.warning("Module {self.module.name} is unavailable: {e}".format(**locals()))
+            return False
+        return True
+
+    def wait_until_healthy(self):
+        """Pause and probe the module with exponential backoff until it is available again"""
+        timeout = self.sleep_timeout
+        while True:
+            logging.info("Pausing {self.module.name} for {timeout} seconds".format(**locals()))
+            time.sleep(timeout)
+            if self.is_healthy():
+                break
+            timeout = min(timeout * 2, self.max_backoff)
+        logging.info("Module {self.module.name} available, resuming work".format(**locals()))
+
     def run(self):
+        failures = 0
         while True:
-            id, doc = self.client.get_task(self.module.name)
+            id, doc = self.client.get_task(self.module.name, worker=self.worker_id)
             if id is None:
                 if self.quit:
                     logging.info("No jobs for {self.module.name}, quitting!".format(**locals()))
@@ -40,14 +88,33 @@ class Worker(Process):
                 time.sleep(self.sleep_timeout)
                 continue
             logging.info("Received task {self.module.name}/{id} ({n} bytes)".format(n=len(doc), **locals()))
+            done = threading.Event()
+            threading.Thread(target=self._heartbeat, args=(id, done), daemon=True).start()
             try:
-                result = self.module.process(doc)
+                try:
+                    result = self.module.process(doc)
+                finally:
+                    done.set()
                 self.client.store_result(self.module.name, id, result)
                 logging.debug("Succesfully completed task {self.module.name}/{id} ({n} bytes)"
                               .format(n=len(result), **locals()))
+                failures = 0
+                self.materialize(id, result)
             except Exception as e:
                 logging.exception("Exception on parsing {self.module.name}/{id}"
                               .format(**locals()))
+                if isinstance(e, BACKEND_ERRORS):
+                    failures += 1
+                if failures >= self.max_failures or not self.is_healthy():
+                    logging.warning("Module {self.module.name} is unavailable ({failures} backend error(s) in a row), "
+                                    "returning task {id} to the queue and pausing".format(**locals()))
+                    try:
+                        self.client.release_task(self.module.name, id)
+                    except:
+                        logging.exception("Exception on releasing task {self.module.name}/{id}".format(**locals()))
+                    self.wait_until_healthy()
+                    failures = 0
+                    continue
                 try:
                     self.client.store_error(self.module.name, id, str(e))
                 except:
@@ -55,6 +122,16 @@ class Worker(Process):
                                       .format(**locals()))
 
 
+    def materialize(self, id, result):
+        """Convert the result to the module's eager formats and store the conversions (see Module.eager_formats)"""
+        for format in self.module.get_eager_formats():
+            try:
+                converted = self.module.convert(id, result, format)
+                self.client.store_converted(self.module.name, id, format, converted, eager=True)
+            except:
+                logging.exception("Exception on converting {self.module.name}/{id} to {format}".format(**locals()))
+
+
 def _import(name):
     result = locate(name)
     if result is None:
@@ -20,10 +20,8 @@ setup(
     install_requires=[
         "Flask",
         "requests",
-        "pynlpl",
-        "corenlp_xml>=1.0.4",
+        "lxml",
         "amcatclient>=3.4.9",
-        "KafNafParserPy",
         "PyJWT",
     ]
 )
@@ -74,3 +74,20 @@ def test_alpino_unicode():
     text = "Bjarnfre\xf0arson leeft"
     # tokenize should convery to utf-8 and only add final line break
     assert_equal(tokenize(text), text + "\n")
+
+
+def test_interpret_unknown_pos():
+    """Unknown POS tags should give pos1 '?' and a single warning per document"""
+    import logging
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logger = logging.getLogger("nlpipe.modules.alpino")
+    logger.addHandler(handler)
+    try:
+        tokens = list(interpret_parse(_PARSE.replace("|name|name(PER)|", "|newtag|name(PER)|")
+                                      .replace("|adj|adj|", "|newtag|adj|")))
+    finally:
+        logger.removeHandler(handler)
+    assert_equal([token[5] for token in tokens], ['?', 'V', '?'])
+    assert_equal([record.getMessage() for record in records], ["Unknown POS tag(s) in alpino parse: newtag (2x)"])
@@ -0,0 +1,52 @@
+"""
+Test the csv conversion of the Alpino NAF modules
+"""
+from nose.tools import assert_equal
+
+from nlpipe.modules.alpinonaf import AlpinoNERCParser, AlpinoCorefPipe
+
+NAF = """<?xml version="1.0" encoding="UTF-8"?>
+<NAF xml:lang="nl" version="v3">
+<nafHeader><linguisticProcessors layer="terms"><lp name="alpino"/></linguisticProcessors></nafHeader>
+<text>
+<wf id="w1" offset="0" length="4" sent="1" para="1">Mark</wf>
+<wf id="w2" offset="5" length="5" sent="1" para="1">Rutte</wf>
+<wf id="w3" offset="11" length="7" sent="1">bezocht</wf>
+<wf id="w4" offset="19" length="5" sent="1" para="1">"a, b"</wf>
+</text>
+<terms>
+<term id="t_1" lemma="Mark_Rutte" pos="name"><span><target id="w1"/><target id="w2"/></span></term>
+<term id="t_3" lemma="bezoeken" pos="verb"><span><target id="w3"/></span></term>
+<term id="t_4" lemma="a" pos="punct"><span><target id="w4"/></span></term>
+</terms>
+<deps>
+<dep from="t_3" to="t_1" rfunc="hd/su"/>
+<dep from="t_3" to="t_4" rfunc="--/--"/>
+</deps>
+<constituency><tree><nt id="nter1" label="top"/><t id="ter1"><span><target id="t_1"/></span></t></tree></constituency>
+<entities>
+<entity id="e1" type="PER"><references><span><target id="t_1"/></span></references></entity>
+</entities>
+<coreferences>
+<coref id="co1" type="entity"><span><target id="t_3"/><target id="t_4" head="yes"/></span></coref>
+</coreferences>
+</NAF>
+"""
+
+
+def test_convert():
+    """Test the csv output (as of the KafNafParser based converter)"""
+    assert_equal(AlpinoNERCParser().convert(7, NAF, "csv").splitlines(), [
+        'doc_id,token_id,para,sentence,offset,token,lemma,POS,pos1,parent,relation',
+        '7,1,1,1,0,Mark,Mark_Rutte,name,M,3,su',
+        '7,1,1,1,5,Rutte,Mark_Rutte,name,M,3,su',
+        '7,3,,1,11,bezocht,bezoeken,verb,V,,',
+        '7,4,1,1,19,"""a, b""",a,punct,.,3,--',
+    ])
+    assert_equal(AlpinoCorefPipe().convert(7, NAF, "csv").splitlines(), [
+        'doc_id,token_id,para,sentence,offset,token,lemma,POS,pos1,parent,relation,ner_id,NER,coref_id',
+        '7,1,1,1,0,Mark,Mark_Rutte,name,M,3,su,e1,PER,',
+        '7,1,1,1,5,Rutte,Mark_Rutte,name,M,3,su,e1,PER,',
+        '7,3,,1,11,bezocht,bezoeken,verb,V,,,,,',
+        '7,4,1,1,19,"""a, b""",a,punct,.,3,--,,,co1',
+    ])
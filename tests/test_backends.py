@@ -0,0 +1,88 @@
+import os
+import time
+from tempfile import TemporaryDirectory
+
+from nose.tools import assert_equal, assert_raises, assert_true, assert_false
+
+from nlpipe.backends import BackendPool, HostSemaphore, get_backends
+from nlpipe.modules.test_upper import TestUpper
+
+
+def test_least_loaded():
+    pool = BackendPool(["a", "b"])
+    with pool.request() as first:
+        with pool.request() as second:
+            assert_equal({first, second}, {"a", "b"})
+    # all requests done: prefer the backend with the lowest latency
+    a, b = pool.backends
+    a.latency, b.latency = 2, 1
+    with pool.request() as url:
+        assert_equal(url, "b")
+
+
+def test_eject():
+    pool = BackendPool(["a", "b"], eject_timeout=10)
+    a, b = pool.backends
+    a.latency, b.latency = 1, 2
+    with assert_raises(ConnectionError):
+        with pool.request() as url:
+            assert_equal(url, "a")
+            raise ConnectionError()
+    assert_false(a.is_healthy())
+    assert_true(8 < a.ejected_until - time.time() <= 10)
+    with pool.request() as url:
+        assert_equal(url, "b")
+
+    # other errors are blamed on the document, not the backend
+    with assert_raises(ValueError):
+        with pool.request() as url:
+            raise ValueError()
+    assert_true(b.is_healthy())
+
+    # a second failure doubles the ejection time, success readmits the backend
+    a.ejected_until = 0
+    with assert_raises(ConnectionError):
+        with pool.request() as url:
+            assert_equal(url, "a")
+            raise ConnectionError()
+    assert_true(18 < a.ejected_until - time.time() <= 20)
+    pool.success(a, 1)
+    assert_true(a.is_healthy())
+
+
+def test_check():
+    def probe(url):
+        if url != "b":
+            raise Exception("offline")
+    pool = get_backends("a, b/")
+    assert_equal(pool.urls, ["a", "b"])
+    pool.check(probe)
+    assert_false(pool.backends[0].is_healthy())
+    assert_true(pool.backends[1].is_healthy())
+    assert_raises(Exception, BackendPool(["a"]).check, probe)
+
+
+def test_max_concurrency():
+    with TemporaryDirectory() as lock_dir:
+        sem = HostSemaphore("http://server", 2, lock_dir=lock_dir)
+        # slots are shared by all semaphores (and processes) with the same name
+        other = HostSemaphore("http://server", 2, lock_dir=lock_dir)
+        slot1 = sem.try_acquire()
+        slot2 = other.try_acquire()
+        assert_true(slot1 is not None and slot2 is not None)
+        assert_equal(sem.try_acquire(), None)
+        assert_true(HostSemaphore("http://other", 2, lock_dir=lock_dir).try_acquire() is not None)
+        HostSemaphore.release(slot1)
+        with sem.acquire():
+            assert_equal(other.try_acquire(), None)
+        HostSemaphore.release(slot2)
+
+
+def test_module_max_concurrency():
+    m = TestUpper()
+    assert_equal(m.get_max_concurrency(), None)
+    os.environ["TEST_UPPER_MAX_CONCURRENCY"] = "3"
+    try:
+        assert_equal(m.get_max_concurrency(), 3)
+    finally:
+        del os.environ["TEST_UPPER_MAX_CONCURRENCY"]
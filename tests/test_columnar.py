@@ -0,0 +1,64 @@
+import json
+from tempfile import TemporaryDirectory
+from unittest import SkipTest
+
+from nose.tools import assert_equal
+
+from nlpipe import columnar
+from nlpipe.client import FSClient
+from nlpipe.restserver import app
+from nlpipe.transport import FRAMES_MIME, decode_frames
+from tests.test_alpino import _PARSE
+
+if columnar.pyarrow is None:
+    raise SkipTest("pyarrow is not installed")
+
+_TOKENS = {'doc': ['7', '7', '7'], 'id': [0, 1, 2], 'sentence': [1, 1, 1], 'offset': [0, 1, 2],
+           'word': ['Toob', 'is', 'dik'], 'lemma': ['Toob', 'ben', 'dik'], 'pos': ['M', 'V', 'A'],
+           'rel': ['su', 'hd', 'predc'], 'parent': [1, None, 1]}
+
+
+def test_convert():
+    from nlpipe.modules.alpino import AlpinoParser
+    table = columnar.decode(AlpinoParser().convert("7", _PARSE, "arrow"))
+    assert_equal(table.to_pydict(), _TOKENS)
+    assert_equal(str(table.schema.field("pos").type), "dictionary<values=string, indices=int32, ordered=0>")
+    assert_equal(str(table.schema.field("parent").type), "int32")
+    assert_equal(columnar.decode(AlpinoParser().convert("7", _PARSE, "parquet"), "parquet"), table)
+
+
+def test_export_table():
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        for i in range(3):
+            app.client.process("alpino", "text {i}".format(**locals()), id=str(i), job="job1" if i else None)
+        list(app.client.get_tasks("alpino", 3))
+        for i in range(3):
+            app.client.store_result("alpino", str(i), _PARSE)
+
+        # single documents are cached as bytes
+        res = client.get("/api/modules/alpino/1?format=arrow")
+        assert_equal(res.mimetype, columnar.MIMETYPES["arrow"])
+        assert_equal(columnar.decode(res.data).column("doc").to_pylist(), ["1"] * 3)
+        assert_equal(app.client.get_converted("alpino", "1", "arrow"), res.data)
+
+        # bulk results are binary frames
+        res = client.post("/api/modules/alpino/bulk/result?format=parquet", data=json.dumps(["0", "2"]),
+                          headers={"Accept": FRAMES_MIME})
+        frames = {id: columnar.decode(data, "parquet").num_rows for (id, data, _status) in decode_frames([res.data])}
+        assert_equal(frames, {"0": 3, "2": 3})
+        res = client.post("/api/modules/alpino/bulk/result?format=arrow", data=json.dumps(["0"]))
+        assert_equal(res.status_code, 406)
+
+        for format in columnar.FORMATS:
+            res = client.get("/api/modules/alpino/export/{format}?job=job1".format(**locals()))
+            assert_equal(res.mimetype, columnar.MIMETYPES[format])
+            table = columnar.decode(res.data, format)
+            assert_equal(table.column("doc").to_pylist(), ["1"] * 3 + ["2"] * 3)
+            assert_equal(table.column("lemma").to_pylist(), _TOKENS['lemma'] * 2)
+        res = client.post("/api/modules/alpino/export/arrow", data=json.dumps(["0", "5"]))
+        assert_equal(columnar.decode(res.data).num_rows, 3)
+        assert_equal(client.get("/api/modules/test_upper/export/arrow").status_code, 404)
+        assert_equal(client.get("/api/modules/alpino/export/xml").status_code, 404)
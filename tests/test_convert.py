@@ -0,0 +1,39 @@
+from nose.tools import assert_equal
+
+from nlpipe.convert import convert_all
+
+
+def test_convert_all():
+    results = [(str(i), "TEST{}".format(i)) for i in range(20)]
+    converted = list(convert_all("test_upper", iter(results), "csv", max_inflight=3))
+    assert_equal(converted, [(id, "id,result\n{id},{result}\n".format(**locals()), None) for (id, result) in results])
+
+    (id, result, error), = convert_all("test_upper", [("1", "TEST")], "unknown_format")
+    assert_equal(result, None)
+    assert isinstance(error, Exception)
+
+
+def test_convert_unordered():
+    results = [(str(i), "TEST{}".format(i)) for i in range(20)]
+    converted = list(convert_all("test_upper", iter(results), "json", max_inflight=5, ordered=False))
+    assert_equal(sorted(id for (id, result, error) in converted), sorted(id for (id, result) in results))
+    assert all(error is None for (id, result, error) in converted)
+
+
+def test_iter_outcomes():
+    from tempfile import TemporaryDirectory
+    from nlpipe.client import FSClient
+    with TemporaryDirectory() as root:
+        client = FSClient(root)
+        for i in range(3):
+            client.process("test_upper", "test{}".format(i), id=str(i))
+        list(client.get_tasks("test_upper", 3))
+        client.store_result("test_upper", "0", "TEST0")
+        client.store_result("test_upper", "1", "TEST1")
+        client.store_error("test_upper", "2", "Failed!")
+        outcomes = {id: (result, error) for (id, result, error) in client.iter_outcomes("test_upper", ["0", "1", "2"],
+                                                                                     format="csv")}
+        assert_equal(outcomes["0"], ("id,result\n0,TEST0\n", None))
+        assert_equal(str(outcomes["2"][1]), "Failed!")
+        assert_equal(client.bulk_result("test_upper", ["0", "1"], format="csv"),
+                     {"0": "id,result\n0,TEST0\n", "1": "id,result\n1,TEST1\n"})
@@ -20,3 +20,56 @@ def test_process():
     assert_equal(len(tokens), 2)
     assert_equal(tokens[1]['lemma'], "word")
     
+
+
+XML = """<?xml version="1.0" encoding="UTF-8"?>
+<root><document><sentences>
+<sentence id="1"><tokens>
+<token id="1"><word>John</word><lemma>John</lemma><CharacterOffsetBegin>0</CharacterOffsetBegin><POS>NNP</POS><NER>PERSON</NER></token>
+<token id="2"><word>and</word><lemma>and</lemma><CharacterOffsetBegin>5</CharacterOffsetBegin><POS>CC</POS><NER>O</NER></token>
+<token id="3"><word>Mary</word><lemma>Mary</lemma><CharacterOffsetBegin>9</CharacterOffsetBegin><POS>NNP</POS><NER>PERSON</NER></token>
+<token id="4"><word>sleep</word><lemma>sleep</lemma><CharacterOffsetBegin>14</CharacterOffsetBegin><POS>VBP</POS><NER>O</NER></token>
+<token id="5"><word>"a, b"</word><lemma>"a, b"</lemma><CharacterOffsetBegin>19</CharacterOffsetBegin><POS>.</POS></token>
+</tokens>
+<dependencies type="basic-dependencies">
+<dep type="nsubj"><governor idx="4">sleep</governor><dependent idx="2">and</dependent></dep>
+</dependencies>
+<dependencies type="collapsed-ccprocessed-dependencies">
+<dep type="root"><governor idx="0">ROOT</governor><dependent idx="4">sleep</dependent></dep>
+<dep type="nsubj"><governor idx="4">sleep</governor><dependent idx="1">John</dependent></dep>
+<dep type="conj:and"><governor idx="1">John</governor><dependent idx="3">Mary</dependent></dep>
+<dep type="nsubj"><governor idx="4">sleep</governor><dependent idx="3">Mary</dependent></dep>
+<dep type="cc"><governor idx="1">John</governor><dependent idx="2">and</dependent></dep>
+<dep type="punct"><governor idx="4">sleep</governor><dependent idx="5">.</dependent></dep>
+</dependencies></sentence>
+<sentence id="2"><tokens>
+<token id="1"><word>Zij</word><lemma>zij</lemma><CharacterOffsetBegin>21</CharacterOffsetBegin><POS>PRP</POS><NER>O</NER></token>
+</tokens></sentence>
+</sentences>
+<coreference><coreference>
+<mention representative="true"><sentence>1</sentence><start>1</start><end>2</end><head>1</head><text>John</text></mention>
+<mention><sentence>2</sentence><start>1</start><end>2</end><head>1</head><text>Zij</text></mention>
+</coreference></coreference>
+</document></root>
+"""
+
+
+def test_convert():
+    """Test the streaming converters (output as of the corenlp_xml based converters)"""
+    from nlpipe.modules.corenlp import CoreNLPParser
+    assert_equal(CoreNLPParser().convert("7", XML, "csv").splitlines(), [
+        'doc_id,sentence,token_id,offset,token,lemma,POS,pos1,NER,relation,parent',
+        '7,1,1,0,John,John,NNP,R,PERSON,nsubj,4',
+        '7,1,2,5,and,and,CC,O,O,cc,1',
+        '7,1,3,9,Mary,Mary,NNP,R,PERSON,conj:and,1',  # links are processed grouped by relation
+        '7,1,4,14,sleep,sleep,VBP,V,O,,',
+        '7,1,5,19,"""a, b""","""a, b""",.,O,,punct,4',
+        '7,2,1,21,Zij,zij,PRP,O,O,,'])
+    assert_equal(CoreNLPLemmatizer().convert("7", XML, "csv").splitlines(), [
+        'id,sentence,offset,word,lemma,POS,pos1,ner',
+        '7,1,0,John,John,NNP,R,PERSON',
+        '7,1,5,and,and,CC,O,O',
+        '7,1,9,Mary,Mary,NNP,R,PERSON',
+        '7,1,14,sleep,sleep,VBP,V,O',
+        '7,1,19,"""a, b""","""a, b""",.,O,',
+        '7,2,21,Zij,zij,PRP,O,O'])
@@ -40,3 +40,46 @@ def test_csv():
     assert_equal(r[0]["pos"], "O")
     assert_equal(r[1]["pos"], "V")
 
+
+def _fake_frog_server():
+    """Start a frog-like server on a free port that answers every line with two tokens per sentence"""
+    import socketserver
+    import threading
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            self.server.connections += 1
+            for line in self.rfile:
+                line = line.decode("utf-8").strip()
+                if line == "EOT":
+                    self.wfile.write(b"READY\n")
+                elif line:
+                    for sent in line.split(". "):
+                        for i, word in enumerate(sent.split(), start=1):
+                            row = [str(i), word, word.lower(), "[morph]", "N(soort,ev)", "0.9", "O", "B-NP"]
+                            self.wfile.write(("\t".join(row) + "\n").encode("utf-8"))
+                        self.wfile.write(b"\n")
+
+    server = socketserver.ThreadingTCPServer(("localhost", 0), Handler)
+    server.daemon_threads = True
+    server.connections = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_connection_pool():
+    """
+    Test whether connections are reused between documents and output is parsed
+    """
+    server = _fake_frog_server()
+    try:
+        c = FrogLemmatizer("localhost:{}".format(server.server_address[1]))
+        r = list(csv.DictReader(StringIO(c.process("Twee Woordjes. En drie"))))
+        assert_equal([(t["sentence"], t["offset"], t["lemma"]) for t in r],
+                     [("1", "0", "twee"), ("1", "4", "woordjes"), ("2", "12", "en"), ("2", "14", "drie")])
+        r = list(csv.DictReader(StringIO(c.process("Nog een"))))
+        assert_equal(len(r), 2)
+        assert_equal(server.connections, 1)
+    finally:
+        server.shutdown()
+        server.server_close()
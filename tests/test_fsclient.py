@@ -1,11 +1,12 @@
 from tempfile import TemporaryDirectory
 import time
+import threading
 import os.path
 import json
 
-from nose.tools import assert_equal, assert_true, assert_false
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
 
-from nlpipe.client import FSClient, get_id
+from nlpipe.client import FSClient, get_id, parse_pipelines
 from nlpipe import modules
 
 def test_pipeline():
@@ -46,3 +47,304 @@ def test_pipeline():
         # Retrieve results in different format
         result = c.result(m, id1, format='json')
         assert_equal(json.loads(result), {'id': id1, 'result': 'THIS IS A TEST', 'status': 'OK'})
+
+
+def test_lease():
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir, lease_timeout=60, max_attempts=2)
+        m = "test_upper"
+        id = c.process(m, "test")
+        assert_equal(c.get_task(m, worker="w1"), (id, "test"))
+        c.heartbeat(m, id, worker="w1")
+        assert_raises(ValueError, c.heartbeat, m, id, worker="w2")
+        assert_equal(c.requeue_expired(m), [])  # lease still valid
+        assert_equal(c.status(m, id), "STARTED")
+
+        # expired lease: return to queue
+        c.lease_timeout = -1
+        c.heartbeat(m, id, worker="w1")
+        assert_equal(c.requeue_expired(m), [id])
+        assert_equal(c.status(m, id), "PENDING")
+        assert_raises(ValueError, c.heartbeat, m, id, worker="w1")
+
+        # released tasks don't count as an attempt
+        assert_equal(c.get_task(m, worker="w2"), (id, "test"))
+        c.release_task(m, id)
+        assert_equal(c.status(m, id), "PENDING")
+
+        # second expired attempt: give up
+        assert_equal(c.get_task(m, worker="w3"), (id, "test"))
+        assert_equal(c.requeue_expired(m), [])
+        assert_equal(c.status(m, id), "ERROR")
+        assert_raises(Exception, c.result, m, id)
+
+        # reset_error starts counting again, result removes lease
+        c.process(m, "test", reset_error=True)
+        assert_equal(c.get_task(m), (id, "test"))
+        c.store_result(m, id, "TEST")
+        assert_equal(c.requeue_expired(m), [])
+        assert_equal(c.status(m, id), "DONE")
+
+
+def test_priority():
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        m = "test_upper"
+        low = c.process(m, "low", priority=-1)
+        normal = c.process(m, "normal")
+        late = c.process(m, "late", priority=5, deadline=time.time() + 100)
+        early = c.process(m, "early", priority=5, deadline=time.time() + 10)
+        high = c.process(m, "high", priority=5)
+        bumped = c.process(m, "bumped")
+        c.process(m, "bumped", priority=10)  # already pending, but now more urgent
+        order = [c.get_task(m)[0] for _ in range(7)]
+        assert_equal(order, [bumped, early, late, high, normal, low, None])
+
+        # released tasks keep their priority
+        c.process(m, "normal2")
+        urgent = c.process(m, "urgent", priority=1)
+        assert_equal(c.get_task(m)[0], urgent)
+        c.release_task(m, urgent)
+        assert_equal(c.get_task(m)[0], urgent)
+
+
+def test_priority_batches():
+    """Test whether tickets are read in batches and unindexed pending tasks are processed"""
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        c.ticket_batch = 2
+        m = "test_upper"
+        ids = [c.process(m, "doc{}".format(i)) for i in range(5)]
+        c._write(m, 'PENDING', "unindexed", "doc")
+        assert_equal([c.get_task(m)[0] for _ in range(7)], ids + ["unindexed", None])
+
+
+def test_fair_scheduling():
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        m = "test_upper"
+        big = [c.process(m, "big{}".format(i), job="big") for i in range(6)]
+        small = [c.process(m, "small{}".format(i), job="small") for i in range(2)]
+        other = c.process(m, "other")
+        jobs = {id: job for (job, ids) in [("big", big), ("small", small), ("default", [other])] for id in ids}
+        # first round: one of each job, then the remaining small one, then the big job
+        order = [jobs[c.get_task(m)[0]] for _ in range(9)]
+        assert_equal(sorted(order[:3]), ["big", "default", "small"])
+        assert_equal(sorted(order[3:5]), ["big", "small"])
+        assert_equal(order[5:], ["big"] * 4)
+
+        # weights
+        c.set_job_weight(m, "heavy", 3)
+        heavy = [c.process(m, "heavy{}".format(i), job="heavy") for i in range(6)]
+        light = [c.process(m, "light{}".format(i), job="light") for i in range(6)]
+        order = [c.get_task(m)[0] for _ in range(4)]
+        assert_equal(len(set(order) & set(heavy)), 3)
+
+        # job status
+        for id in big + small:
+            c.store_result(m, id, "DONE")
+        c.store_error(m, other, "ERROR")
+        stats = c.job_statistics(m)
+        assert_equal({job: (s['DONE'], s['ERROR'], s['STARTED']) for (job, s) in stats.items()},
+                     {"big": (6, 0, 0), "small": (2, 0, 0), "heavy": (0, 0, 3), "light": (0, 0, 1)})
+        assert_true(stats["big"]["throughput"] > 0)
+
+        assert_raises(ValueError, c.process, m, "x", job="../etc")
+
+
+def test_job_status():
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        m = "test_upper"
+        done = c.process(m, "done")
+        c.get_task(m)
+        c.store_result(m, done, "DONE")
+        ids = c.bulk_process(m, ["a", "b", "c", "done"], job="job1")
+        assert_equal(c.jobs(m), ["job1"])
+        assert_equal(c.job_ids(m, "job1"), ids)
+        status = c.job_status(m, "job1")
+        assert_equal({s: status[s] for s in ("PENDING", "STARTED", "DONE", "ERROR", "total")},
+                     dict(PENDING=3, STARTED=0, DONE=1, ERROR=0, total=4))
+        assert_equal(status["eta"], None)
+
+        # resubmitting to the same job does not count twice, and a task can be part of multiple jobs
+        c.bulk_process(m, ["a", "b"], job="job1")
+        c.bulk_process(m, ["a"], job="job2")
+        assert_equal(c.job_status(m, "job1")["total"], 4)
+        a, b = ids[:2]
+        assert_equal(c.get_task(m)[0], a)
+        assert_equal(c.get_task(m)[0], b)
+        c.store_result(m, a, "A")
+        c.store_error(m, b, "error")
+        status = c.job_status(m, "job1")
+        assert_equal({s: status[s] for s in ("PENDING", "STARTED", "DONE", "ERROR")},
+                     dict(PENDING=1, STARTED=0, DONE=2, ERROR=1))
+        assert_true(status["throughput"] > 0)
+        assert_true(status["eta"] >= 0)
+        assert_equal(c.job_status(m, "job2")["DONE"], 1)
+
+        # storing a completed task again does not count as another completion
+        counters = os.path.join(c._job_dir(m, "job1"), "counters")
+        assert_equal(json.load(open(counters))["completed"], 2)
+        c.store_error(m, a, "error")
+        assert_equal(json.load(open(counters))["completed"], 2)
+        assert_equal(c.job_status(m, "job1")["ERROR"], 2)
+
+        c.process(m, "b", reset_error=True)
+        assert_equal(c.job_status(m, "job1")["PENDING"], 2)
+        assert_raises(ValueError, c.job_status, m, "nosuchjob")
+
+
+def test_convert_cache():
+    with TemporaryDirectory() as d:
+        c = FSClient(d, convert_cache_size=1000)
+        for i in range(3):
+            c.process("test_upper", "test{}".format(i), id=str(i))
+        list(c.get_tasks("test_upper", 3))
+        c.store_result("test_upper", "0", "RESULT")
+        expected = '{"id": "0", "status": "OK", "result": "RESULT"}'
+        assert_equal(c.result("test_upper", "0", format="json"), expected)
+        assert_equal(c.get_converted("test_upper", "0", "json"), expected)
+        assert_equal(c.cache_statistics("test_upper")["misses"], 1)
+        assert_equal(c.result("test_upper", "0", format="json"), expected)
+        assert_equal(c.cache_statistics("test_upper")["hits"], 2)
+
+        # storing the result again invalidates the cache
+        c.store_result("test_upper", "0", "NEW")
+        assert_equal(c.get_converted("test_upper", "0", "json"), None)
+        assert_equal(json.loads(c.result("test_upper", "0", format="json"))["result"], "NEW")
+
+        # least recently used conversions are evicted
+        for id in "1", "2":
+            c.store_result("test_upper", id, "X" * 500)
+        c.result("test_upper", "1", format="json")
+        c.result("test_upper", "0", format="json")  # 0 is now used more recently than 1
+        os.utime(c._converted_filename("test_upper", "json", "1"), (0, 0))
+        c.result("test_upper", "2", format="json")
+        assert_equal(c.get_converted("test_upper", "1", "json"), None)
+        assert c.get_converted("test_upper", "0", "json") is not None
+        assert c.get_converted("test_upper", "2", "json") is not None
+        assert_equal(c.cache_statistics("test_upper")["evictions"], 1)
+
+
+def test_convert_concurrent():
+    # threads of the (threaded) rest server can convert and cache the same result at the same time
+    with TemporaryDirectory() as d:
+        c = FSClient(d, convert_cache_size=10 ** 6)
+        c.process("test_upper", "test", id="0")
+        c.get_task("test_upper")
+        c.store_result("test_upper", "0", "RESULT")
+        errors = []
+
+        def convert():
+            try:
+                for _i in range(50):
+                    c.store_converted("test_upper", "0", "json", "CONVERTED")
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=convert) for _i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_equal(errors, [])
+        assert_equal(os.listdir(os.path.dirname(c._converted_filename("test_upper", "json", "0"))), ["0"])
+        assert_equal(c.get_converted("test_upper", "0", "json"), "CONVERTED")
+
+
+def test_blobs():
+    with TemporaryDirectory() as d:
+        c = FSClient(d)
+        id = c.process_modules(["test_upper", "alpino"], "shared text")
+        assert_equal(os.listdir(os.path.join(d, "blobs")), [id])
+        assert_true(os.path.samefile(c._filename("test_upper", "PENDING", id), c._filename("alpino", "PENDING", id)))
+        assert_equal(c.get_task("alpino"), (id, "shared text"))
+
+        # the blob is removed once no module needs the document anymore
+        c.store_result("alpino", id, "parse")
+        assert_equal(os.listdir(os.path.join(d, "blobs")), [id])
+        assert_equal(c.get_task("test_upper"), (id, "shared text"))
+        c.store_error("test_upper", id, "error")
+        assert_equal(os.listdir(os.path.join(d, "blobs")), [])
+
+        # resubmitting writes the blob again
+        c.process("test_upper", "shared text", reset_error=True)
+        assert_equal(c.get_task("test_upper"), (id, "shared text"))
+
+
+def test_blobs_concurrent():
+    # documents submitted at the same time for different modules share a single blob
+    with TemporaryDirectory() as d:
+        c = FSClient(d)
+        errors = []
+
+        def submit(module):
+            try:
+                for i in range(50):
+                    c.process(module, "text {i}".format(**locals()))
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=submit, args=(module,)) for module in ("test_upper", "alpino")]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert_equal(errors, [])
+        assert_equal(len(os.listdir(os.path.join(d, "blobs"))), 50)
+        for module in "test_upper", "alpino":
+            assert_equal(c.status(module, get_id("text 7")), "PENDING")
+
+
+def test_pipelines():
+    with TemporaryDirectory() as d:
+        c = FSClient(d, pipelines=parse_pipelines("test_upper -> alpino"))
+        c.process("test_upper", "text", id="1", priority=2, job="job1")
+        c.process("test_upper", "text 2", id="2")
+        assert_equal(c.get_task("test_upper")[0], "1")
+        c.store_result("test_upper", "1", "TEXT")
+        assert_equal(c.get_task("alpino"), ("1", "TEXT"))
+        assert_equal(c.job_status("alpino", "job1")["STARTED"], 1)
+        assert_equal(c._read_lease("alpino", "1")["priority"], 2)
+
+        # documents that were done before the pipeline was configured
+        c.pipelines = {}
+        c.store_result("test_upper", c.get_task("test_upper")[0], "TEXT 2")
+        assert_equal(c.status("alpino", "2"), "UNKNOWN")
+        assert_equal(c.process_results("alpino", "test_upper", ["2", "3"], job="job1"), ["2"])
+        assert_equal(c.get_task("alpino"), ("2", "TEXT 2"))
+        assert_equal(c.job_status("alpino", "job1")["STARTED"], 2)
+        assert_raises(ValueError, parse_pipelines, "test_upper->")
+
+
+
+def test_pipelines_downstream_error():
+    with TemporaryDirectory() as d:
+        c = FSClient(d, pipelines=parse_pipelines("test_upper -> alpino"))
+        c.process("test_upper", "text", id="1")
+        c.get_task("test_upper")
+
+        def process(module, *args, **kargs):
+            raise OSError("Cannot queue for {module}".format(**locals()))
+        c.process = process
+        c.store_result("test_upper", "1", "TEXT")
+        assert_equal(c.status("test_upper", "1"), "DONE")
+        assert_equal(c.result("test_upper", "1"), "TEXT")
+        assert_equal(c.status("alpino", "1"), "UNKNOWN")
+
+
+def test_claim_no_rescan():
+    """Removing claimed tickets should not cause the job dir to be scanned again"""
+    with TemporaryDirectory() as d:
+        c = FSClient(d)
+        for i in range(5):
+            c.process("test_upper", "test{}".format(i), id=str(i))
+        assert_equal(c.get_task("test_upper")[0], "0")
+        cache = c._tickets["test_upper", 0, "default"]
+        assert_equal([c.get_task("test_upper")[0] for _i in range(3)], ["1", "2", "3"])
+        assert c._tickets["test_upper", 0, "default"] is cache
+
+        # tickets added by others are still seen
+        c.process("test_upper", "test5", id="5", priority=0)
+        time.sleep(0.01)
+        c.process("test_upper", "test", id="00")
+        assert_equal([c.get_task("test_upper")[0] for _i in range(3)], ["4", "5", "00"])
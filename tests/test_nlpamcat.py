@@ -0,0 +1,47 @@
+"""
+Test the NAF input documents and csv export of nlpamcat
+"""
+from tempfile import TemporaryDirectory
+from unittest import SkipTest
+
+from nose.tools import assert_equal, assert_raises
+
+from nlpipe.client import FSClient
+
+try:
+    from nlpipe.nlpamcat import _get_text, get_csv, get_job_name
+except ImportError:
+    raise SkipTest("amcatclient is not installed")
+
+
+def test_get_naf():
+    """Test the NAF documents (as of the KafNafParser based serialization)"""
+    a = dict(id=1, headline='Kop & <staart> "x"', text="Dit is\n de ]]> tekst.\n\nTweede  alinea\r", uuid="abc-123",
+             date="2017-01-01T00:00:00", medium="De Krant", section="Binnenland", page=3, author="A\tB")
+    assert_equal(_get_text(a), 'Kop & <staart> "x"\n\nDit is de ]]> tekst.\n\nTweede alinea')
+    assert_equal(_get_text(a, to_naf=True), """<?xml version='1.0' encoding='UTF-8'?>
+<NAF xml:lang="nl" version="3.0">
+  <raw><![CDATA[Kop & <staart> "x"
+
+Dit is de ]]]]><![CDATA[> tekst.
+
+Tweede alinea]]></raw>
+  <nafHeader>
+    <public publicId="abc-123"/>
+    <fileDesc author="A&#9;B" title="Kop &amp; &lt;staart&gt; &quot;x&quot;" creationtime="2017-01-01T00:00:00" \
+magazine="De Krant" pages="3" section="Binnenland"/>
+  </nafHeader>
+</NAF>
+""")
+    assert_raises(ValueError, _get_text, dict(headline="h", text="\x01", uuid="u"), to_naf=True)
+
+
+def test_get_csv():
+    """The results of an articleset submitted as a job are exported without asking amcat for the ids"""
+    with TemporaryDirectory() as d:
+        c = FSClient(d)
+        for id in "1", "2":
+            c.process("test_upper", "text", id=id, job=get_job_name(3, 4))
+            c.store_result("test_upper", c.get_task("test_upper")[0], "TEXT")
+        csv = b"".join(get_csv(None, 3, 4, c, "test_upper")).decode("utf-8")
+        assert_equal(csv.splitlines(), ["id,result", "1,TEXT", "2,TEXT"])
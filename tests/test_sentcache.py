@@ -0,0 +1,112 @@
+import csv
+import os
+import re
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+from nose.tools import assert_equal
+
+from nlpipe.modules.alpino import AlpinoParser
+from nlpipe.modules.corenlp import CoreNLPLemmatizer, _utf16_offsets
+from nlpipe.modules.frog import FrogLemmatizer
+from nlpipe.sentcache import split_sentences
+from tests.test_frog import _fake_frog_server
+
+_TEXT = "Dit is een zin.\n\nEn nog een  zin, zei hij. nietwaar? Dit is een zin. (3 zinnen)"
+
+
+def test_split_sentences():
+    assert_equal(split_sentences(_TEXT),
+                 [(0, "Dit is een zin."), (17, "En nog een  zin, zei hij. nietwaar?"), (53, "Dit is een zin."),
+                  (69, "(3 zinnen)")])
+    assert_equal(split_sentences("  Een 'zin.'\n\"Twee\"\n"), [(2, "Een 'zin.'"), (13, '"Twee"')])
+    assert_equal(split_sentences(" \n"), [])
+
+
+def _blocks(text):
+    """Split text into sentences as the fake parsers below do: at blank lines and after every '.' or '?'"""
+    return [sent for block in text.split("\n\n") for sent in re.split(r"(?<=[.?]) +", block) if sent.strip()]
+
+
+class _FakeAlpino(AlpinoParser):
+    """Parse every word as a dependent of the first word of the sentence"""
+    calls = 0
+
+    def _parse(self, text):
+        self.calls += 1
+        lines = []
+        for sid, sent in enumerate(_blocks(text), start=1):
+            words = sent.split()
+            tokens = ["{word}|{word}|{i}|{}|noun|noun|x".format(i + 1, **locals()) for (i, word) in enumerate(words)]
+            lines.append("top|top|0|0|top|top|top|top/hd|{}|{sid}".format(tokens[0], **locals()))
+            lines += ["{}|hd/mod|{}|{}".format(tokens[0], token, sid) for token in tokens[1:]]
+        return "\n".join(lines)
+
+
+class _FakeCoreNLP(CoreNLPLemmatizer):
+    """Tokenize on white space, with sentences as in _blocks"""
+    calls = 0
+
+    def _process(self, text):
+        self.calls += 1
+        out = ["<root><document><sentences>"]
+        position = 0
+        for sid, sent in enumerate(_blocks(text), start=1):
+            out.append('<sentence id="{sid}"><tokens>'.format(**locals()))
+            position = text.index(sent, position)
+            for i, m in enumerate(re.finditer(r"\S+", sent), start=1):
+                begin, end, word = m.start() + position, m.end() + position, m.group()
+                out.append('<token id="{i}"><word>{word}</word><lemma>{word}</lemma><CharacterOffsetBegin>{begin}'
+                           '</CharacterOffsetBegin><CharacterOffsetEnd>{end}</CharacterOffsetEnd><POS>NN</POS>'
+                           '<NER>O</NER></token>'.format(**locals()))
+            out.append('</tokens></sentence>')
+        out.append("</sentences></document></root>")
+        return "".join(out)
+
+
+def _process_cached(module, text):
+    os.environ["NLPIPE_SENTENCE_CACHE"] = module.cache_dir
+    try:
+        return module.process(text)
+    finally:
+        del os.environ["NLPIPE_SENTENCE_CACHE"]
+
+
+def test_sentence_cache():
+    # the second sentence is split in two by the parser, so alpino parses the sentences one at a time,
+    # while corenlp uses the offsets to find the sentence of each parsed sentence
+    for module, calls in [(_FakeAlpino(), 4), (_FakeCoreNLP(), 1)]:
+        with TemporaryDirectory() as module.cache_dir:
+            expected = module.convert(1, module.process(_TEXT), "csv")
+            module.calls = 0
+            assert_equal(module.convert(1, _process_cached(module, _TEXT), "csv"), expected)
+            assert_equal(module.calls, calls)
+            module.calls = 0
+            assert_equal(module.convert(1, _process_cached(module, _TEXT), "csv"), expected)
+            assert_equal(module.calls, 0)
+            # only the new sentence is parsed
+            _process_cached(module, "Dit is een zin. Nieuw hier.")
+            assert_equal(module.calls, 1)
+
+
+def test_frog_sentence_cache():
+    text = "Twee woordjes\n\nEn  drie\nwoorden hier\n\nTwee woordjes"
+    server = _fake_frog_server()
+    module = FrogLemmatizer("localhost:{}".format(server.server_address[1]))
+    with TemporaryDirectory() as module.cache_dir:
+        try:
+            expected = module.process(text)
+            assert_equal(_process_cached(module, text), expected)
+        finally:
+            server.shutdown()
+            server.server_close()
+        # all sentences are cached, so the server is not needed
+        assert_equal(_process_cached(module, text), expected)
+        r = list(csv.DictReader(StringIO(expected)))
+        assert_equal([(t["sentence"], t["offset"]) for t in r][-3:], [("3", "25"), ("4", "29"), ("4", "33")])
+
+
+def test_utf16_offsets():
+    text = "a\U0001F600b\U0001F600 c"
+    assert_equal(_utf16_offsets(text, [0, 2, 5]), [0, 3, 7])
+    assert_equal(_utf16_offsets("abc", [0, 2]), [0, 2])
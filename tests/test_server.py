@@ -116,3 +116,213 @@ def test_bulk():
         # test process without id
         ids = post_json("bulk/process", ["test1", "test2"])
         assert_equal(len(ids), 2)
+
+
+def test_jobs():
+    """Test job progress"""
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        url_base = "/api/modules/test_upper/"
+        client.post(url_base + "bulk/process?job=job1", data=json.dumps({"1": "test1", "2": "test2"}))
+        id = client.get(url_base).headers.get('ID')
+        client.put(url_base + id, data="TEST")
+
+        x = client.get(url_base + "jobs/")
+        assert_equal(json.loads(x.data.decode("utf-8")), ["job1"])
+        x = client.get(url_base + "jobs/job1")
+        status = json.loads(x.data.decode("utf-8"))
+        assert_equal((status['PENDING'], status['DONE'], status['total']), (1, 1, 2))
+        x = client.get(url_base + "jobs/job1/ids")
+        assert_equal(set(json.loads(x.data.decode("utf-8"))), {"1", "2"})
+        x = client.get(url_base + "jobs/nosuchjob")
+        assert_equal(x.status_code, 404)
+
+
+def test_bulk_ndjson():
+    """Test streaming bulk submission"""
+    from nlpipe.transport import NDJSON_MIME, chunked, encode_ndjson
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        url = "/api/modules/test_upper/bulk/process?job=job1"
+        docs = ({"id": str(i), "text": "test{}".format(i)} for i in range(100))
+        body = b"".join(chunked(encode_ndjson(docs), chunk_size=100))
+        x = client.post(url, data=body, content_type=NDJSON_MIME)
+        assert_equal(json.loads(x.data.decode("utf-8")), [str(i) for i in range(100)])
+        assert_equal(app.client.job_status("test_upper", "job1")["PENDING"], 100)
+
+        # without id
+        x = client.post(url, data=b'{"text": "test"}\n', content_type=NDJSON_MIME)
+        assert_equal(json.loads(x.data.decode("utf-8")), [get_id("test")])
+
+        x = client.post(url, data=b'{"text": "test"}\nnot json\n', content_type=NDJSON_MIME)
+        assert_equal(x.status_code, 400)
+
+        # queue for more than one module
+        url = "/api/modules/test_upper,alpino/bulk/process"
+        x = client.post(url, data=b'{"id": "x", "text": "test"}\n', content_type=NDJSON_MIME)
+        assert_equal(json.loads(x.data.decode("utf-8")), ["x"])
+        assert_equal(app.client.status("alpino", "x"), "PENDING")
+        assert_equal(client.post("/api/modules/test_upper,nomodule/bulk/process", data=b"").status_code, 404)
+
+
+def test_bulk_result_ndjson():
+    """Test streaming bulk results"""
+    from nlpipe.transport import NDJSON_MIME
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        url_base = "/api/modules/test_upper/"
+        app.client.process("test_upper", "test1", id="1")
+        app.client.process("test_upper", "test2", id="2")
+        list(app.client.get_tasks("test_upper", 2))
+        app.client.store_result("test_upper", "1", "TEST1")
+        app.client.store_error("test_upper", "2", "Failed!")
+        res = client.post(url_base + "bulk/result", data=json.dumps(["1", "2"]), headers={'Accept': NDJSON_MIME})
+        assert_equal(res.mimetype, NDJSON_MIME)
+        lines = [json.loads(line) for line in res.data.decode("utf-8").splitlines()]
+        assert_equal(lines, [{"id": "1", "result": "TEST1"}, {"id": "2", "error": "Failed!"}])
+
+
+def test_bulk_frames():
+    """Test framed bulk submission and results"""
+    from nlpipe.transport import FRAMES_MIME, encode_frames, decode_frames
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        url_base = "/api/modules/test_upper/"
+        body = b"".join(encode_frames([("1", '<doc id="1"/>\n', None), (None, "test", None)]))
+        x = client.post(url_base + "bulk/process", data=body, content_type=FRAMES_MIME)
+        assert_equal(json.loads(x.data.decode("utf-8")), ["1", get_id("test")])
+        x = client.post(url_base + "bulk/process", data=b"1 100\nshort", content_type=FRAMES_MIME)
+        assert_equal(x.status_code, 400)
+
+        id, doc = app.client.get_task("test_upper")
+        app.client.store_result("test_upper", id, doc.upper())
+        res = client.post(url_base + "bulk/result", data=json.dumps(["1", get_id("test")]),
+                          headers={'Accept': FRAMES_MIME})
+        assert_equal(res.mimetype, FRAMES_MIME)
+        frames = list(decode_frames([res.data]))
+        assert_equal(frames[0], ("1", b'<DOC ID="1"/>\n', None))
+        assert_equal(frames[1][0], get_id("test"))
+        assert_equal(frames[1][2], "ERROR")
+
+
+def test_compression():
+    """Test compressed request and response bodies"""
+    from nlpipe.transport import compress, decompressing_reader
+    from io import BytesIO
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        url_base = "/api/modules/test_upper/"
+        doc = "<doc>test</doc>\n" * 1000
+        res = client.post(url_base, data=compress(doc.encode("utf-8"), "gzip"), headers={'Content-Encoding': 'gzip'})
+        id = res.headers['ID']
+        assert_equal(id, get_id(doc))
+
+        client.get(url_base)
+        client.put(url_base + id, data=compress(doc.upper().encode("utf-8"), "gzip"),
+                   headers={'Content-Encoding': 'gzip'})
+        res = client.get(url_base + id, headers={'Accept-Encoding': 'gzip'})
+        assert_equal(res.headers['Content-Encoding'], 'gzip')
+        assert_equal(decompressing_reader(BytesIO(res.data), 'gzip').read().decode("utf-8"), doc.upper())
+
+        res = client.get(url_base + id)
+        assert 'Content-Encoding' not in res.headers
+        assert_equal(res.data.decode("utf-8"), doc.upper())
+
+        res = client.post(url_base, data=b"x", headers={'Content-Encoding': 'unknown'})
+        assert_equal(res.status_code, 415)
+
+
+def test_export():
+    """Test exporting results as a tar archive"""
+    import io
+    import tarfile
+    from nlpipe.transport import TAR_MIME
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        url_base = "/api/modules/test_upper/"
+        for i in range(5):
+            app.client.process("test_upper", "test{}".format(i), id=str(i), job="job1" if i < 3 else None)
+        list(app.client.get_tasks("test_upper", 5))
+        for i in range(4):
+            app.client.store_result("test_upper", str(i), "TEST{}".format(i))
+
+        def export(url, **kargs):
+            res = client.get(url_base + url, **kargs) if 'data' not in kargs else client.post(url_base + url, **kargs)
+            assert_equal(res.mimetype, TAR_MIME)
+            with tarfile.open(fileobj=io.BytesIO(res.data)) as tar:
+                return [(m.name, tar.extractfile(m).read().decode("utf-8")) for m in tar]
+
+        assert_equal(export("export"), [(str(i), "TEST{}".format(i)) for i in range(4)])
+        assert_equal(export("export?after=1"), [("2", "TEST2"), ("3", "TEST3")])
+        assert_equal(export("export?job=job1"), [(str(i), "TEST{}".format(i)) for i in range(3)])
+        assert_equal(export("export?format=json", data=json.dumps(["3", "4"])),
+                     [("3.json", '{"id": "3", "status": "OK", "result": "TEST3"}')])
+        assert_equal(client.get(url_base + "export?job=nonexisting").status_code, 404)
+
+
+def test_export_csv():
+    """Test exporting results as a single csv"""
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        url_base = "/api/modules/test_upper/"
+        for i in range(3):
+            app.client.process("test_upper", "test{}".format(i), id=str(i), job="job1")
+        list(app.client.get_tasks("test_upper", 3))
+        for i in range(2):
+            app.client.store_result("test_upper", str(i), "TEST{}".format(i))
+        res = client.get(url_base + "export/csv?job=job1")
+        assert_equal(res.mimetype, "text/csv")
+        assert_equal(res.data.decode("utf-8"), "id,result\n0,TEST0\n1,TEST1\n")
+        res = client.post(url_base + "export/csv", data=json.dumps(["1", "2"]))
+        assert_equal(res.data.decode("utf-8"), "id,result\n1,TEST1\n")
+
+
+def test_put_converted():
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.use_auth = False
+        client = app.test_client()
+        url_base = "/api/modules/test_upper/"
+        id = app.client.process("test_upper", "test")
+        assert_equal(client.put(url_base + id + "/converted/csv", data="x").status_code, 409)
+        app.client.get_task("test_upper")
+        app.client.store_result("test_upper", id, "TEST")
+        assert_equal(client.put(url_base + id + "/converted/csv", data="x").status_code, 204)
+        assert_equal(client.get(url_base + id + "?format=csv").data.decode("utf-8"), "x")
+
+        # without a cache, only eager formats can be stored
+        app.client.convert_cache_size = 0
+        assert_equal(client.put(url_base + id + "/converted/json", data="x").status_code, 507)
+        assert_equal(client.put(url_base + id + "/converted/json?eager=1", data="y").status_code, 204)
+        assert_equal(client.get(url_base + id + "?format=json").data.decode("utf-8"), "y")
+        app.client.store_error("test_upper", id, "error")
+        assert_equal(app.client.get_converted("test_upper", id, "json"), None)
+
+
+def test_process_results():
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root, pipelines={})
+        app.use_auth = False
+        client = app.test_client()
+        app.client.process("test_upper", "text", id="1")
+        app.client.store_result("test_upper", app.client.get_task("test_upper")[0], "TEXT")
+        res = client.post("/api/modules/alpino/bulk/process_results?from=test_upper&job=job1",
+                          data=json.dumps(["1", "2"]))
+        assert_equal(json.loads(res.data.decode("utf-8")), ["1"])
+        assert_equal(app.client.get_task("alpino"), ("1", "TEXT"))
+        res = client.post("/api/modules/alpino/bulk/process_results?from=nomodule", data=json.dumps(["1"]))
+        assert_equal(res.status_code, 404)
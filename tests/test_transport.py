@@ -0,0 +1,25 @@
+from nose.tools import assert_equal, assert_raises
+
+from nlpipe.transport import encode_frames, decode_frames, encode_ndjson, decode_ndjson, chunked
+
+
+def _split(data, size):
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+
+def test_frames():
+    frames = [("1", '<doc a="1">\n\t"quoted"</doc>', None), (None, "", None), ("id with spaces/%", "ë€", "ERROR")]
+    data = b"".join(encode_frames(frames))
+    expected = [(id, text.encode("utf-8"), status) for (id, text, status) in frames]
+    for size in (1, 3, 1000):
+        assert_equal(list(decode_frames(_split(data, size))), expected)
+    assert_equal(list(decode_frames([])), [])
+    assert_raises(ValueError, list, decode_frames([data[:-1]]))
+    assert_raises(ValueError, list, decode_frames([b"1 x\n"]))
+
+
+def test_ndjson():
+    objects = [{"id": str(i), "text": "line\n{}".format(i)} for i in range(100)]
+    chunks = list(chunked(encode_ndjson(objects), chunk_size=100))
+    assert len(chunks) > 1
+    assert_equal(list(decode_ndjson(_split(b"".join(chunks), 7))), objects)
@@ -26,3 +26,82 @@ def test_worker():
         assert_equal(c.result(m.name, id), "TEST")
 
         w.terminate()
+
+
+class FlakyModule(TestUpper):
+    """Module that is offline until it has been probed twice"""
+    name = "test_flaky"
+
+    def __init__(self):
+        self.probes = 0
+
+    def check_status(self):
+        self.probes += 1
+        if self.probes <= 2:
+            raise Exception("offline")
+
+    def process(self, text):
+        if self.probes <= 2:
+            raise Exception("offline")
+        return super().process(text)
+
+
+def test_circuit_breaker():
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        m = FlakyModule()
+        w = Worker(c, m, quit=True)
+        w.sleep_timeout = 0.01
+
+        id = c.process(m.name, "test")
+        w.run()  # in this process, quits when done
+        assert_equal(m.probes, 3)
+        assert_equal(c.status(m.name, id), "DONE")
+        assert_equal(c.result(m.name, id), "TEST")
+
+
+class BadDocModule(TestUpper):
+    """Module that is available, but cannot process documents containing 'bad'"""
+    name = "test_baddoc"
+
+    def check_status(self):
+        pass
+
+    def process(self, text):
+        if "bad" in text:
+            raise ValueError("cannot process {text!r}".format(**locals()))
+        return super().process(text)
+
+
+def test_circuit_breaker_bad_docs():
+    """Documents that fail while the backend is available are stored as errors without pausing the worker"""
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        m = BadDocModule()
+        w = Worker(c, m, quit=True)
+        w.max_failures = 1
+        w.wait_until_healthy = lambda: None
+        ids = [c.process(m.name, "bad {i}".format(**locals())) for i in range(3)]
+        good = c.process(m.name, "good")
+        w.run()
+        assert_equal([c.status(m.name, id) for id in ids], ["ERROR"] * 3)
+        assert_equal(c.result(m.name, good), "GOOD")
+
+
+def test_eager_formats():
+    with TemporaryDirectory() as dir:
+        # eager formats are stored even if the cache is disabled
+        c = FSClient(dir, convert_cache_size=0)
+        m = TestUpper()
+        m.eager_formats = ["csv", "unknown_format"]
+        w = Worker(c, m, quit=True)
+        id = c.process(m.name, "test")
+        w.run()
+        assert_equal(c.status(m.name, id), "DONE")
+        assert_equal(c.get_converted(m.name, id, "csv"), "id,result\n{id},TEST\n".format(**locals()))
+        assert_equal(c.get_converted(m.name, id, "unknown_format"), None)
+
+        # and removed when the result is stored again
+        c.store_result(m.name, id, "NEW")
+        assert_equal(c.get_converted(m.name, id, "csv"), None)
+        assert_equal(c.result(m.name, id, "csv"), "id,result\n{id},NEW\n".format(**locals()))